@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+
+"""\
+This compares the classifiers over everything that mark_quotes.py has marked.
+For every pair of classifiers, it reports how much of the text they agree on
+and Cohen's kappa, and then it lists the spans where they disagree most.
+
+Agreement is measured over characters. The quoted spans of each classifier
+come from its standoff sidecars (see standoff.py), which are exact. For
+plain caret text, a quoted span runs from a caret to the end of its sentence
+(the first sentence-ending punctuation directly followed by more text, since
+marked text drops the space between sentences) or to the next caret, so
+it's approximate.
+
+Each marked file is read once, and all of the interval work is done on the
+elementary segments between span boundaries, so the whole marked corpus
+takes seconds.
+
+usage: agreement.py [-n HOT_SPOTS] MARKED_DIR
+"""
+
+
+import argparse
+from collections import defaultdict
+import itertools
+import os
+import re
+import sys
+
+import numpy as np
+
+import standoff
+
+
+HOT_SPOTS = 20
+SENTENCE_END = re.compile(r'[.!?]+[\'"’”)\]]*(?=\S)')
+
+
+def caret_spans(text):
+    """\
+    This returns the quoted spans in caret text, as offsets into the text
+    with the carets taken out, and the length of that text.
+    """
+    carets = np.array([m.start() for m in re.finditer(r'\^', text)],
+                      dtype=np.int64)
+    starts = carets - np.arange(len(carets))
+    stripped = text.replace('^', '')
+    length = len(stripped)
+    ends = np.array([m.end() for m in SENTENCE_END.finditer(stripped)] +
+                    [length], dtype=np.int64)
+    sentence_end = ends[np.minimum(np.searchsorted(ends, starts, 'right'),
+                                   len(ends) - 1)]
+    next_start = np.append(starts[1:], length)
+    spans = np.column_stack((starts, np.minimum(sentence_end, next_start)))
+    return (spans[spans[:, 1] > spans[:, 0]], length)
+
+
+def read_marked(path):
+    """\
+    This returns (spans, length, kind) for a marked file or sidecar. The
+    length is None for sidecars that don't record it.
+    """
+    if standoff.is_sidecar(path):
+        (spans, length) = standoff.read_sidecar(path)
+        return (spans, length, 'source')
+    with open(path) as fin:
+        (spans, length) = caret_spans(fin.read())
+    return (spans, length, 'caret')
+
+
+def find_marked(marked_dir):
+    """\
+    This walks a marked_* folder laid out like mark_quotes.py writes it
+    (MODEL/trained_on_CORPUS/NAME/DOCUMENT) and returns {document:
+    {classifier: path}}.
+    """
+    found = defaultdict(dict)
+    for (root, _, files) in os.walk(marked_dir):
+        rel = os.path.relpath(root, marked_dir)
+        parts = rel.split(os.sep)
+        if len(parts) != 3:
+            continue
+        (model, corpus, name) = parts
+        classifier = '/'.join((model, re.sub(r'^trained_on_', '', corpus),
+                               name))
+        for fn in sorted(files):
+            if fn.startswith('.'):
+                continue
+            found[standoff.source_name(fn)][classifier] = os.path.join(root,
+                                                                        fn)
+    return found
+
+
+def segment_membership(span_lists, length):
+    """\
+    This cuts [0, length) into elementary segments at every span boundary
+    and returns (bounds, weights, members): the segment boundaries, their
+    lengths, and a classifier x segment boolean array of which classifiers
+    quoted each one.
+    """
+    bounds = np.unique(np.concatenate(
+        [np.array([0, length], dtype=np.int64)] +
+        [np.clip(spans.ravel(), 0, length) for spans in span_lists]
+    ))
+    seg_starts = bounds[:-1]
+    weights = np.diff(bounds)
+    members = np.zeros((len(span_lists), len(seg_starts)), dtype=bool)
+    for (i, spans) in enumerate(span_lists):
+        spans = standoff.merge_spans(spans)
+        if len(spans) == 0:
+            continue
+        idx = np.searchsorted(spans[:, 0], seg_starts, 'right') - 1
+        inside = idx >= 0
+        inside[inside] = seg_starts[inside] < spans[idx[inside], 1]
+        members[i] = inside
+    return (bounds, weights, members)
+
+
+def pair_counts(weights, members):
+    """\
+    This returns a (k, k, 2, 2) array of the characters each pair of
+    classifiers labels (quoted, quoted), (quoted, not), and so on.
+    """
+    quoted = members.astype(np.float64)
+    unquoted = 1 - quoted
+    counts = np.empty((len(members), len(members), 2, 2))
+    for (a, ma) in ((0, unquoted), (1, quoted)):
+        for (b, mb) in ((0, unquoted), (1, quoted)):
+            counts[:, :, a, b] = (ma * weights) @ mb.T
+    return counts
+
+
+def kappa(counts):
+    """This returns Cohen's kappa for a 2 x 2 table of counts."""
+    total = counts.sum()
+    if total == 0:
+        return float('nan')
+    observed = np.trace(counts) / total
+    expected = (counts.sum(axis=1) @ counts.sum(axis=0)) / total ** 2
+    if expected == 1:
+        return 1.0
+    return (observed - expected) / (1 - expected)
+
+
+def hot_spots(bounds, weights, members):
+    """\
+    This returns the runs of segments where the classifiers disagree, as
+    (first, last, disagreement) arrays: the runs' first segments, the
+    segments just past them, and how evenly the classifiers split over each
+    run, from 0 (unanimous) to 1 (half and half).
+    """
+    votes = members.sum(axis=0)
+    k = len(members)
+    disputed = (votes > 0) & (votes < k)
+    edges = np.diff(np.concatenate(([0], disputed.astype(np.int8), [0])))
+    first = np.flatnonzero(edges == 1)
+    last = np.flatnonzero(edges == -1)
+    if k == 0:
+        return (first, last, np.zeros(len(first)))
+    split = 1 - np.abs(2 * votes - k) / k
+    weighted = np.concatenate(([0], np.cumsum(split * weights)))
+    lengths = bounds[last] - bounds[first]
+    return (first, last, (weighted[last] - weighted[first]) / lengths)
+
+
+def compare(marked_dir):
+    """\
+    This compares every pair of classifiers over every document in
+    `marked_dir` and returns (classifiers, counts, spots), where counts is
+    the (k, k, 2, 2) table summed over the documents and spots is a list of
+    (document, start, end, disagreement, quoted_by) rows.
+    """
+    found = find_marked(marked_dir)
+    classifiers = sorted(set(name for by_doc in found.values()
+                             for name in by_doc))
+    index = dict((name, i) for (i, name) in enumerate(classifiers))
+    counts = np.zeros((len(classifiers), len(classifiers), 2, 2))
+    spots = []
+
+    for (document, paths) in sorted(found.items()):
+        names = sorted(paths)
+        marked = [read_marked(paths[name]) for name in names]
+        if len(set(kind for (_, _, kind) in marked)) > 1:
+            print('{}: skipping, it mixes caret text and sidecars'.format(
+                document), file=sys.stderr)
+            continue
+        lengths = [length for (_, length, _) in marked if length is not None]
+        length = max(lengths) if lengths else max(
+            [int(spans[:, 1].max()) for (spans, _, _) in marked
+             if len(spans)] + [0])
+        (bounds, weights, members) = segment_membership(
+            [spans for (spans, _, _) in marked], length)
+        doc_index = [index[name] for name in names]
+        counts[np.ix_(doc_index, doc_index)] += pair_counts(weights, members)
+        (first, last, splits) = hot_spots(bounds, weights, members)
+        for (i, j, split) in zip(first.tolist(), last.tolist(),
+                                 splits.tolist()):
+            quoted_by = [names[n] for n in
+                         np.flatnonzero(members[:, i:j].any(axis=1))]
+            spots.append((document, int(bounds[i]), int(bounds[j]), split,
+                          quoted_by))
+
+    spots.sort(key=lambda spot: (spot[2] - spot[1]) * spot[3], reverse=True)
+    return (classifiers, counts, spots)
+
+
+def print_report(classifiers, counts, spots, n_spots=HOT_SPOTS):
+    print('{:<48} {:<48} {:>9} {:>7}'.format('A', 'B', 'Agreement', 'Kappa'))
+    for (a, b) in itertools.combinations(range(len(classifiers)), 2):
+        table = counts[a, b]
+        total = table.sum()
+        agreement = np.trace(table) / total if total else float('nan')
+        print('{:<48} {:<48} {:>9.4f} {:>7.4f}'.format(
+            classifiers[a], classifiers[b], agreement, kappa(table)))
+
+    print()
+    print('Hot spots')
+    for (document, start, end, split, quoted_by) in spots[:n_spots]:
+        print('{} {}-{} ({:.2f}): quoted by {}'.format(
+            document, start, end, split, ', '.join(quoted_by)))
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('marked_dir', metavar='MARKED_DIR',
+                        help='The marked_* folder that mark_quotes.py '
+                             'wrote.')
+    parser.add_argument('-n', '--hot-spots', dest='hot_spots', type=int,
+                        default=HOT_SPOTS,
+                        help='How many disagreement spans to list. '
+                             'Default = {}.'.format(HOT_SPOTS))
+
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    (classifiers, counts, spots) = compare(args.marked_dir)
+    print_report(classifiers, counts, spots, args.hot_spots)
+
+
+if __name__ == '__main__':
+    main()
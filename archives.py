@@ -0,0 +1,130 @@
+"""\
+Readers for corpora kept in archives, the way local Project Gutenberg
+mirrors are: .zip files, gzipped texts, and tar files. Documents are read
+straight out of the archives, one at a time, without extracting anything.
+
+Each document is named by the archive's path joined with its path inside
+the archive (corpus/12345.zip/12345.txt), or by the archive's path less
+.gz for a gzipped text. Plain files are read and decoded the same way, so
+a folder can mix texts and archives.
+
+Mirrors have the odd truncated or corrupt archive. Given an `errors`
+callback, the readers hand it each file they can't read, and go on to the
+next one.
+"""
+
+
+import gzip
+import hashlib
+import os
+import tarfile
+import zipfile
+import zlib
+
+
+TAR_SUFFIXES = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz')
+ARCHIVE_SUFFIXES = TAR_SUFFIXES + ('.zip', '.gz')
+
+# What reading a damaged archive or file raises.
+READ_ERRORS = (OSError, EOFError, ValueError, zlib.error, tarfile.TarError,
+               zipfile.BadZipFile)
+
+
+def is_archive(path):
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def is_hidden(name):
+    return os.path.basename(name).startswith('.')
+
+
+def decode(data):
+    """\
+    This decodes a document read out of an archive or a plain file.
+    Gutenberg's older files aren't all UTF-8, so anything that isn't is
+    replaced rather than stopping the run.
+    """
+    return data.decode('utf8', errors='replace')
+
+
+def archive_documents(path, keep=None, errors=None):
+    """\
+    This yields (name, text) for each file in an archive. If `keep` is
+    given, only the documents whose names it returns True for are read. A
+    zip file's members are read one at a time, so with `errors`, one that's
+    damaged is handed to it as (name, exception) and skipped.
+    """
+    lower = path.lower()
+    keep = keep or (lambda name: True)
+    if lower.endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                name = os.path.join(path, info.filename)
+                if info.is_dir() or is_hidden(name) or not keep(name):
+                    continue
+                try:
+                    with archive.open(info) as fin:
+                        data = fin.read()
+                except READ_ERRORS as exc:
+                    if errors is None:
+                        raise
+                    errors(name, exc)
+                    continue
+                yield (name, decode(data))
+    elif lower.endswith(TAR_SUFFIXES):
+        # Stream mode reads the archive front to back, without seeking.
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                name = os.path.join(path, member.name)
+                if not member.isfile() or is_hidden(name) or not keep(name):
+                    continue
+                yield (name, decode(archive.extractfile(member).read()))
+    else:
+        name = path[:-len('.gz')]
+        if keep(name):
+            with gzip.open(path, 'rb') as fin:
+                yield (name, decode(fin.read()))
+
+
+def iter_documents(path, keep=None, errors=None, failed=()):
+    """\
+    This yields (name, text) for every document in `path`, which can be a
+    plain file, an archive, or a folder of either, walked in sorted order.
+
+    With `errors`, a file or archive that can't be read is handed to it as
+    (path, exception), and the walk goes on; the documents already read out
+    of a damaged archive are kept. Paths in `failed` aren't read at all.
+    """
+    if path in failed:
+        return
+    if os.path.isdir(path):
+        for (root, dirs, files) in os.walk(path):
+            dirs.sort()
+            for fn in sorted(files):
+                if not is_hidden(fn):
+                    for document in iter_documents(os.path.join(root, fn),
+                                                   keep, errors, failed):
+                        yield document
+        return
+    try:
+        if is_archive(path):
+            for document in archive_documents(path, keep, errors):
+                yield document
+        elif keep is None or keep(path):
+            # Each document is only read once, so this skips the docstore
+            # cache.
+            with open(path, 'rb') as fin:
+                yield (path, decode(fin.read()))
+    except READ_ERRORS as exc:
+        if errors is None:
+            raise
+        errors(path, exc)
+
+
+def shard_of(name, shards):
+    """\
+    This assigns a document to one of `shards` shards by a hash of its name,
+    so every run splits the corpus the same way.
+    """
+    digest = hashlib.sha1(name.encode('utf8')).hexdigest()
+    return int(digest[:12], 16) % shards
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+
+"""\
+This runs the quotation statistics, or marking with one classifier, over a
+whole local archive of books: a folder of texts, .zip files, gzipped texts,
+or tar files, read without extracting them (see archives.py).
+
+The run can be split into shards with --shard I/N, and each shard can run
+on its own machine or process. Every finished document is logged to a JSON
+lines file for its shard as soon as it's done, and a shard that's run again
+skips the documents already in its log, so a run that's stopped can pick up
+where it left off. A document or archive that can't be read or processed is
+logged with its error instead, so it's skipped the next time too.
+
+With --classifier, the marked documents are written under OUTPUT_DIR the
+same way mark_quotes.py lays them out, with the documents' paths inside the
+input kept, since archives often reuse file names.
+
+usage: batch.py INPUT OUTPUT_DIR [--shard I/N] [-c CLASSIFIER]
+                [-f text|spans|npy] [-j JOBS]
+"""
+
+
+import argparse
+import functools
+import itertools
+import json
+from multiprocessing import Pool
+import os
+import sys
+
+import archives
+import docstore
+from fset_manager import Current, build_tagger
+from mark_quotes import (classifier_parts, insert_quotes_many,
+                         load_classifier, write_marked)
+import ps
+import standoff
+import train_quotes
+
+
+# How many documents to hand the pool at a time, per process, so that the
+# reader doesn't get ahead of the workers and hold the whole archive.
+BATCH_SIZE = 4
+
+_WORKER = {}
+
+
+def parse_shard(value):
+    """This parses I/N into (I, N), with shards counted from zero."""
+    try:
+        (shard, shards) = [int(part) for part in value.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('Shards are given as I/N.')
+    if not 0 <= shard < shards:
+        raise argparse.ArgumentTypeError(
+            'The shard has to be from 0 to {}.'.format(shards - 1))
+    return (shard, shards)
+
+
+def log_path(output, task, shard, shards):
+    return os.path.join(output, '{}.{}-of-{}.jsonl'.format(task, shard,
+                                                           shards))
+
+
+def load_done(path):
+    """\
+    This returns the names of the documents already in a shard's log. If
+    the last line was cut off when a run was stopped, it's dropped from the
+    file, so new lines aren't appended to it.
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+    good = 0
+    with open(path, 'rb') as fin:
+        for line in fin:
+            try:
+                done.add(json.loads(line.decode('utf8'))['file'])
+            except (ValueError, KeyError):
+                break
+            good += len(line)
+    if good < os.path.getsize(path):
+        with open(path, 'r+b') as fout:
+            fout.truncate(good)
+    return done
+
+
+def error_row(name, exc):
+    return {'file': name, 'error': '{}: {}'.format(type(exc).__name__, exc)}
+
+
+def logs_errors(work):
+    """\
+    This wraps a worker function so that a document it fails on is logged
+    with the error, rather than the error stopping the whole shard.
+    """
+    @functools.wraps(work)
+    def guarded(document):
+        try:
+            return work(document)
+        except Exception as exc:
+            return error_row(document[0], exc)
+    return guarded
+
+
+@logs_errors
+def document_stats(document):
+    """This returns the statistics for one (name, text) document."""
+    (name, text) = document
+    stats = ps.text_stats(docstore.clean_text(text))
+    stats['file'] = name
+    return stats
+
+
+def marked_path(output, input_dir, classifier_path, name):
+    """\
+    This returns where to write the marked version of a document, keeping
+    its path inside the input, and creates the folders for it.
+    """
+    (model, corpus, classifier_name) = classifier_parts(classifier_path)
+    input_name = os.path.basename(os.path.normpath(input_dir))
+    if not os.path.isdir(input_dir):
+        input_dir = os.path.dirname(input_dir)
+    path = os.path.join(output, 'marked_' + input_name, model,
+                        'trained_on_' + corpus, classifier_name,
+                        os.path.relpath(name, input_dir))
+    out_dir = os.path.dirname(path)
+    if not os.path.exists(out_dir):
+        os.makedirs(out_dir)
+    return path
+
+
+def batches(iterable, size):
+    """This yields lists of up to `size` items from an iterable."""
+    iterable = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterable, size))
+        if not batch:
+            return
+        yield batch
+
+
+def init_worker(args, tagger, classifier):
+    """\
+    This sets up a worker process for marking. With the fork start method,
+    the tagger and classifier are inherited from the parent.
+    """
+    _WORKER['args'] = args
+    _WORKER['tagger'] = tagger
+    _WORKER['classifier'] = classifier
+    _WORKER['manager'] = Current(train_quotes.is_quote, train_quotes.is_word)
+
+
+@logs_errors
+def mark_document(document):
+    """This marks one (name, text) document and returns its log row."""
+    (name, text) = document
+    args = _WORKER['args']
+    manager = _WORKER['manager']
+    fsets = [manager.get_training_features(sentence)
+             for sentence in manager.tag_text(text, _WORKER['tagger'])]
+    quotes = list(insert_quotes_many(_WORKER['classifier'], fsets))
+    output_path = marked_path(args.output, args.input, args.classifier, name)
+    write_marked(output_path, text, quotes, args.format, name)
+    return {
+        'file': name,
+        'sentences': len(fsets),
+        'quoted': len(standoff.quote_spans(quotes)),
+    }
+
+
+def run(args):
+    """\
+    This runs one shard, logging each document as it finishes, and returns
+    the number of documents done in this run.
+    """
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    (shard, shards) = args.shard
+    task = 'stats' if args.classifier is None else 'marked'
+    path = log_path(args.output, task, shard, shards)
+    done = load_done(path)
+    print('{}: {} documents already done'.format(path, len(done)))
+
+    def keep(name):
+        return archives.shard_of(name, shards) == shard and name not in done
+
+    # Files and archives that the reader can't read, logged between batches.
+    unreadable = []
+    documents = archives.iter_documents(
+        args.input, keep,
+        lambda name, exc: unreadable.append(error_row(name, exc)), done,
+    )
+    if args.classifier is None:
+        pool = Pool(args.jobs)
+        work = document_stats
+    else:
+        pool = Pool(args.jobs, init_worker,
+                    (args, build_tagger(), load_classifier(args.classifier)))
+        work = mark_document
+
+    n = 0
+    size = BATCH_SIZE * (args.jobs or os.cpu_count() or 1)
+    with pool, open(path, 'a') as fout:
+        # The empty batch at the end logs anything unreadable found after
+        # the last documents.
+        for batch in itertools.chain(batches(documents, size), [[]]):
+            rows = itertools.chain(unreadable, pool.imap_unordered(work, batch))
+            for row in rows:
+                fout.write(json.dumps(row) + '\n')
+                fout.flush()
+                if 'error' in row:
+                    print('{}: {}'.format(row['file'], row['error']))
+                else:
+                    n += 1
+                    print(row['file'])
+            del unreadable[:]
+    return n
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('input', metavar='INPUT',
+                        help='A folder of texts and archives, or one '
+                             'archive.')
+    parser.add_argument('output', metavar='OUTPUT_DIR',
+                        help='Where to write the logs and marked documents.')
+    parser.add_argument('--shard', dest='shard', type=parse_shard,
+                        default=(0, 1), metavar='I/N',
+                        help='Only do the documents in shard I of N, '
+                             'counting from 0. Default = 0/1.')
+    parser.add_argument('-c', '--classifier', dest='classifier',
+                        help='Mark the documents with this classifier '
+                             'instead of computing their statistics.')
+    parser.add_argument('-f', '--format', dest='format', default='text',
+                        choices=['text'] + sorted(standoff.FORMATS),
+                        help='How to write the marked documents. '
+                             'Default = text.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='The number of worker processes. '
+                             'Default = one per CPU.')
+
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    print('{} documents done'.format(run(args)))
+
+
+if __name__ == '__main__':
+    main()
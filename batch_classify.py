@@ -0,0 +1,401 @@
+"""\
+Batch prediction for the classifiers that train_quotes produces.
+
+Calling `classify` once per feature set walks the NLTK object graph for every
+sentence. Instead, this compiles NaiveBayes and DecisionTree classifiers into
+flat NumPy arrays once and then labels many feature sets at a time. Anything
+else falls back on the classifier's own `classify_many`.
+"""
+
+
+import weakref
+
+import nltk
+import numpy as np
+from scipy import sparse
+
+
+_COMPILED = weakref.WeakKeyDictionary()
+
+
+def label_order(labels):
+    """\
+    This returns the labels in the order that NLTK breaks ties in: when two
+    labels score the same, `DictionaryProbDist.max` picks the larger one, so
+    the compiled models keep the labels sorted and take the last maximum.
+    """
+    labels = list(labels)
+    try:
+        return sorted(labels)
+    except TypeError:
+        return labels
+
+
+def last_argmax(scores):
+    """This returns the index of the last maximum in each row of scores."""
+    width = scores.shape[1]
+    return width - 1 - np.argmax(scores[:, ::-1], axis=1)
+
+
+class CompiledNaiveBayes(object):
+    """\
+    A NaiveBayesClassifier flattened into a matrix of log probabilities, one
+    row per (feature name, feature value) pair and one column per label.
+
+    Each feature name also gets an extra row holding the log probability of a
+    value that wasn't seen in training, so the results match
+    `NaiveBayesClassifier.classify` exactly.
+    """
+
+    def __init__(self, labels, prior, weights, pair_index, fname_index):
+        self.labels = labels
+        self.prior = prior
+        self.weights = weights
+        self.pair_index = pair_index
+        self.fname_index = fname_index
+
+    @classmethod
+    def from_classifier(cls, classifier):
+        """This builds the arrays from a trained NaiveBayesClassifier."""
+        labels = label_order(classifier._labels)
+        probdists = classifier._feature_probdist
+        prior = np.array([classifier._label_probdist.logprob(label)
+                          for label in labels])
+
+        fnames = []
+        fname_index = {}
+        fvals = {}
+        for (_, fname), probdist in probdists.items():
+            if fname not in fname_index:
+                fname_index[fname] = len(fnames)
+                fnames.append(fname)
+                fvals[fname] = {}
+            for fval in probdist.samples():
+                fvals[fname].setdefault(fval, len(fvals[fname]))
+
+        pair_index = {}
+        rows = []
+        for fname in fnames:
+            for fval in fvals[fname]:
+                pair_index[(fname, fval)] = len(rows)
+                rows.append((fname, fval))
+
+        unseen = object()
+        weights = np.empty((len(rows) + len(fnames), len(labels)))
+        for (j, label) in enumerate(labels):
+            for (i, (fname, fval)) in enumerate(rows):
+                probdist = probdists.get((label, fname))
+                weights[i, j] = (-np.inf if probdist is None
+                                 else probdist.logprob(fval))
+            for (i, fname) in enumerate(fnames):
+                probdist = probdists.get((label, fname))
+                weights[len(rows) + i, j] = (-np.inf if probdist is None
+                                             else probdist.logprob(unseen))
+
+        return cls(labels, prior, weights, pair_index, fname_index)
+
+    def encode(self, featuresets):
+        """\
+        This turns a sequence of feature sets into a sparse indicator matrix
+        over the rows of `weights`. Feature names that the classifier never
+        saw are dropped, just as `NaiveBayesClassifier.prob_classify` does.
+        """
+        n_pairs = len(self.pair_index)
+        indptr = [0]
+        indices = []
+        for featureset in featuresets:
+            for (fname, fval) in featureset.items():
+                fi = self.fname_index.get(fname)
+                if fi is None:
+                    continue
+                col = self.pair_index.get((fname, fval))
+                indices.append(n_pairs + fi if col is None else col)
+            indptr.append(len(indices))
+        data = np.ones(len(indices))
+        return sparse.csr_matrix(
+            (data, np.array(indices, dtype=np.int64), np.array(indptr)),
+            shape=(len(indptr) - 1, self.weights.shape[0]),
+        )
+
+    def log_scores(self, featuresets):
+        """\
+        This returns the unnormalized log probability (base 2) of each label
+        for each feature set.
+        """
+        matrix = self.encode(featuresets)
+        return np.asarray(matrix @ self.weights) + self.prior
+
+    def classify_many(self, featuresets):
+        scores = self.log_scores(featuresets)
+        return [self.labels[i] for i in last_argmax(scores)]
+
+    def prob_many(self, featuresets):
+        """\
+        This returns the probability of each label (in `labels` order) for
+        each feature set, like `NaiveBayesClassifier.prob_classify`.
+        """
+        scores = self.log_scores(featuresets)
+        best = scores.max(axis=1, keepdims=True)
+        probs = np.exp2(scores - np.where(np.isfinite(best), best, 0))
+        return probs / probs.sum(axis=1, keepdims=True)
+
+
+class CompiledDecisionTree(object):
+    """\
+    A DecisionTreeClassifier flattened into node arrays. Every node has a
+    feature (-1 for leaves), a label, and a default child (-1 for none), and
+    `children[node, value]` gives the child for a feature value (-1 for none).
+    Classification walks all of the feature sets down the tree a level at a
+    time.
+    """
+
+    def __init__(self, labels, node_fname, node_label, node_default, children,
+                 fname_index, value_index):
+        self.labels = labels
+        self.node_fname = node_fname
+        self.node_label = node_label
+        self.node_default = node_default
+        self.children = children
+        self.fname_index = fname_index
+        self.value_index = value_index
+
+    @classmethod
+    def from_classifier(cls, classifier):
+        """This builds the arrays from a trained DecisionTreeClassifier."""
+        nodes = [classifier]
+        edges = []
+        fname_index = {}
+        value_index = {}
+        label_index = {}
+        fnames = []
+        defaults = []
+
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            label_index.setdefault(node._label, None)
+            if node._fname is not None:
+                fname_index.setdefault(node._fname, len(fname_index))
+                for (fval, child) in (node._decisions or {}).items():
+                    value_index.setdefault(fval, len(value_index))
+                    edges.append((i, value_index[fval], len(nodes)))
+                    nodes.append(child)
+            if node._default is not None:
+                defaults.append((i, len(nodes)))
+                nodes.append(node._default)
+            fnames.append(node._fname)
+            i += 1
+
+        labels = label_order(label_index)
+        label_index = dict((label, j) for (j, label) in enumerate(labels))
+
+        node_fname = np.array(
+            [-1 if fname is None else fname_index[fname] for fname in fnames],
+            dtype=np.int64,
+        )
+        node_label = np.array([label_index[node._label] for node in nodes],
+                              dtype=np.int64)
+        node_default = np.full(len(nodes), -1, dtype=np.int64)
+        for (parent, child) in defaults:
+            node_default[parent] = child
+        children = np.full((len(nodes), max(len(value_index), 1)), -1,
+                           dtype=np.int64)
+        for (parent, value, child) in edges:
+            children[parent, value] = child
+
+        return cls(labels, node_fname, node_label, node_default, children,
+                   fname_index, value_index)
+
+    def encode(self, featuresets):
+        """\
+        This returns a matrix of value indexes, one row per feature set and
+        one column per feature used in the tree. Missing features are looked
+        up as None, like `featureset.get` does, and values that never appear
+        in the tree are -1.
+        """
+        featuresets = list(featuresets)
+        missing = self.value_index.get(None, -1)
+        values = np.full((len(featuresets), max(len(self.fname_index), 1)),
+                         missing, dtype=np.int64)
+        rows = []
+        cols = []
+        vals = []
+        for (i, featureset) in enumerate(featuresets):
+            for (fname, fval) in featureset.items():
+                j = self.fname_index.get(fname)
+                if j is not None:
+                    rows.append(i)
+                    cols.append(j)
+                    vals.append(self.value_index.get(fval, -1))
+        values[rows, cols] = vals
+        return values
+
+    def predict(self, featuresets):
+        """This returns the index of the label for each feature set."""
+        values = self.encode(featuresets)
+        current = np.zeros(values.shape[0], dtype=np.int64)
+        active = np.flatnonzero(self.node_fname[current] >= 0)
+
+        while len(active):
+            nodes = current[active]
+            value = values[active, self.node_fname[nodes]]
+            child = np.where(
+                value >= 0,
+                self.children[nodes, np.maximum(value, 0)],
+                -1,
+            )
+            child = np.where(child >= 0, child, self.node_default[nodes])
+            moved = child >= 0
+            current[active[moved]] = child[moved]
+            active = active[moved]
+            active = active[self.node_fname[current[active]] >= 0]
+
+        return self.node_label[current]
+
+    def classify_many(self, featuresets):
+        return [self.labels[i] for i in self.predict(featuresets)]
+
+    def prob_many(self, featuresets):
+        """\
+        Decision trees don't have probabilities, so this gives the label
+        each feature set is classified as a probability of one.
+        """
+        return one_hot(self.predict(featuresets), len(self.labels))
+
+
+def one_hot(indexes, width):
+    """This returns a row for each index with a 1 in that column."""
+    rows = np.zeros((len(indexes), width))
+    rows[np.arange(len(indexes)), indexes] = 1
+    return rows
+
+
+def compile_classifier(classifier):
+    """\
+    This returns the compiled, array-based version of a classifier, or the
+    classifier itself if there's no compiled version for its class. Compiled
+    classifiers are cached for as long as the original is alive.
+    """
+    if isinstance(classifier, (CompiledNaiveBayes, CompiledDecisionTree)):
+        return classifier
+    try:
+        return _COMPILED[classifier]
+    except (KeyError, TypeError):
+        pass
+
+    if isinstance(classifier, nltk.NaiveBayesClassifier):
+        compiled = CompiledNaiveBayes.from_classifier(classifier)
+    elif isinstance(classifier, nltk.DecisionTreeClassifier):
+        compiled = CompiledDecisionTree.from_classifier(classifier)
+    else:
+        return classifier
+
+    _COMPILED[classifier] = compiled
+    return compiled
+
+
+def classify_many(classifier, featuresets):
+    """\
+    This returns the labels for all of the feature sets, the same as calling
+    `classifier.classify` on each one.
+    """
+    featuresets = list(featuresets)
+    if not featuresets:
+        return []
+    return list(compile_classifier(classifier).classify_many(featuresets))
+
+
+def accuracy(classifier, gold):
+    """\
+    This is a drop-in replacement for `nltk.classify.accuracy` that
+    classifies all of the gold feature sets in one batch.
+    """
+    results = classify_many(classifier, (fs for (fs, _) in gold))
+    correct = [label == result
+               for ((_, label), result) in zip(gold, results)]
+    if correct:
+        return sum(correct) / len(correct)
+    else:
+        return 0
+
+
+def classifier_labels(classifier):
+    """This returns the labels that a classifier can give."""
+    compiled = compile_classifier(classifier)
+    if isinstance(compiled, (CompiledNaiveBayes, CompiledDecisionTree)):
+        return list(compiled.labels)
+    return classifier.labels()
+
+
+def prob_classify_many(classifier, featuresets, labels):
+    """\
+    This returns an array with the probability of each of `labels` for each
+    feature set. Classifiers that can't give probabilities give their label
+    a probability of one.
+    """
+    featuresets = list(featuresets)
+    label_index = dict((label, i) for (i, label) in enumerate(labels))
+    compiled = compile_classifier(classifier)
+    if isinstance(compiled, (CompiledNaiveBayes, CompiledDecisionTree)):
+        probs = np.zeros((len(featuresets), len(labels)))
+        if featuresets:
+            columns = [label_index[label] for label in compiled.labels]
+            probs[:, columns] = compiled.prob_many(featuresets)
+        return probs
+
+    try:
+        probdists = classifier.prob_classify_many(featuresets)
+    except NotImplementedError:
+        return one_hot([label_index[label] for label in
+                        classifier.classify_many(featuresets)], len(labels))
+    return np.array([[probdist.prob(label) for label in labels]
+                     for probdist in probdists]).reshape(
+                         (len(featuresets), len(labels)))
+
+
+def classify_and_prob_many(classifier, featuresets):
+    """\
+    This returns (labels, probs, order): the label for each feature set, the
+    `prob_classify_many` array for them, and the labels that its columns
+    are for. The labels are the most probable ones, with ties going to the
+    larger label, so the feature sets are only classified once.
+    """
+    order = label_order(classifier_labels(classifier))
+    probs = prob_classify_many(classifier, featuresets, order)
+    return ([order[i] for i in last_argmax(probs)], probs, order)
+
+
+ENSEMBLE_METHODS = ('vote', 'average')
+
+
+def ensemble_classify_many(classifiers, featuresets, method='vote',
+                           labels=None):
+    """\
+    This combines the labels from several classifiers for each feature set,
+    either by majority vote or by averaging their label probabilities. Ties
+    go to the larger label, the way NLTK breaks them. `labels` can hold
+    labels already found with `classify_many`, one list per classifier, to
+    vote without classifying everything again.
+    """
+    if method not in ENSEMBLE_METHODS:
+        raise ValueError('Unknown ensemble method: {}'.format(method))
+    featuresets = list(featuresets)
+    if not featuresets:
+        return []
+
+    if method == 'vote':
+        if labels is None:
+            labels = [classify_many(classifier, featuresets)
+                      for classifier in classifiers]
+        order = label_order(set(label for row in labels for label in row))
+        label_index = dict((label, i) for (i, label) in enumerate(order))
+        scores = sum(one_hot([label_index[label] for label in row],
+                             len(order))
+                     for row in labels)
+    else:
+        order = label_order(set(label for classifier in classifiers
+                                for label in classifier_labels(classifier)))
+        scores = sum(prob_classify_many(classifier, featuresets, order)
+                     for classifier in classifiers) / len(classifiers)
+
+    return [order[i] for i in last_argmax(scores)]
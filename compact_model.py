@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+
+"""\
+This exports pickled classifiers into a compact model directory: the arrays
+from batch_classify saved as .npy files, plus a vocab.json holding the
+feature names, feature values, and labels. Loading a model memory-maps the
+arrays, so it takes milliseconds instead of unpickling the whole NLTK object
+graph.
+
+usage: compact_model.py [-o MODEL_DIR] [--benchmark] PICKLE_FILE...
+"""
+
+
+import argparse
+import json
+import os
+import pickle
+import sys
+import timeit
+
+import numpy as np
+
+import batch_classify
+from batch_classify import CompiledDecisionTree, CompiledNaiveBayes
+
+
+VOCAB = 'vocab.json'
+EXTENSION = '.model'
+
+ARRAYS = {
+    'NaiveBayes': ['prior', 'weights'],
+    'DecisionTree': ['node_fname', 'node_label', 'node_default', 'children'],
+}
+
+
+def is_model(path):
+    """Is this a compact model directory?"""
+    return os.path.isfile(os.path.join(path, VOCAB))
+
+
+def model_path(pickle_path):
+    """This returns the default model directory for a pickle file."""
+    (base, _) = os.path.splitext(pickle_path)
+    return base + EXTENSION
+
+
+def keys_by_index(index):
+    """This turns a {key: index} dict into a list of keys in index order."""
+    keys = [None] * len(index)
+    for (key, i) in index.items():
+        keys[i] = key
+    return keys
+
+
+def feature_values(compiled):
+    """This yields the (feature name, value) pairs a compiled model tests."""
+    if isinstance(compiled, CompiledNaiveBayes):
+        for pair in compiled.pair_index:
+            yield pair
+    else:
+        fnames = keys_by_index(compiled.fname_index)
+        values = keys_by_index(compiled.value_index)
+        (nodes, value_ids) = np.nonzero(compiled.children >= 0)
+        for (node, value_id) in set(zip(nodes.tolist(), value_ids.tolist())):
+            yield (fnames[compiled.node_fname[node]], values[value_id])
+
+
+def is_json_value(value):
+    """Does this value come back out of vocab.json as itself?"""
+    if isinstance(value, float):
+        return bool(np.isfinite(value))
+    return value is None or isinstance(value, (str, int))
+
+
+def check_vocab(compiled):
+    """\
+    This raises a ValueError naming the first feature name, feature value,
+    or label that JSON would change, such as a tuple that would come back
+    as a list, so the model isn't written only to load differently.
+    """
+    for (fname, fval) in feature_values(compiled):
+        if not is_json_value(fname):
+            raise ValueError('The feature name {!r} cannot be saved in '
+                             '{}.'.format(fname, VOCAB))
+        if not is_json_value(fval):
+            raise ValueError('The value {!r} of the feature {!r} cannot be '
+                             'saved in {}.'.format(fval, fname, VOCAB))
+    for label in compiled.labels:
+        if not is_json_value(label):
+            raise ValueError('The label {!r} cannot be saved in {}.'.format(
+                label, VOCAB))
+
+
+def save_model(classifier, path):
+    """\
+    This compiles the classifier and writes it into the directory `path`.
+    Only NaiveBayes and DecisionTree classifiers can be saved, and only if
+    their feature names, values, and labels survive JSON.
+    """
+    compiled = batch_classify.compile_classifier(classifier)
+    if isinstance(compiled, CompiledNaiveBayes):
+        kind = 'NaiveBayes'
+        vocab = {
+            'pairs': [list(pair) for pair in keys_by_index(compiled.pair_index)],
+            'fnames': keys_by_index(compiled.fname_index),
+        }
+    elif isinstance(compiled, CompiledDecisionTree):
+        kind = 'DecisionTree'
+        vocab = {
+            'fnames': keys_by_index(compiled.fname_index),
+            'values': keys_by_index(compiled.value_index),
+        }
+    else:
+        raise TypeError('Cannot save a {} as a compact model.'.format(
+            type(classifier).__name__))
+    vocab['kind'] = kind
+    vocab['labels'] = compiled.labels
+    check_vocab(compiled)
+
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name in ARRAYS[kind]:
+        np.save(os.path.join(path, name + '.npy'), getattr(compiled, name))
+    with open(os.path.join(path, VOCAB), 'w') as fout:
+        json.dump(vocab, fout)
+
+    return compiled
+
+
+def load_model(path, mmap=True):
+    """\
+    This loads a compact model directory. The arrays are memory-mapped
+    unless `mmap` is False.
+    """
+    with open(os.path.join(path, VOCAB)) as fin:
+        vocab = json.load(fin)
+    kind = vocab['kind']
+    mmap_mode = 'r' if mmap else None
+    arrays = dict(
+        (name, np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode))
+        for name in ARRAYS[kind]
+    )
+    fname_index = dict((fname, i) for (i, fname) in enumerate(vocab['fnames']))
+
+    if kind == 'NaiveBayes':
+        pair_index = dict(
+            ((fname, fval), i) for (i, (fname, fval)) in enumerate(vocab['pairs'])
+        )
+        return CompiledNaiveBayes(vocab['labels'], arrays['prior'],
+                                  arrays['weights'], pair_index, fname_index)
+    else:
+        value_index = dict(
+            (fval, i) for (i, fval) in enumerate(vocab['values'])
+        )
+        return CompiledDecisionTree(
+            vocab['labels'], arrays['node_fname'], arrays['node_label'],
+            arrays['node_default'], arrays['children'], fname_index,
+            value_index,
+        )
+
+
+def same_model(a, b):
+    """\
+    This checks that two compiled models have the same vocabulary and arrays,
+    and therefore classify everything the same way.
+    """
+    if type(a) is not type(b) or list(a.labels) != list(b.labels):
+        return False
+    kind = 'NaiveBayes' if isinstance(a, CompiledNaiveBayes) else 'DecisionTree'
+    if kind == 'NaiveBayes':
+        indexes = ['pair_index', 'fname_index']
+    else:
+        indexes = ['fname_index', 'value_index']
+    return (
+        all(getattr(a, name) == getattr(b, name) for name in indexes) and
+        all(np.array_equal(getattr(a, name), getattr(b, name))
+            for name in ARRAYS[kind])
+    )
+
+
+def load_pickle(filename):
+    """This unpickles a classifier."""
+    with open(filename, 'rb') as fin:
+        return pickle.load(fin)
+
+
+def benchmark_load(pickle_file, path, repeat=5):
+    """\
+    This returns the best time, in seconds, to load the classifier from the
+    pickle and from the compact model directory.
+    """
+    pickled = min(timeit.repeat(lambda: load_pickle(pickle_file),
+                                number=1, repeat=repeat))
+    compact = min(timeit.repeat(lambda: load_model(path),
+                                number=1, repeat=repeat))
+    return (pickled, compact)
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('pickles', metavar='PICKLE_FILE', nargs='+',
+                        help='The pickled classifiers to export.')
+    parser.add_argument('-o', '--output', dest='output', metavar='MODEL_DIR',
+                        help='The directory to write the model into. Only '
+                             'valid with one pickle. Default = the pickle '
+                             'name with {}.'.format(EXTENSION))
+    parser.add_argument('-b', '--benchmark', dest='benchmark',
+                        action='store_true',
+                        help='Time loading the pickle against loading the '
+                             'compact model.')
+
+    args = parser.parse_args(argv)
+    if args.output is not None and len(args.pickles) > 1:
+        parser.error('--output only works with one pickle.')
+    return args
+
+
+def main():
+    args = parse_args()
+    for pickle_file in args.pickles:
+        path = args.output or model_path(pickle_file)
+        compiled = save_model(load_pickle(pickle_file), path)
+        if not same_model(compiled, load_model(path)):
+            raise ValueError('{} did not round-trip.'.format(path))
+        print('{} => {}'.format(pickle_file, path))
+
+        if args.benchmark:
+            (pickled, compact) = benchmark_load(pickle_file, path)
+            print('\tpickle  {:.4f}s'.format(pickled))
+            print('\tcompact {:.4f}s ({:.1f}x)'.format(
+                compact, pickled / compact))
+
+
+if __name__ == '__main__':
+    main()
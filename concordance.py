@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+
+"""\
+This builds and searches a concordance of the corpus: an index from each
+token to everywhere it occurs, with the document, the offset, the sentence,
+and whether it's inside a quote. Questions like where "clarissa" comes up
+in dialogue become a lookup instead of a grep.
+
+Tokens and sentences come from the same tokenization that marking uses
+(`fset_manager.Current`), so they're lower-cased, and the quotes come from
+`ps.find_quoted_quotes`. The index is kept in one .npz file. Adding a
+document that's already in it replaces its entries.
+
+usage: concordance.py INDEX_FILE [-a PATH] [-q | -u] [-w WIDTH] [-n LIMIT]
+                      [WORD [WORD ...]]
+"""
+
+
+import argparse
+import os
+import sys
+
+import nltk
+import numpy as np
+
+import ps
+import train_quotes
+from fset_manager import Current
+
+
+WIDTH = 40
+COLUMNS = (
+    ('document', np.int32),
+    ('start', np.int64),
+    ('end', np.int64),
+    ('quoted', bool),
+    ('sentence', np.int32),
+)
+
+
+def normalize(word):
+    """This normalizes a word the way `split_sentences` does its tokens."""
+    return word.lower().replace('_', '')
+
+
+def read_document(path):
+    with open(path) as fin:
+        return fin.read()
+
+
+def document_postings(text, manager, tokenizer=None):
+    """\
+    This tokenizes a text and returns (tokens, columns): the token at each
+    position, and a dict of arrays of where each one is (start, end,
+    quoted, sentence).
+    """
+    tokens = []
+    spans = []
+    sentences = []
+    for (i, sentence) in enumerate(manager.tokenize_text(text, tokenizer)):
+        for (token, span) in sentence:
+            tokens.append(token)
+            spans.append(span)
+            sentences.append(i)
+    spans = np.array(spans, dtype=np.int64).reshape((-1, 2))
+    columns = {
+        'start': spans[:, 0],
+        'end': spans[:, 1],
+        'quoted': ps.in_quotes(ps.find_quoted_quotes(text), spans[:, 0]),
+        'sentence': np.array(sentences, dtype=np.int32),
+    }
+    return (np.array(tokens, dtype=str), columns)
+
+
+class Concordance(object):
+    """\
+    An inverted index from tokens to their positions. The positions are
+    kept in columns sorted by token, then document, then offset, and
+    `indptr` points to where each token's positions start, the way a CSR
+    matrix does.
+
+    New documents are held until the next lookup or save, and then merged
+    in all at once.
+    """
+
+    def __init__(self):
+        self.documents = []
+        self.vocab = np.array([], dtype=str)
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.columns = dict((name, np.array([], dtype=dtype))
+                            for (name, dtype) in COLUMNS)
+        self.index = {}
+        self.pending = []
+
+    def __len__(self):
+        self.merge()
+        return len(self.vocab)
+
+    @classmethod
+    def load(cls, path):
+        concordance = cls()
+        with np.load(path) as data:
+            concordance.documents = data['documents'].tolist()
+            concordance.vocab = data['vocab']
+            concordance.indptr = data['indptr']
+            concordance.columns = dict((name, data[name])
+                                       for (name, _) in COLUMNS)
+        concordance.index = dict(
+            (token, i) for (i, token) in enumerate(concordance.vocab.tolist())
+        )
+        return concordance
+
+    def save(self, path):
+        self.merge()
+        with open(path, 'wb') as fout:
+            np.savez_compressed(
+                fout,
+                documents=np.array(self.documents, dtype=str),
+                vocab=self.vocab,
+                indptr=self.indptr,
+                **self.columns
+            )
+
+    def add_document(self, path, text, manager, tokenizer=None):
+        """This tokenizes a document and queues its positions to be added."""
+        if path in self.documents:
+            document = self.documents.index(path)
+        else:
+            document = len(self.documents)
+            self.documents.append(path)
+        (tokens, columns) = document_postings(text, manager, tokenizer)
+        columns['document'] = np.full(len(tokens), document, dtype=np.int32)
+        self.pending.append((document, tokens, columns))
+
+    def merge(self):
+        """\
+        This merges the pending documents into the index, replacing any
+        positions that were already there for them.
+        """
+        if not self.pending:
+            return
+        replaced = np.array([document for (document, _, _) in self.pending],
+                            dtype=np.int32)
+        keep = ~np.isin(self.columns['document'], replaced)
+        old_tokens = np.repeat(self.vocab, np.diff(self.indptr))[keep]
+        tokens = np.concatenate(
+            [old_tokens] + [tokens for (_, tokens, _) in self.pending]
+        )
+        columns = dict(
+            (name, np.concatenate(
+                [self.columns[name][keep]] +
+                [new[name].astype(dtype) for (_, _, new) in self.pending]
+            ))
+            for (name, dtype) in COLUMNS
+        )
+        self.pending = []
+
+        (self.vocab, ids) = np.unique(tokens, return_inverse=True)
+        order = np.lexsort((columns['start'], columns['document'], ids))
+        self.columns = dict((name, column[order])
+                            for (name, column) in columns.items())
+        self.indptr = np.concatenate((
+            [0], np.cumsum(np.bincount(ids, minlength=len(self.vocab)))
+        )).astype(np.int64)
+        self.index = dict(
+            (token, i) for (i, token) in enumerate(self.vocab.tolist())
+        )
+
+    def lookup(self, word, quoted=None):
+        """\
+        This returns a dict of the columns for every position of `word`,
+        only the quoted or unquoted ones if `quoted` is True or False.
+        """
+        self.merge()
+        i = self.index.get(normalize(word))
+        if i is None:
+            (start, end) = (0, 0)
+        else:
+            (start, end) = (self.indptr[i], self.indptr[i + 1])
+        found = dict((name, column[start:end])
+                     for (name, column) in self.columns.items())
+        if quoted is not None:
+            found = dict((name, column[found['quoted'] == quoted])
+                         for (name, column) in found.items())
+        return found
+
+    def concordance(self, word, quoted=None, width=WIDTH, limit=None,
+                    read=read_document):
+        """\
+        This yields (document, sentence, quoted, left, match, right) for
+        each position of `word`, with `width` characters of context on each
+        side, reading each document once.
+        """
+        found = self.lookup(word, quoted)
+        texts = {}
+        rows = zip(found['document'].tolist(), found['start'].tolist(),
+                   found['end'].tolist(), found['quoted'].tolist(),
+                   found['sentence'].tolist())
+        for (n, (document, start, end, is_quoted, sentence)) in enumerate(
+                rows):
+            if limit is not None and n >= limit:
+                break
+            path = self.documents[document]
+            if path not in texts:
+                texts[path] = read(path)
+            text = texts[path]
+            yield (path, sentence, is_quoted,
+                   text[max(start - width, 0):start].replace('\n', ' '),
+                   text[start:end],
+                   text[end:end + width].replace('\n', ' '))
+
+
+def print_concordance(rows, width=WIDTH):
+    for (path, sentence, quoted, left, match, right) in rows:
+        print('{}:{:<6} {} {:>{width}} {} {:<{width}}'.format(
+            path, sentence, '"' if quoted else ' ', left, match, right,
+            width=width))
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('index', metavar='INDEX_FILE',
+                        help='The concordance file. It is created if it '
+                             'does not exist.')
+    parser.add_argument('words', metavar='WORD', nargs='*',
+                        help='The words to look up.')
+    parser.add_argument('-a', '--add', dest='add', metavar='PATH',
+                        action='append', default=[],
+                        help='A file or folder of texts to add to the index '
+                             'first. This can be given more than once.')
+    quoted = parser.add_mutually_exclusive_group()
+    quoted.add_argument('-q', '--quoted', dest='quoted',
+                        action='store_const', const=True,
+                        help='Only show the words inside of quotes.')
+    quoted.add_argument('-u', '--unquoted', dest='quoted',
+                        action='store_const', const=False,
+                        help='Only show the words outside of quotes.')
+    parser.add_argument('-w', '--width', dest='width', type=int,
+                        default=WIDTH,
+                        help='The characters of context on each side. '
+                             'Default = {}.'.format(WIDTH))
+    parser.add_argument('-n', '--limit', dest='limit', type=int,
+                        help='Show at most this many lines for each word.')
+
+    return parser.parse_intermixed_args(argv)
+
+
+def main():
+    args = parse_args()
+    if os.path.exists(args.index):
+        concordance = Concordance.load(args.index)
+    else:
+        concordance = Concordance()
+
+    if args.add:
+        manager = Current(train_quotes.is_quote, train_quotes.is_word)
+        tokenizer = nltk.load('tokenizers/punkt/{0}.pickle'.format('english'))
+        for path in args.add:
+            paths = ps.all_files(path) if os.path.isdir(path) else [path]
+            for input_file_path in sorted(paths):
+                concordance.add_document(input_file_path,
+                                         read_document(input_file_path),
+                                         manager, tokenizer)
+        concordance.save(args.index)
+
+    for word in args.words:
+        print_concordance(concordance.concordance(word, args.quoted,
+                                                  args.width, args.limit),
+                          args.width)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,200 @@
+"""\
+Cumulative counts of where things happen in a document: quotation marks,
+quotes, carets, and quoted characters. Each one is built once, as a prefix
+sum over the characters of the text. Then any histogram, rolling window, or
+zoomed range is a lookup at each bin edge, so trying another bin count, or
+drawing the same document three ways, doesn't go back over the text.
+
+Histograms come out the same as `np.histogram` of the positions, edges and
+all, which is what the plots in ps.py and visualize.py used before.
+
+The counts for a marked document and its source are built here for both
+ps.py and visualize.py, and kept until either file changes.
+"""
+
+
+import os
+import re
+
+import numpy as np
+
+import charscan
+import docstore
+import standoff
+
+
+# The cumulative counts for each marked file, built once for every plot, and
+# the source and (mtime, size) stamps they were built from.
+_DENSITIES = {}
+
+
+class PrefixCounts(object):
+    """\
+    The number of events (a position in the text each) before each offset:
+    `cumulative[k]` is how many happen at positions under k.
+    """
+
+    def __init__(self, cumulative):
+        self.cumulative = cumulative
+
+    @classmethod
+    def from_positions(cls, positions, length=None):
+        """\
+        This counts events at the given positions, in a text `length`
+        characters long (default = just past the last event).
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        if length is None:
+            length = int(positions.max()) + 1 if len(positions) else 0
+        counts = np.bincount(positions, minlength=length)
+        return cls(np.concatenate(([0], np.cumsum(counts))).astype(np.int32))
+
+    @classmethod
+    def from_spans(cls, spans, length):
+        """This counts the characters covered by the (start, end) spans."""
+        spans = np.asarray(spans, dtype=np.int64).reshape((-1, 2))
+        edges = np.zeros(length + 1, dtype=np.int64)
+        np.add.at(edges, np.clip(spans[:, 0], 0, length), 1)
+        np.add.at(edges, np.clip(spans[:, 1], 0, length), -1)
+        covered = (np.cumsum(edges[:-1]) > 0).astype(np.int32)
+        return cls(np.concatenate(([0], np.cumsum(covered))).astype(np.int32))
+
+    @classmethod
+    def from_matches(cls, matches, length=None):
+        """This counts where each regex match starts."""
+        return cls.from_positions([m.start() for m in matches], length)
+
+    def __len__(self):
+        return len(self.cumulative) - 1
+
+    def total(self):
+        return int(self.cumulative[-1])
+
+    def before(self, offsets):
+        """This returns how many events happen before each offset."""
+        offsets = np.clip(np.ceil(offsets), 0, len(self)).astype(np.int64)
+        return self.cumulative[offsets]
+
+    def count(self, start, end):
+        """This returns how many events happen in [start, end)."""
+        return int(self.before(end) - self.before(start))
+
+    def extent(self):
+        """This returns the first and last positions with an event."""
+        if self.total() == 0:
+            return (0, 0)
+        return (int(np.searchsorted(self.cumulative, 1)) - 1,
+                int(np.searchsorted(self.cumulative, self.total())) - 1)
+
+    def bin_edges(self, bin_count, range=None):
+        """\
+        This returns the edges `np.histogram` would use for these events:
+        from the first one to the last one, unless given a range.
+        """
+        if range is None:
+            range = self.extent() if self.total() else (0, 1)
+        (first, last) = (float(range[0]), float(range[1]))
+        if first == last:
+            (first, last) = (first - 0.5, last + 0.5)
+        return np.linspace(first, last, bin_count + 1)
+
+    def histogram(self, bin_count, range=None):
+        """\
+        This returns (counts, edges) like `np.histogram(positions,
+        bin_count, range)`. Each bin is [left, right), except that the last
+        one also takes events on its right edge.
+        """
+        edges = self.bin_edges(bin_count, range)
+        before = self.before(edges)
+        before[-1] = self.before(np.floor(edges[-1]) + 1)
+        return (np.diff(before).astype(np.intp), edges)
+
+    def rolling(self, width, bin_count, range=None):
+        """\
+        This returns (density, centers): the events per character in a
+        window `width` characters wide, centered on the middle of each of
+        the histogram's bins.
+        """
+        edges = self.bin_edges(bin_count, range)
+        centers = (edges[:-1] + edges[1:]) / 2
+        counts = (self.before(centers + width / 2) -
+                  self.before(centers - width / 2))
+        return (counts / float(width), centers)
+
+
+def location_bin_counts(densities, token, bin_count):
+    """\
+    This returns (counts, edges) for one of the plots: where the quotes
+    start (quote), where the carets are (caret), or the quotation marks
+    less the carets (compare). `densities` maps 'marks', 'quotes', and
+    'carets' to `PrefixCounts`.
+    """
+    if token == 'compare':
+        (quote_n, bins) = densities['marks'].histogram(bin_count)
+        (caret_n, _) = densities['carets'].histogram(bin_count)
+        return (quote_n - caret_n, bins)
+    elif token == 'caret':
+        return densities['carets'].histogram(bin_count)
+    else:
+        return densities['quotes'].histogram(bin_count)
+
+
+def quoted_quote_pattern(double_marks, single_marks):
+    """returns the regex for quoted quotes: single quotes if there are
+    more single quotation marks than double ones."""
+    if double_marks < single_marks:
+        return r'(?<!\w)\'.+?\'(?!\w)'
+    else:
+        return r'"[^"]+"'
+
+
+def find_quoted_quotes(text):
+    """This returns the regex matches from finding the quoted
+    quotes. Note: if the number of quotation marks is less than fifty
+    it assumes that single quotes are used to designate dialogue."""
+    pattern = quoted_quote_pattern(text.count('"'), text.count("'"))
+    return list(re.finditer(pattern, text))
+
+
+def find_quote_characters(text):
+    """returns the positions of the quote characters only, single ones if
+    there are more of them than double ones."""
+    marks = charscan.scan(text, '"\'')
+    if len(marks['"']) < len(marks["'"]):
+        return marks["'"]
+    else:
+        return marks['"']
+
+
+def caret_locations(marked_fn):
+    """returns the caret locations in a marked file, or in the caret text
+    rendered from a standoff sidecar without reading the text."""
+    if standoff.is_sidecar(marked_fn):
+        return standoff.caret_positions(standoff.read_spans(marked_fn))
+    return charscan.positions(docstore.clean_and_read_text(marked_fn), '^')
+
+
+def document_densities(marked_fn, unmarked_folder):
+    """\
+    This returns the `PrefixCounts` for a marked file and its source in
+    `unmarked_folder`: where the quotation marks, quotes, and carets are,
+    keyed the way `location_bin_counts` wants them. They're built the first
+    time they're asked for, and again whenever either file changes.
+    """
+    unmarked_fn = os.path.join(
+        unmarked_folder, os.path.basename(standoff.source_name(marked_fn)))
+    stamp = (unmarked_fn, docstore.file_stamp(marked_fn),
+             docstore.file_stamp(unmarked_fn))
+    cached = _DENSITIES.get(marked_fn)
+    if cached is None or cached[0] != stamp:
+        unmarked_text = docstore.clean_and_read_text(unmarked_fn)
+        length = len(unmarked_text)
+        cached = (stamp, {
+            'marks': PrefixCounts.from_positions(
+                find_quote_characters(unmarked_text), length),
+            'quotes': PrefixCounts.from_matches(
+                find_quoted_quotes(unmarked_text), length),
+            'carets': PrefixCounts.from_positions(caret_locations(marked_fn)),
+        })
+        _DENSITIES[marked_fn] = cached
+    return cached[1]
@@ -0,0 +1,162 @@
+"""\
+A store of the corpus texts that the analysis modules share, so a file is
+read once however many statistics and plots ask for it. Without it,
+`punctuated_spaces.percent_quoted` reads each file twice, and drawing all
+three plots in visualize.py reads each file three times.
+
+Texts are kept in memory, raw and cleaned, with the least recently used
+ones dropped past `max_characters`. With a `cache_dir`, cleaned texts are
+also written to disk, keyed by the source's path, modification time, and
+size, so that another run over the same corpus can skip the work. Any
+change to a file changes its key, so stale entries are never used, and
+each source's entries share a folder, so writing the new one removes the
+old ones.
+"""
+
+
+import codecs
+from collections import OrderedDict
+import hashlib
+import os
+
+
+MAX_CHARACTERS = 2 ** 27
+
+
+def clean_text(input_text):
+    """Clean the text by lowercasing and removing newlines."""
+    return input_text.replace('\n', ' ').lower()
+
+
+def file_stamp(filename):
+    """This returns what identifies a version of a file: (mtime, size)."""
+    stat = os.stat(filename)
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class DocumentStore(object):
+    """\
+    An LRU cache of raw and cleaned texts, keyed by path and checked
+    against each file's modification time and size.
+    """
+
+    def __init__(self, cache_dir=None, max_characters=MAX_CHARACTERS):
+        self.cache_dir = cache_dir
+        self.max_characters = max_characters
+        self.memory = OrderedDict()
+        self.characters = 0
+        self.hits = 0
+        self.misses = 0
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def remember(self, key, value):
+        """This puts a text at the front of the LRU."""
+        if key in self.memory:
+            self.characters -= len(self.memory.pop(key)[1])
+        self.memory[key] = value
+        self.characters += len(value[1])
+        while self.characters > self.max_characters and len(self.memory) > 1:
+            (_, (_, text)) = self.memory.popitem(last=False)
+            self.characters -= len(text)
+
+    def lookup(self, key, stamp):
+        found = self.memory.get(key)
+        if found is None or found[0] != stamp:
+            return None
+        self.memory.move_to_end(key)
+        return found[1]
+
+    def disk_path(self, filename, stamp, kind):
+        """\
+        This returns where a version of a file is cached on disk: a folder
+        for the file and kind, holding one file for each (mtime, size).
+        """
+        digest = hashlib.sha1('{}\0{}'.format(
+            os.path.abspath(filename), kind,
+        ).encode('utf8')).hexdigest()
+        return os.path.join(self.cache_dir, digest,
+                            '{}-{}.txt'.format(stamp[0], stamp[1]))
+
+    def read_disk(self, path):
+        if not os.path.exists(path):
+            return None
+        with codecs.open(path, 'r', 'utf8') as fin:
+            return fin.read()
+
+    def write_disk(self, path, text):
+        """\
+        This writes a cached text and removes the ones for older versions
+        of the same file.
+        """
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with codecs.open(tmp, 'w', 'utf8') as fout:
+            fout.write(text)
+        os.replace(tmp, path)
+        for fn in os.listdir(folder):
+            stale = os.path.join(folder, fn)
+            if stale != path and not fn.endswith('.tmp'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+
+    def read(self, filename):
+        """This returns the text of a file."""
+        stamp = file_stamp(filename)
+        key = (os.path.abspath(filename), 'raw')
+        text = self.lookup(key, stamp)
+        if text is None:
+            self.misses += 1
+            with codecs.open(filename, 'r', 'utf8') as fin:
+                text = fin.read()
+            self.remember(key, (stamp, text))
+        else:
+            self.hits += 1
+        return text
+
+    def clean(self, filename):
+        """This returns the text of a file, cleaned by `clean_text`."""
+        stamp = file_stamp(filename)
+        key = (os.path.abspath(filename), 'clean')
+        text = self.lookup(key, stamp)
+        if text is not None:
+            self.hits += 1
+            return text
+
+        path = None
+        if self.cache_dir is not None:
+            path = self.disk_path(filename, stamp, 'clean')
+            text = self.read_disk(path)
+        if text is None:
+            text = clean_text(self.read(filename))
+            if path is not None:
+                self.write_disk(path, text)
+        else:
+            self.hits += 1
+        self.remember(key, (stamp, text))
+        return text
+
+
+# The store that the analysis modules share. Use `configure` to give it a
+# disk cache.
+STORE = DocumentStore()
+
+
+def configure(cache_dir=None, max_characters=MAX_CHARACTERS):
+    """This replaces the shared store with a new one."""
+    global STORE
+    STORE = DocumentStore(cache_dir, max_characters)
+    return STORE
+
+
+def read_text(filename):
+    """Read in the text from the file, through the shared store."""
+    return STORE.read(filename)
+
+
+def clean_and_read_text(filename):
+    """Read in the cleaned text from the file, through the shared store."""
+    return STORE.clean(filename)
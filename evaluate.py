@@ -0,0 +1,174 @@
+"""\
+This evaluates classifier output against the gold labels. Besides accuracy it
+reports per-class precision, recall, and F1, the confusion matrix, and
+bootstrap confidence intervals for all of them. Quoted sentences are the
+minority class, so accuracy on its own hides a lot.
+
+Everything works from integer-coded label arrays, so the bootstrap resamples
+are just fancy indexing and `np.bincount`.
+"""
+
+
+import numpy as np
+
+
+BOOTSTRAP_RESAMPLES = 1000
+ALPHA = 0.05
+
+# How much memory the bootstrap resamples can take at once. Each (resample x
+# item) cell holds an int64 index and an int64 confusion cell.
+CHUNK_BYTES = 2 ** 26
+CELL_BYTES = 16
+
+
+def encode_labels(gold, predicted, labels=None):
+    """\
+    This turns gold and predicted label sequences into integer arrays indexing
+    into `labels`, which defaults to every label seen in either, sorted.
+    """
+    gold = list(gold)
+    predicted = list(predicted)
+    if len(gold) != len(predicted):
+        raise ValueError('{} gold labels, but {} predictions'.format(
+            len(gold), len(predicted)))
+    if labels is None:
+        labels = sorted(set(gold) | set(predicted))
+    index = dict((label, i) for (i, label) in enumerate(labels))
+    gold = np.array([index[label] for label in gold], dtype=np.int64)
+    predicted = np.array([index[label] for label in predicted],
+                         dtype=np.int64)
+    return (list(labels), gold, predicted)
+
+
+def confusion_counts(gold, predicted, n_labels, samples=None):
+    """\
+    This returns the confusion matrix (rows are gold, columns are predicted)
+    for integer-coded labels. If `samples` is given, it's a matrix of indexes
+    with one resample per row, and this returns one confusion matrix per row.
+    """
+    cells = gold * n_labels + predicted
+    if samples is None:
+        counts = np.bincount(cells, minlength=n_labels ** 2)
+        return counts.reshape((n_labels, n_labels))
+
+    (n_samples, _) = samples.shape
+    resampled = cells[samples]
+    resampled += np.arange(n_samples)[:, None] * n_labels ** 2
+    counts = np.bincount(resampled.ravel(),
+                         minlength=n_samples * n_labels ** 2)
+    return counts.reshape((n_samples, n_labels, n_labels))
+
+
+def safe_divide(numerator, denominator):
+    """This divides, returning 0 wherever the denominator is 0."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    out = np.zeros(np.broadcast(numerator, denominator).shape)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+
+def scores(matrix):
+    """\
+    This takes one confusion matrix, or a stack of them, and returns a dict
+    of arrays for accuracy and per-class precision, recall, and F1.
+    """
+    matrix = np.asarray(matrix)
+    true_pos = np.diagonal(matrix, axis1=-2, axis2=-1)
+    predicted = matrix.sum(axis=-2)
+    actual = matrix.sum(axis=-1)
+    total = actual.sum(axis=-1)
+
+    precision = safe_divide(true_pos, predicted)
+    recall = safe_divide(true_pos, actual)
+    return {
+        'accuracy': safe_divide(true_pos.sum(axis=-1), total),
+        'precision': precision,
+        'recall': recall,
+        'f1': safe_divide(2 * precision * recall, precision + recall),
+        'support': actual,
+    }
+
+
+def bootstrap_scores(gold, predicted, n_labels, n_resamples=BOOTSTRAP_RESAMPLES,
+                     seed=None):
+    """\
+    This resamples the (gold, predicted) pairs with replacement
+    `n_resamples` times and returns the `scores` for every resample. The
+    resamples are drawn and counted in chunks of at most `CHUNK_BYTES`.
+    """
+    rng = np.random.RandomState(seed)
+    n = len(gold)
+    chunk = max(1, CHUNK_BYTES // (CELL_BYTES * max(n, 1)))
+    results = []
+    for start in range(0, n_resamples, chunk):
+        size = min(chunk, n_resamples - start)
+        samples = rng.randint(0, n, size=(size, n))
+        results.append(scores(confusion_counts(gold, predicted, n_labels,
+                                               samples)))
+    return dict(
+        (key, np.concatenate([r[key] for r in results]))
+        for key in results[0]
+    )
+
+
+def evaluation_report(gold, predicted, labels=None,
+                      n_resamples=BOOTSTRAP_RESAMPLES, alpha=ALPHA, seed=None):
+    """\
+    This returns a dict with the labels, the confusion matrix, the scores,
+    and, unless `n_resamples` is 0, the (low, high) bootstrap interval for
+    each score at the 1 - `alpha` level.
+    """
+    (labels, gold, predicted) = encode_labels(gold, predicted, labels)
+    matrix = confusion_counts(gold, predicted, len(labels))
+    report = {
+        'labels': labels,
+        'confusion': matrix,
+        'scores': scores(matrix),
+        'intervals': {},
+    }
+
+    if n_resamples and len(gold):
+        resampled = bootstrap_scores(gold, predicted, len(labels),
+                                     n_resamples, seed)
+        bounds = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+        for (key, values) in resampled.items():
+            if key == 'support':
+                continue
+            (low, high) = np.percentile(values, bounds, axis=0)
+            report['intervals'][key] = (low, high)
+
+    return report
+
+
+def format_report(report):
+    """This formats an `evaluation_report` as a plain-text table."""
+    labels = report['labels']
+    scores_ = report['scores']
+    intervals = report['intervals']
+
+    def cell(key, i=None):
+        value = scores_[key] if i is None else scores_[key][i]
+        if key not in intervals:
+            return '{:.4f}'.format(value)
+        (low, high) = intervals[key]
+        if i is not None:
+            (low, high) = (low[i], high[i])
+        return '{:.4f} [{:.4f}, {:.4f}]'.format(value, low, high)
+
+    lines = ['Accuracy = {}'.format(cell('accuracy')), '']
+    lines.append('{:<10} {:<26} {:<26} {:<26} {:>8}'.format(
+        'Label', 'Precision', 'Recall', 'F1', 'Support'))
+    for (i, label) in enumerate(labels):
+        lines.append('{:<10} {:<26} {:<26} {:<26} {:>8}'.format(
+            str(label), cell('precision', i), cell('recall', i),
+            cell('f1', i), scores_['support'][i]))
+
+    lines.append('')
+    lines.append('Confusion matrix (rows = gold, columns = predicted):')
+    lines.append(' ' * 10 + ''.join('{:>10}'.format(str(label))
+                                     for label in labels))
+    for (label, row) in zip(labels, report['confusion']):
+        lines.append('{:<10}'.format(str(label)) +
+                     ''.join('{:>10}'.format(count) for count in row))
+    return '\n'.join(lines)
@@ -0,0 +1,203 @@
+"""\
+This prunes the feature sets between `get_all_training_features` and
+training. InternalStyle makes every distinct token/TAG pair a feature, so
+most features are rare, and DecisionTree training spends its time scanning
+them.
+
+Every (feature name, feature value) pair becomes a column in a sparse
+indicator matrix, and the pairs are scored by frequency, chi-squared, or
+mutual information with the label over the whole matrix at once.
+"""
+
+
+import pickle
+import time
+
+import numpy as np
+from scipy import sparse
+
+import batch_classify
+from compact_model import keys_by_index
+import weighted_training
+
+
+PRUNE_METHODS = ('frequency', 'chi2', 'mi')
+MIN_COUNT = 2
+# The fractions of the features that `report_settings` keeps when it isn't
+# given a number to keep.
+REPORT_FRACTIONS = (0.5, 0.25, 0.1)
+
+
+def feature_matrix(labeled_featuresets):
+    """\
+    This returns (pairs, matrix, y, labels): the (feature name, value) pair
+    for each column, a sparse instance x pair indicator matrix, and the
+    integer-coded labels indexing into `labels`.
+    """
+    pair_index = {}
+    label_index = {}
+    indptr = [0]
+    indices = []
+    y = []
+    for (featureset, label) in labeled_featuresets:
+        for pair in featureset.items():
+            indices.append(pair_index.setdefault(pair, len(pair_index)))
+        indptr.append(len(indices))
+        y.append(label_index.setdefault(label, len(label_index)))
+
+    matrix = sparse.csr_matrix(
+        (np.ones(len(indices)), np.array(indices, dtype=np.int64),
+         np.array(indptr)),
+        shape=(len(y), len(pair_index)),
+    )
+    return (keys_by_index(pair_index), matrix, np.array(y),
+            keys_by_index(label_index))
+
+
+def label_counts(matrix, y, n_labels):
+    """\
+    This returns (observed, feature_count, label_count), where observed[c,
+    f] is the number of instances with label c and feature f.
+    """
+    indicator = sparse.csr_matrix(
+        (np.ones(len(y)), (np.arange(len(y)), y)),
+        shape=(len(y), n_labels),
+    )
+    observed = np.asarray((indicator.T @ matrix).todense())
+    feature_count = np.asarray(matrix.sum(axis=0)).ravel()
+    label_count = np.bincount(y, minlength=n_labels)
+    return (observed, feature_count, label_count)
+
+
+def chi2_scores(observed, feature_count, label_count):
+    """\
+    This returns the chi-squared statistic between each feature's presence
+    and the label.
+    """
+    expected = np.outer(label_count / label_count.sum(), feature_count)
+    terms = np.zeros_like(expected)
+    np.divide((observed - expected) ** 2, expected, out=terms,
+              where=expected > 0)
+    return terms.sum(axis=0)
+
+
+def mi_scores(observed, feature_count, label_count):
+    """\
+    This returns the mutual information (in bits) between each feature's
+    presence and the label.
+    """
+    n = label_count.sum()
+    p_label = (label_count / n)[:, None]
+    scores = np.zeros(observed.shape[1])
+    for (joint, p_feature) in (
+            (observed / n, feature_count / n),
+            ((label_count[:, None] - observed) / n, 1 - feature_count / n)):
+        denominator = p_label * p_feature
+        ratio = np.ones_like(joint)
+        np.divide(joint, denominator, out=ratio,
+                  where=(joint > 0) & (denominator > 0))
+        scores += (joint * np.log2(ratio)).sum(axis=0)
+    return scores
+
+
+def select_features(labeled_featuresets, method='frequency',
+                    min_count=MIN_COUNT, keep=None):
+    """\
+    This returns the set of (feature name, value) pairs to keep. Pairs seen
+    fewer than `min_count` times are always dropped. If `keep` is given,
+    only that many of the remaining pairs are kept: the most frequent ones
+    for 'frequency', or the highest-scoring ones for 'chi2' and 'mi'. The
+    scores only rank the pairs, so 'chi2' and 'mi' need `keep`.
+    """
+    if method not in PRUNE_METHODS:
+        raise ValueError('Unknown pruning method: {}'.format(method))
+    if method != 'frequency' and keep is None:
+        raise ValueError('Pruning by {} needs a number to keep.'.format(
+            method))
+    (pairs, matrix, y, labels) = feature_matrix(labeled_featuresets)
+    (observed, feature_count, label_count) = label_counts(matrix, y,
+                                                          len(labels))
+
+    candidates = np.flatnonzero(feature_count >= min_count)
+    if keep is not None and keep < len(candidates):
+        if method == 'frequency':
+            score = feature_count[candidates]
+        else:
+            score = (chi2_scores if method == 'chi2' else mi_scores)(
+                observed, feature_count, label_count)[candidates]
+        best = np.argpartition(-score, keep)[:keep]
+        candidates = candidates[best]
+
+    return set(pairs[i] for i in candidates)
+
+
+def prune_featuresets(labeled_featuresets, keep):
+    """\
+    This returns the feature sets with only the (feature name, value) pairs
+    in `keep`.
+    """
+    return [(dict(pair for pair in featureset.items() if pair in keep), label)
+            for (featureset, label) in labeled_featuresets]
+
+
+def train_and_measure(cls, training, test):
+    """\
+    This trains a classifier and returns (seconds to train, pickled size in
+    bytes, test accuracy).
+    """
+    start = time.perf_counter()
+    classifier = weighted_training.train(cls, training)
+    elapsed = time.perf_counter() - start
+    size = len(pickle.dumps(classifier))
+    return (elapsed, size, batch_classify.accuracy(classifier, test))
+
+
+def report_settings(training, min_count=MIN_COUNT, keep=None):
+    """\
+    This returns the (method, min_count, keep) settings for
+    `pruning_report`: frequency pruning by `min_count` alone, and then each
+    method keeping `keep` pairs, or, without `keep`, each of
+    `REPORT_FRACTIONS` of the pairs seen at least `min_count` times.
+    """
+    if keep is None:
+        feature_count = np.asarray(
+            feature_matrix(training)[1].sum(axis=0)).ravel()
+        n = int((feature_count >= min_count).sum())
+        keeps = sorted(set(max(1, int(n * fraction))
+                           for fraction in REPORT_FRACTIONS), reverse=True)
+    else:
+        keeps = [keep]
+    return [('frequency', min_count, None)] + [
+        (method, min_count, n_keep)
+        for n_keep in keeps for method in PRUNE_METHODS
+    ]
+
+
+def pruning_report(cls, training, test, settings):
+    """\
+    This trains `cls` on the unpruned training set and then on the set
+    pruned with each of `settings`, a sequence of (method, min_count, keep)
+    triples. It prints the number of features, training time, model size,
+    and accuracy for each, and returns the rows.
+    """
+    print('Pruning {}'.format(cls.__name__))
+    n_features = len(feature_matrix(training)[0])
+    rows = [('none', n_features) + train_and_measure(cls, training, test)]
+    for (method, min_count, keep) in settings:
+        selected = select_features(training, method, min_count, keep)
+        pruned = prune_featuresets(training, selected)
+        name = '{} (min={}, keep={})'.format(method, min_count, keep)
+        rows.append((name, len(selected)) +
+                    train_and_measure(cls, pruned, test))
+
+    (_, _, base_time, base_size, _) = rows[0]
+    print('{:<34} {:>9} {:>9} {:>11} {:>9}'.format(
+        'Pruning', 'Features', 'Seconds', 'Bytes', 'Accuracy'))
+    for (name, features, elapsed, size, accuracy) in rows:
+        print('{:<34} {:>9} {:>9.3f} {:>11} {:>9.4f}'.format(
+            name, features, elapsed, size, accuracy))
+    for (name, features, elapsed, size, accuracy) in rows[1:]:
+        print('{}: {:.1%} of the training time, {:.1%} of the size'.format(
+            name, elapsed / base_time if base_time else 0,
+            size / base_size if base_size else 0))
+    return rows
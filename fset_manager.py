@@ -17,6 +17,12 @@ import ps
 
 TAGGED = 'training_passages/tagged_text/'
 
+# How much text to read at a time when streaming, and how much to hold while
+# waiting for a paragraph break outside of a quote before cutting on
+# whitespace instead.
+CHUNK_SIZE = 2 ** 16
+MAX_BUFFER = 2 ** 20
+
 FeatureContext = namedtuple('FeatureContext',
                             ['history', 'current', 'lookahead'])
 TaggedToken = namedtuple('TaggedToken', ['token', 'tag', 'start', 'end'])
@@ -55,6 +61,90 @@ def split_sentences(text, tokenizer=None, offset=0):
         yield sent_tokens
 
 
+def split_quote_segments(text, in_quote=False):
+    """\
+    Splits text into quotes and non-quotes on double quotation marks, like
+    `ps.split_quoted_quotes`, except that it can start inside of a quote.
+    This returns the segments and whether the text ends inside of a quote,
+    so that a long text can be split up a piece at a time.
+
+    """
+    segments = []
+    start = 0
+    for match in re.finditer(r'"', text):
+        end = match.end() if in_quote else match.start()
+        segments.append(text[start:end])
+        start = end
+        in_quote = not in_quote
+    segments.append(text[start:])
+    return ([segment for segment in segments if segment], in_quote)
+
+
+def ends_in_quote(text, in_quote):
+    """This returns whether a piece starting in `in_quote` ends in one."""
+    return in_quote != (text.count('"') % 2 == 1)
+
+
+def paragraph_cuts(text, in_quote=False):
+    """\
+    This returns the offsets to cut `text` into paragraphs at: after the
+    first newline of each paragraph break that isn't inside of a double
+    quote, so that no quote is split between two pieces. `in_quote` is
+    whether the text starts inside of a quote.
+
+    """
+    cuts = []
+    for match in re.finditer(r'"|\n(?=\n)', text):
+        if match.group() == '"':
+            in_quote = not in_quote
+        elif not in_quote:
+            cuts.append(match.end())
+    return cuts
+
+
+def read_paragraphs(fin, chunk_size=CHUNK_SIZE, max_buffer=MAX_BUFFER):
+    """\
+    This reads a file a chunk at a time and yields (offset, text) pieces,
+    one per paragraph, cutting in the same places as `split_paragraphs`
+    whatever the chunk size, so no sentence or quote is cut in half. If
+    there's no such break in `max_buffer` characters, it cuts on the last
+    whitespace instead.
+
+    """
+    buf = ''
+    offset = 0
+    in_quote = False
+    while True:
+        data = fin.read(chunk_size)
+        buf += data
+        if data:
+            cuts = paragraph_cuts(buf, in_quote)
+            if not cuts and len(buf) >= max_buffer:
+                cut = max(buf.rfind(' '), buf.rfind('\n'))
+                cuts = [len(buf) if cut < 0 else cut + 1]
+        else:
+            cuts = [len(buf)] if buf else []
+        start = 0
+        for cut in cuts:
+            yield (offset + start, buf[start:cut])
+            in_quote = ends_in_quote(buf[start:cut], in_quote)
+            start = cut
+        offset += start
+        buf = buf[start:]
+        if not data:
+            break
+
+
+def split_paragraphs(text):
+    """\
+    This splits a text that's already in memory into (offset, text) pieces
+    on paragraph breaks, cutting in the same places as `read_paragraphs`.
+    """
+    cuts = [0] + paragraph_cuts(text) + [len(text)]
+    return [(start, text[start:end])
+            for (start, end) in zip(cuts, cuts[1:]) if end > start]
+
+
 def tag_token_spans(sentences, tagger):
     """\
     This uses tagger to split apart tokens (token, span) and returns ((token,
@@ -107,6 +197,19 @@ def build_trainer(tagged_sents, default_tag='DEFAULT'):
     return tagger3
 
 
+def build_tagger(testing=False):
+    """\
+    Return the POS tagger trained on the Brown corpus. This is slow, so build
+    it once and pass it to `get_tagged_tokens` when tagging many documents.
+    """
+    if testing:
+        # train against a smaller version of the corpus so that it
+        # doesn't take years during testing.
+        return build_trainer(brown.tagged_sents(categories='news'))
+    else:
+        return build_trainer(brown.tagged_sents())
+
+
 def tag_quotes(text, is_quote):
     """\
     Takes a list of sentence tokens (lists of pairs of tokens and span indexes)
@@ -167,14 +270,11 @@ class AQuoteProcess:
             yield list(window)
 
     # FileName -> [[((TOKEN, TAG), (START, END))]]
-    def get_tagged_tokens(self, corpus=TAGGED, testing=False):
-        """This tokenizes, segments, and tags all the files in a directory."""
-        if testing:
-            # train against a smaller version of the corpus so that it
-            # doesn't take years during testing.
-            tagger = build_trainer(brown.tagged_sents(categories='news'))
-        else:
-            tagger = build_trainer(brown.tagged_sents())
+    def get_tagged_tokens(self, corpus=TAGGED, testing=False, tagger=None):
+        """This tokenizes, segments, and tags all the files in a directory.
+        If no tagger is given, this builds one."""
+        if tagger is None:
+            tagger = build_tagger(testing)
         tokens_and_spans = self.tokenize_corpus(corpus)
         tagged_spanned_tokens = tag_token_spans(
             tokens_and_spans,
@@ -202,20 +302,20 @@ class AQuoteProcess:
             with open(filename) as fin:
                 data = fin.read()
 
-            for start, end in tokenizer.span_tokenize(data):
-                sent = data[start:end]
-                sent_tokens = []
-                matches = re.finditer(
-                    r'\w+|[\'\"\/^/\,\-\:\.\;\?\!\(0-9]', sent
-                )
-                for match in matches:
-                    mstart, mend = match.span()
-                    sent_tokens.append(
-                        (match.group(0).lower().replace('_', ''),
-                         (mstart+start, mend+start))
-                    )
+            for sent_tokens in self.tokenize_text(data, tokenizer):
                 yield sent_tokens
 
+    def tokenize_text(self, text, tokenizer=None):
+        """Read one text as a list of sentences, each of which is a list of
+        tokens and the spans in which they occur in the text."""
+        return split_sentences(text, tokenizer)
+
+    # Text -> [[((TOKEN, TAG), (START, END))]]
+    def tag_text(self, text, tagger, tokenizer=None):
+        """This tokenizes, segments, and tags one text that's already in
+        memory."""
+        return tag_token_spans(self.tokenize_text(text, tokenizer), tagger)
+
 
 class QuotePoint(AQuoteProcess):
     """\
@@ -381,13 +481,62 @@ class InternalStyle(AQuoteProcess):
                 print(filename)
                 data = fin.read()
 
-            segment_start = 0
+            for sent_tokens in self.tokenize_text(data, tokenizer):
+                yield sent_tokens
+
+    def tokenize_text(self, text, tokenizer=None):
+        """Split one text into quotes and non-quotes, and then split those
+        into sentences of tokens and their spans in the text."""
+        if tokenizer is None:
+            tokenizer = nltk.load(
+                'tokenizers/punkt/{0}.pickle'.format('english'))
 
-            for span in ps.split_quoted_quotes(data):
-                for sent_tokens in split_sentences(span, tokenizer,
-                                                   segment_start):
-                    yield sent_tokens
-                segment_start += len(span)
+        segment_start = 0
+
+        for span in ps.split_quoted_quotes(text):
+            for sent_tokens in split_sentences(span, tokenizer,
+                                               segment_start):
+                yield sent_tokens
+            segment_start += len(span)
+
+    def tokenize_stream(self, fin, tokenizer=None, chunk_size=CHUNK_SIZE):
+        """\
+        Read a file or stream a paragraph at a time. For each piece, this
+        yields its offset, its text, and its sentences (tokens and spans
+        relative to the whole stream). Whether the stream is inside a quote
+        is carried from one piece to the next, so memory stays bounded by
+        the piece size however long the input is.
+
+        Since it can't count the whole text first, this only splits quotes
+        on double quotation marks.
+        """
+        if tokenizer is None:
+            tokenizer = nltk.load(
+                'tokenizers/punkt/{0}.pickle'.format('english'))
+
+        in_quote = False
+        for (offset, text) in read_paragraphs(fin, chunk_size):
+            (sentences, in_quote) = self.tokenize_piece(text, offset,
+                                                        in_quote, tokenizer)
+            yield (offset, text, sentences)
+
+    def tokenize_piece(self, text, offset=0, in_quote=False, tokenizer=None):
+        """\
+        Split one piece of a longer text, starting at `offset` and inside a
+        quote or not, into sentences. This returns the sentences and whether
+        the piece ends inside of a quote.
+        """
+        if tokenizer is None:
+            tokenizer = nltk.load(
+                'tokenizers/punkt/{0}.pickle'.format('english'))
+
+        (segments, in_quote) = split_quote_segments(text, in_quote)
+        sentences = []
+        segment_start = offset
+        for segment in segments:
+            sentences += split_sentences(segment, tokenizer, segment_start)
+            segment_start += len(segment)
+        return (sentences, in_quote)
 
 
 Current = InternalStyle
@@ -0,0 +1,155 @@
+"""\
+Incremental re-marking for edited documents. Hand fixes like the ones in
+changes.txt only touch a line or two, but marking the document again tags
+and classifies the whole novel.
+
+Marking incrementally saves a state file (in a tree beside the marked
+output) with a hash of each paragraph, whether it starts inside of a quote, and the labels
+of its sentences. The next time the document is marked, any paragraph with
+the same text and the same quote state is reused. Only the paragraphs that
+changed, plus the ones after them whose quote state an edit flipped, are
+tokenized, tagged, and classified again.
+
+Quote state is carried across paragraphs on double quotation marks, the
+same way that `mark_quotes.py --stream` does it.
+"""
+
+
+import hashlib
+import json
+import os
+
+import nltk
+
+import batch_classify
+import compact_model
+from fset_manager import ends_in_quote, split_paragraphs, tag_token_spans
+
+
+# State files go in their own tree, mirroring the marked output, so that
+# nothing walking the marked output runs into them.
+PREFIX = 'state_'
+STATE = '.state.json'
+
+
+def classifier_key(classifier_path):
+    """\
+    This identifies a classifier by its path and modification time, so the
+    state from an older version of the classifier isn't reused.
+    """
+    path = classifier_path
+    if compact_model.is_model(path):
+        path = os.path.join(path, compact_model.VOCAB)
+    return '{}@{}'.format(os.path.abspath(classifier_path),
+                          os.stat(path).st_mtime_ns)
+
+
+def paragraph_hash(text):
+    return hashlib.sha1(text.encode('utf8')).hexdigest()
+
+
+def load_state(path, key):
+    """\
+    This reads a state file and returns {(hash, in_quote): sentences}, where
+    each sentence is a (start, end, label) list relative to the paragraph.
+    If there's no state file, or it was written with a different
+    classifier, this returns an empty dict.
+    """
+    if not os.path.exists(path):
+        return {}
+    with open(path) as fin:
+        state = json.load(fin)
+    if state.get('classifier') != key:
+        return {}
+    return dict(((paragraph['hash'], paragraph['in_quote']),
+                 paragraph['sentences'])
+                for paragraph in state['paragraphs'])
+
+
+def save_state(path, key, source, paragraphs):
+    """\
+    This writes a state file. `paragraphs` is a list of (hash, in_quote,
+    sentences) triples.
+    """
+    state = {
+        'classifier': key,
+        'source': source,
+        'paragraphs': [
+            {'hash': para_hash, 'in_quote': in_quote, 'sentences': sentences}
+            for (para_hash, in_quote, sentences) in paragraphs
+        ],
+    }
+    with open(path, 'w') as fout:
+        json.dump(state, fout)
+
+
+def mark_incremental(text, previous, manager, tagger, classifier,
+                     tokenizer=None):
+    """\
+    This marks `text`, reusing the sentences in `previous` (from
+    `load_state`) for unchanged paragraphs. All of the new paragraphs are
+    classified in one batch.
+
+    This returns (quotes, paragraphs, reused): the (features, spans, quoted)
+    triples for the whole text, like `mark_quotes.insert_quotes_many` (with
+    None for the features of reused sentences), the (hash, in_quote,
+    sentences) triples to save, and the number of paragraphs reused.
+    """
+    if tokenizer is None:
+        tokenizer = nltk.load('tokenizers/punkt/{0}.pickle'.format('english'))
+
+    paragraphs = []
+    pending = []
+    in_quote = False
+    for (offset, paragraph) in split_paragraphs(text):
+        key = (paragraph_hash(paragraph), in_quote)
+        sentences = previous.get(key)
+        if sentences is None:
+            (tokens, _) = manager.tokenize_piece(paragraph, 0, in_quote,
+                                                 tokenizer)
+            pending.append((len(paragraphs), tokens))
+        paragraphs.append((offset, key, sentences))
+        in_quote = ends_in_quote(paragraph, in_quote)
+
+    fsets = []
+    owners = []
+    for (i, tokens) in pending:
+        for sentence in tag_token_spans(tokens, tagger):
+            fsets.append(manager.get_training_features(sentence))
+            owners.append(i)
+    labels = batch_classify.classify_many(
+        classifier, (features for (features, _, _) in fsets)
+    )
+    found = dict((i, []) for (i, _) in pending)
+    for (i, (_, spans, _), label) in zip(owners, fsets, labels):
+        if spans:
+            found[i].append([spans[0][0], spans[-1][1], label])
+
+    quotes = []
+    state = []
+    for (i, (offset, key, sentences)) in enumerate(paragraphs):
+        if sentences is None:
+            sentences = found[i]
+        for (start, end, label) in sentences:
+            quotes.append((None, [(offset + start, offset + end)], label))
+        state.append(key + (sentences,))
+
+    return (quotes, state, len(paragraphs) - len(pending))
+
+
+def remark_file(input_file_path, path, classifier_path, manager, tagger,
+                classifier):
+    """\
+    This marks one file incrementally against the state file `path`, saves
+    the new state there, and returns the quotes.
+    """
+    with open(input_file_path, 'r') as fin:
+        text = fin.read()
+    key = classifier_key(classifier_path)
+    (quotes, paragraphs, reused) = mark_incremental(
+        text, load_state(path, key), manager, tagger, classifier,
+    )
+    save_state(path, key, input_file_path, paragraphs)
+    print('{}: reused {} of {} paragraphs'.format(
+        input_file_path, reused, len(paragraphs)))
+    return quotes
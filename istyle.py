@@ -18,8 +18,10 @@ from nltk.corpus import brown, names
 import pickle
 import csv
 import os
+import batch_classify
 from ps import all_files
 from train_quotes import get_sets
+import weighted_training
 import statistics
 import operator
 
@@ -35,12 +37,12 @@ second = operator.itemgetter(1)
 
 def count_quotation_marks(text):
     """"counts the number of double quotation marks in a text"""
-    return len(list(re.finditer(r'"', text)))
+    return text.count('"')
 
 
 def count_single_quotation_marks(text):
     """counts number of single quotation marks in a text"""
-    return len(list(re.finditer(r"'", text)))
+    return text.count("'")
 
 
 def find_quoted_quotes(text):
@@ -130,8 +132,8 @@ def cross_validate(cls, training_features, num_folds=10):
         testing_this_round = training_features[i*subset_size:][:subset_size]
         training_this_round = (training_features[:i*subset_size] +
                                training_features[(i+1)*subset_size:])
-        classifier = cls.train(training_this_round)
-        accuracy = nltk.classify.accuracy(classifier, testing_this_round)
+        classifier = weighted_training.train(cls, training_this_round)
+        accuracy = batch_classify.accuracy(classifier, testing_this_round)
         accuracies.append(accuracy)
         print('Accuracy for fold {} = {}'.format(i, accuracy))
 
@@ -156,8 +158,8 @@ def cross_validate_sets(cls, training_features, num_folds=10):
 def cross_validate_p(cls, training, test):
     """This performs the cross-validation on one fold."""
     # print('TRAINING', training)
-    classifier = cls.train(training)
-    accuracy = nltk.classify.accuracy(classifier, test)
+    classifier = weighted_training.train(cls, training)
+    accuracy = batch_classify.accuracy(classifier, test)
     return (cls, accuracy)
 
 
@@ -176,7 +178,7 @@ def report_classifier(cls, accuracy, training, test, featureset, outdir):
     name = cls.__name__
     output = os.path.join(outdir, name + '.pickle')
     baseline = get_baseline(cls, training, test, False)
-    classifier = cls.train(featureset)
+    classifier = weighted_training.train(cls, featureset)
     with open(output, 'wb') as fout:
         pickle.dump(classifier, fout)
     return (output, accuracy, baseline)
@@ -186,8 +188,8 @@ def get_baseline(cls, training, test, base_value):
     """This returns the accuracy for a baseline training, i.e.,
     training based on everything being `base_value`."""
     baseline = [(fs, base_value) for (fs, _) in training]
-    classifier = cls.train(baseline)
-    return nltk.classify.accuracy(classifier, test)
+    classifier = weighted_training.train(cls, baseline)
+    return batch_classify.accuracy(classifier, test)
 
 
 def get_features(sent):
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+
+
+"""\
+A long-running marking server. It keeps the tagger, the punkt tokenizer, and
+the classifiers loaded in a pool of worker processes, so marking a passage
+doesn't pay several seconds of startup every time.
+
+Clients connect to a Unix socket (or a localhost TCP port) and send one JSON
+request per line:
+
+    {"text": "...", "classifier": "internal/tagged/DecisionTreeClassifier"}
+
+and get one JSON response per line back:
+
+    {"spans": [[start, end], ...]}
+
+The spans are the quoted sentences, as offsets into the text. The classifier
+is named relative to the classifier folder, without its extension; it can be
+left out if there's only one. If a classifier's file changes on disk, the
+workers reload it before the next request that uses it.
+
+usage: mark_daemon.py [-s SOCKET | -p PORT] [-d CLASSIFIER_DIR] [-j JOBS]
+                      [--cache CACHE_FILE]
+"""
+
+
+import argparse
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import re
+import socket
+import sys
+
+import nltk
+
+import compact_model
+import mark_quotes
+import sentence_cache
+import standoff
+import train_quotes
+from fset_manager import Current, build_tagger
+
+
+SOCKET = 'mark_daemon.sock'
+CLASSIFIERS = 'classifiers'
+
+# Set in each worker process by `init_worker`.
+_WORKER = {}
+
+
+def classifier_names(classifier_dir):
+    """\
+    This maps the name of each classifier under `classifier_dir` (its path
+    relative to the folder, without the extension) to its path.
+    """
+    names = {}
+    for path in mark_quotes.find_classifiers(classifier_dir):
+        name = os.path.relpath(path, classifier_dir)
+        names[re.sub(r'\.(pickle|model)$', '', name)] = path
+    return names
+
+
+def init_worker(tagger, cache_path=None, cache_size=None):
+    """\
+    This sets up a worker process with the tagger and a warm punkt
+    tokenizer. With the fork start method, the tagger is inherited from the
+    parent rather than rebuilt. If there's a `cache_path`, the worker also
+    opens the sentence cache there.
+    """
+    _WORKER['tagger'] = tagger
+    _WORKER['tokenizer'] = nltk.load(
+        'tokenizers/punkt/{0}.pickle'.format('english'))
+    _WORKER['manager'] = Current(train_quotes.is_quote, train_quotes.is_word)
+    _WORKER['classifiers'] = {}
+    _WORKER['cache'] = None
+    if cache_path is not None:
+        _WORKER['cache'] = sentence_cache.SentenceCache(
+            cache_path, cache_size or sentence_cache.MAX_ENTRIES)
+
+
+def load_entry(path):
+    """\
+    This returns the worker's (mtime, classifier, digest) for a classifier,
+    loading it the first time and reloading it whenever the file's
+    modification time changes. A compact model is re-exported in place, so
+    its vocab.json (written last) is the file to watch. The digest is only
+    computed when there's a sentence cache.
+    """
+    stamp_path = path
+    if compact_model.is_model(path):
+        stamp_path = os.path.join(path, compact_model.VOCAB)
+    mtime = os.stat(stamp_path).st_mtime_ns
+    cached = _WORKER['classifiers'].get(path)
+    if cached is None or cached[0] != mtime:
+        digest = None
+        if _WORKER['cache'] is not None:
+            digest = sentence_cache.classifier_digest(path)
+        cached = (mtime, mark_quotes.load_classifier(path), digest)
+        _WORKER['classifiers'][path] = cached
+    return cached
+
+
+def get_classifier(path):
+    """This returns the worker's copy of a classifier."""
+    return load_entry(path)[1]
+
+
+def warm(paths):
+    """This loads the classifiers into a worker ahead of the requests."""
+    for path in paths:
+        get_classifier(path)
+    return os.getpid()
+
+
+def mark_request(classifier_path, text):
+    """This marks one text in a worker and returns its spans as lists."""
+    manager = _WORKER['manager']
+    tokenizer = _WORKER['tokenizer']
+    cache = _WORKER['cache']
+    (_, classifier, digest) = load_entry(classifier_path)
+    if cache is None:
+        fsets = [
+            manager.get_training_features(sentence)
+            for sentence in manager.tag_text(text, _WORKER['tagger'],
+                                             tokenizer)
+        ]
+        quotes = mark_quotes.insert_quotes_many(classifier, fsets)
+    else:
+        tagged = sentence_cache.tag_sentences(
+            cache, manager.tokenize_text(text, tokenizer), _WORKER['tagger'])
+        fsets = [manager.get_training_features(sentence)
+                 for sentence in tagged]
+        labels = sentence_cache.classify_sentences(
+            cache, classifier, digest, tagged,
+            (features for (features, _, _) in fsets),
+        )
+        quotes = mark_quotes.label_quotes(fsets, labels)
+        cache.commit()
+    return standoff.quote_spans(quotes).tolist()
+
+
+class MarkServer(object):
+    """\
+    This accepts connections and hands the marking off to the process pool,
+    so many requests can be in flight at once.
+    """
+
+    def __init__(self, classifiers, pool):
+        self.classifiers = classifiers
+        self.pool = pool
+
+    def resolve(self, name):
+        """This returns the path for a classifier name from a request."""
+        if name is None:
+            if len(self.classifiers) != 1:
+                raise ValueError('Specify one of: {}'.format(
+                    ', '.join(sorted(self.classifiers))))
+            return next(iter(self.classifiers.values()))
+        try:
+            return self.classifiers[name]
+        except KeyError:
+            raise ValueError('Unknown classifier: {}'.format(name))
+
+    async def respond(self, line):
+        """\
+        This turns one request line into a response dict. A request that
+        can't be parsed or marked gets an error response, so it doesn't
+        drop the connection.
+        """
+        try:
+            request = json.loads(line)
+            path = self.resolve(request.get('classifier'))
+            text = request['text']
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            return {'error': str(exc)}
+        loop = asyncio.get_running_loop()
+        try:
+            spans = await loop.run_in_executor(self.pool, mark_request, path,
+                                               text)
+        except Exception as exc:
+            return {'error': str(exc)}
+        return {'spans': spans}
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                response = await self.respond(line)
+                writer.write(json.dumps(response).encode('utf8') + b'\n')
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+async def serve(args, classifiers, pool):
+    server = MarkServer(classifiers, pool)
+    if args.port is not None:
+        listener = await asyncio.start_server(server.handle, '127.0.0.1',
+                                              args.port, limit=2 ** 26)
+        print('listening on 127.0.0.1:{}'.format(args.port))
+    else:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        listener = await asyncio.start_unix_server(server.handle, args.socket,
+                                                   limit=2 ** 26)
+        print('listening on {}'.format(args.socket))
+    async with listener:
+        await listener.serve_forever()
+
+
+def request(text, classifier=None, socket_path=SOCKET, port=None):
+    """\
+    This is a small blocking client: it sends one text to a running daemon
+    and returns the response dict.
+    """
+    if port is not None:
+        conn = socket.create_connection(('127.0.0.1', port))
+    else:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(socket_path)
+    with conn, conn.makefile('rwb') as stream:
+        message = {'text': text}
+        if classifier is not None:
+            message['classifier'] = classifier
+        stream.write(json.dumps(message).encode('utf8') + b'\n')
+        stream.flush()
+        return json.loads(stream.readline().decode('utf8'))
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-s', '--socket', dest='socket', default=SOCKET,
+                        help='The Unix socket to listen on. '
+                             'Default = {}.'.format(SOCKET))
+    parser.add_argument('-p', '--port', dest='port', type=int,
+                        help='Listen on this localhost TCP port instead of '
+                             'a Unix socket.')
+    parser.add_argument('-d', '--classifier-dir', dest='classifier_dir',
+                        default=CLASSIFIERS,
+                        help='The folder of classifiers to serve. '
+                             'Default = {}.'.format(CLASSIFIERS))
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='The number of worker processes. '
+                             'Default = one per CPU.')
+    parser.add_argument('--cache', dest='cache', metavar='CACHE_FILE',
+                        help='A SQLite file of sentence tags and labels '
+                             'that the workers share.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int,
+                        default=sentence_cache.MAX_ENTRIES,
+                        help='The most entries to keep in --cache. '
+                             'Default = {}.'.format(
+                                 sentence_cache.MAX_ENTRIES))
+
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    classifiers = classifier_names(args.classifier_dir)
+    print('{} classifiers'.format(len(classifiers)))
+    tagger = build_tagger()
+    with ProcessPoolExecutor(args.jobs, initializer=init_worker,
+                             initargs=(tagger, args.cache,
+                                       args.cache_size)) as pool:
+        paths = list(classifiers.values())
+        for _ in range(args.jobs or os.cpu_count()):
+            pool.submit(warm, paths)
+        try:
+            asyncio.run(serve(args, classifiers, pool))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -8,19 +8,34 @@ in it, based on the classifier."""
 
 
 import argparse
-from collections import deque
+from collections import Counter, deque
+from multiprocessing.pool import Pool
 import pickle
 import sys
 
+import numpy as np
+
+import batch_classify
+import compact_model
+import incremental
+import sentence_cache
+import standoff
+import thresholds
 import train_quotes
-from fset_manager import Current
+from fset_manager import (CHUNK_SIZE, Current, build_tagger, tag_quotes,
+                          tag_token_spans)
 import os
 import re
 
 CORPUS = 'corpus'
+ENSEMBLE = 'ensemble'
 
 def load_classifier(filename):
-    """Loads the classifier from pickled into `filename`."""
+    """Loads the classifier from pickled into `filename`. If `filename` is a
+    compact model directory (see compact_model.py), this memory-maps that
+    instead."""
+    if compact_model.is_model(filename):
+        return compact_model.load_model(filename)
     with open(filename, 'rb') as fin:
         return pickle.load(fin)
 
@@ -33,6 +48,117 @@ def insert_quotes(classifier, fsets, sentence):
     yield (features, span, classifier.classify(features))
 
 
+def insert_quotes_many(classifier, fsets):
+    """\
+    This is `insert_quotes` for a whole sequence of feature sets at once. It
+    classifies them in one batch and yields (features, span, quoted) for
+    each.
+    """
+    fsets = list(fsets)
+    labels = batch_classify.classify_many(
+        classifier, (features for (features, _, _) in fsets)
+    )
+    return label_quotes(fsets, labels)
+
+
+def explicit_states(tagged_sentences, is_quote):
+    """\
+    This returns whether each sentence's quote state is fixed by explicit
+    quotation marks, following the parity in `tag_quotes`: sentences with
+    quotation marks in them, and sentences inside an open quote, are quoted.
+    The rest are ambiguous and need a classifier.
+    """
+    return [state for (_, state) in tag_quotes(tagged_sentences, is_quote)]
+
+
+def fill_ambiguous(fixed, labels):
+    """\
+    This labels the fixed sentences as quoted and gives the ambiguous ones
+    `labels`, in order.
+    """
+    labels = iter(labels)
+    return [True if is_fixed else next(labels) for is_fixed in fixed]
+
+
+def tag_document(manager, input_file_path, tagger, cache=None):
+    """\
+    This tokenizes, segments, and tags one file, taking the tags of any
+    sentences already in `cache` (a sentence_cache.SentenceCache) from there.
+    """
+    if cache is None:
+        return list(manager.get_tagged_tokens(input_file_path, tagger=tagger))
+    return sentence_cache.tag_sentences(
+        cache, manager.tokenize_corpus(input_file_path), tagger)
+
+
+def classify_ambiguous(classifier, tagged, fsets, fixed, cache=None,
+                       digest=None):
+    """\
+    This returns the labels of the sentences that aren't fixed, taking the
+    ones already in `cache` for the classifier with `digest` from there.
+    """
+    pairs = [(sentence, features)
+             for (sentence, (features, _, _), is_fixed)
+             in zip(tagged, fsets, fixed)
+             if not is_fixed]
+    if cache is None:
+        return batch_classify.classify_many(
+            classifier, (features for (_, features) in pairs))
+    return sentence_cache.classify_sentences(
+        cache, classifier, digest, [sentence for (sentence, _) in pairs],
+        [features for (_, features) in pairs],
+    )
+
+
+def print_explicit_counts(counts):
+    print('{} of {} sentences classified; {} classify calls saved'.format(
+        counts['classified'], counts['sentences'],
+        counts['sentences'] - counts['classified']))
+
+
+def label_quotes(fsets, labels):
+    """\
+    This pairs feature sets with labels that have already been found and
+    yields (features, span, quoted) for each, like `insert_quotes_many`.
+    """
+    for ((features, span, _), label) in zip(fsets, labels):
+        yield (features, span, label)
+
+
+def mark_text(text, manager, tagger, classifier):
+    """\
+    This marks a text that's already in memory and returns the quoted
+    sentence spans, as an (n, 2) array of offsets into `text`.
+    """
+    fsets = [manager.get_training_features(sentence)
+             for sentence in manager.tag_text(text, tagger)]
+    return standoff.quote_spans(insert_quotes_many(classifier, fsets))
+
+
+def mark_stream(fin, fout, manager, tagger, classifier, output_format='text',
+                chunk_size=CHUNK_SIZE):
+    """\
+    This reads text from `fin` a paragraph at a time and writes the marked
+    output for each piece to `fout` as soon as it's classified. With the
+    `text` format, that's the text with a ^ before each quoted sentence;
+    with `spans`, it's one JSON line per quoted sentence, with offsets into
+    the whole stream.
+    """
+    if output_format not in ('text', 'spans'):
+        raise ValueError('Cannot stream the {} format.'.format(output_format))
+    for (offset, text, sentences) in manager.tokenize_stream(
+            fin, chunk_size=chunk_size):
+        fsets = [manager.get_training_features(sentence)
+                 for sentence in tag_token_spans(sentences, tagger)]
+        spans = standoff.quote_spans(insert_quotes_many(classifier, fsets))
+        if output_format == 'text':
+            fout.write(standoff.render_carets(text, spans - offset))
+        else:
+            for (start, end) in spans.tolist():
+                fout.write('{{"start": {}, "end": {}}}\n'.format(start, end))
+        fout.flush()
+
+
 def quote_output(classifier, manager, input_file, tagged_tokens, output_file):
     """\
     Classifies input sentences for quotes. This assumes that the classifier
@@ -41,15 +167,12 @@ def quote_output(classifier, manager, input_file, tagged_tokens, output_file):
     In other words, we no longer use this.
     """
 
-    quotes = []
-
     # before we could easily insert quotes. maybe not so now?
-    for sentence in tagged_tokens:
-        quotes += insert_quotes(
-            classifier,
-            manager.get_training_features(sentence),
-            sentence
-        )
+    quotes = list(insert_quotes_many(
+        classifier,
+        (manager.get_training_features(sentence)
+         for sentence in tagged_tokens),
+    ))
     quotes.reverse()
 
     with open(input_file) as fin:
@@ -84,8 +207,82 @@ def parse_args(argv=None):
                         help='The classifier to use marking the quotes.')
     parser.add_argument('-o', '--output', dest='output', metavar='OUTPUT_FILE',
                         help='The folder to write the output sentences into.', default='marked_output')
-
-    return parser.parse_args(argv)
+    parser.add_argument('-d', '--classifier-dir', dest='classifier_dir',
+                        metavar='CLASSIFIER_DIR',
+                        help='Mark the input folder with every classifier in '
+                             'this folder, tagging each document only once. '
+                             'The input has to be a folder.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='The number of worker processes for '
+                             '--classifier-dir. Default = one per CPU.')
+    parser.add_argument('-e', '--ensemble', dest='ensemble',
+                        choices=batch_classify.ENSEMBLE_METHODS,
+                        help='With --classifier-dir, also mark the input '
+                             'with the majority vote (vote) or the averaged '
+                             'label probabilities (average) of all of the '
+                             'classifiers.')
+    parser.add_argument('-l', '--labels', dest='labels', action='store_true',
+                        help='With --classifier-dir, also write a table of '
+                             'every classifier\'s label for every sentence '
+                             'in each document.')
+    parser.add_argument('-f', '--format', dest='format', default='text',
+                        choices=['text'] + sorted(standoff.FORMATS),
+                        help='Write the marked text with carets (text), or '
+                             'a sidecar of quoted spans in source offsets as '
+                             'JSON lines (spans) or a NumPy array (npy). '
+                             'Default = text.')
+    parser.add_argument('-x', '--explicit', dest='explicit',
+                        action='store_true',
+                        help='Mark sentences with quotation marks, and the '
+                             'ones inside open quotes, as quoted without '
+                             'classifying them.')
+    parser.add_argument('--cache', dest='cache', metavar='CACHE_FILE',
+                        help='A SQLite file to keep the tags and labels of '
+                             'sentences in, so sentences seen before are '
+                             'not tagged or classified again.')
+    parser.add_argument('--cache-size', dest='cache_size', type=int,
+                        default=sentence_cache.MAX_ENTRIES,
+                        help='The most entries to keep in --cache. Default '
+                             '= {}.'.format(sentence_cache.MAX_ENTRIES))
+    parser.add_argument('--scores', dest='scores', action='store_true',
+                        help='Also save the label probabilities of every '
+                             'sentence, so thresholds.py can mark the input '
+                             'again with other thresholds.')
+    parser.add_argument('--incremental', dest='incremental',
+                        action='store_true',
+                        help='Only re-mark the paragraphs that changed since '
+                             'the last incremental run, reusing the rest.')
+    parser.add_argument('-s', '--stream', dest='stream', action='store_true',
+                        help='Read the text from stdin and write the marked '
+                             'text or spans to stdout a paragraph at a time.')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int,
+                        default=CHUNK_SIZE,
+                        help='How many characters to read at a time with '
+                             '--stream. Default = {}.'.format(CHUNK_SIZE))
+
+    args = parser.parse_args(argv)
+    if args.stream and args.classifier is None:
+        parser.error('--stream needs a --classifier.')
+    if ((args.ensemble is not None or args.labels) and
+            args.classifier_dir is None):
+        parser.error('--ensemble and --labels need a --classifier-dir.')
+    if (args.classifier_dir is not None and
+            (args.input is None or not os.path.isdir(args.input))):
+        parser.error('--classifier-dir needs an --input folder.')
+    if args.scores and (args.stream or args.incremental):
+        parser.error('--scores does not work with --stream or '
+                     '--incremental.')
+    if args.cache is not None and (args.stream or args.incremental):
+        parser.error('--cache does not work with --stream or --incremental.')
+    if args.explicit and (args.stream or args.incremental):
+        parser.error('--explicit does not work with --stream or '
+                     '--incremental.')
+    if args.incremental and (args.stream or args.classifier_dir is not None):
+        parser.error('--incremental does not work with --stream or '
+                     '--classifier-dir.')
+    if args.stream and args.format == 'npy':
+        parser.error('--stream can only write text or spans.')
+    return args
 
 
 def all_files(corpus=CORPUS):
@@ -101,47 +298,165 @@ def all_files(corpus=CORPUS):
     return texts
 
 
-def mark_single_text(input_file_path, args, manager, classifier):
+def classifier_parts(classifier_path):
+    """\
+    This splits a classifier path laid out like train_quotes writes them
+    (classifiers/MODEL/CORPUS/NAME.pickle) into (model, corpus, name).
+    """
+    parts = os.path.normpath(classifier_path).split(os.sep)
+    (model, corpus, name) = parts[-3:]
+    return (model, corpus, re.sub(r'\.(pickle|model)$', '', name))
+
+
+def marked_output_path(output, input_dir, classifier_path, input_file_path):
+    """\
+    This returns the path to write the marked version of `input_file_path`
+    to, creating the directories for it.
+    """
+    return parts_output_path(output, input_dir,
+                             classifier_parts(classifier_path),
+                             input_file_path)
+
+
+def parts_output_path(output, input_dir, parts, input_file_path,
+                      prefix='marked_'):
+    """\
+    This is `marked_output_path` for a (model, corpus, name) triple that
+    doesn't come from a classifier path, like an ensemble's.
+    """
+    (model, corpus, classifier_name) = parts
+    out_dir = os.path.join(output, prefix + input_dir, model,
+                           'trained_on_' + corpus, classifier_name)
+    os.makedirs(out_dir, exist_ok=True)
+    return os.path.join(out_dir, os.path.basename(input_file_path))
+
+
+def write_marked_text(fout, data, quotes):
+    """\
+    This writes each sentence from `quotes` (features, spans, quoted), with
+    a ^ before the ones classified as quoted.
+    """
+    for (_, spans, quoted) in quotes:
+        if not spans:
+            continue
+        start = spans[0][0]
+        end = spans[-1][1]
+        if quoted:
+            fout.write('^')
+        fout.write(data[start:end])
+
+
+def write_marked(output_path, data, quotes, output_format='text',
+                 source=None):
+    """\
+    This writes the marked output for one document, either as the text with
+    carets or as a standoff sidecar of the quoted spans (see standoff.py).
+    """
+    if output_format == 'text':
+        with open(output_path, 'w') as fout:
+            write_marked_text(fout, data, quotes)
+    else:
+        standoff.write_spans(
+            standoff.sidecar_path(output_path, output_format),
+            standoff.quote_spans(quotes), source, len(data),
+        )
+
+
+def scores_output_path(args, classifier_path, input_file_path):
+    """This returns the path to write a document's scores to."""
+    return parts_output_path(
+        args.output, args.input, classifier_parts(classifier_path),
+        input_file_path, thresholds.PREFIX,
+    ) + thresholds.SCORES
+
+
+def score_ambiguous(classifier, fsets, fixed):
+    """\
+    This is `classify_ambiguous` for --scores: it returns (labels, probs,
+    order) for the sentences that aren't fixed, like
+    `batch_classify.classify_and_prob_many`, classifying them only once.
+    """
+    return batch_classify.classify_and_prob_many(
+        classifier, (features
+                     for ((features, _, _), is_fixed) in zip(fsets, fixed)
+                     if not is_fixed),
+    )
+
+
+def write_scores(output_path, fsets, fixed, probs, labels):
+    """\
+    This writes the span and label probabilities of each sentence, so the
+    document can be marked again with another threshold (see thresholds.py)
+    without classifying it again. `probs` holds the probabilities of
+    `labels` for the sentences that aren't fixed, and the sentences fixed
+    as quoted by explicit quotation marks are quoted with a probability of
+    one, whatever the threshold.
+    """
+    labels = list(labels)
+    probs = np.asarray(probs, dtype=np.float64).reshape((-1, len(labels)))
+    if True not in labels:
+        labels.append(True)
+        probs = np.column_stack((probs, np.zeros(len(probs))))
+    fixed = np.array(fixed, dtype=bool).reshape(-1)
+    rows = np.zeros((len(fsets), len(labels)))
+    rows[fixed, labels.index(True)] = 1
+    rows[~fixed] = probs
+    keep = [i for (i, (_, spans, _)) in enumerate(fsets) if spans]
+    spans = [(fsets[i][1][0][0], fsets[i][1][-1][1]) for i in keep]
+    thresholds.save_scores(output_path, spans, rows[keep], labels)
+
+
+def mark_single_text(input_file_path, args, manager, classifier, tagger=None,
+                     counts=None, cache=None, digest=None):
     print(args.classifier)
-    path_dump = re.split(r'\/', args.classifier)
-    model = path_dump[1]
-    corpus = path_dump[2]
-    classifier_name = re.sub(r'.pickle', '', path_dump[3])
+    if counts is None:
+        counts = Counter()
     if os.path.isdir(args.input):
-        if not os.path.exists(os.path.join(args.output, 'marked_' + args.input, model)):
-            os.makedirs(os.path.join(args.output, 'marked_' + args.input, model))
-        if not os.path.exists(os.path.join(args.output, 'marked_' + args.input, model,
-                              'trained_on_' + corpus)):
-            os.makedirs(os.path.join(args.output, 'marked_' + args.input, model, 'trained_on_' + corpus))
-        if not os.path.exists(os.path.join(args.output, 'marked_' + args.input, model,
-                                           'trained_on_' + corpus, classifier_name)):
-            os.makedirs(os.path.join(args.output, 'marked_' + args.input, model,
-                                     'trained_on_' + corpus, classifier_name))
-
-
-        with open(os.path.join(args.output, 'marked_' + args.input, model, 'trained_on_' + corpus,
-                               classifier_name, re.split(r'\/', input_file_path)[-1]), 'w') as fout:
-                with open(input_file_path, 'r') as fin:
-                    data = fin.read()
-
-                for sentence in manager.get_tagged_tokens(input_file_path):
-                    quotes = insert_quotes(
-                        classifier,
-                        manager.get_training_features(sentence),
-                        sentence
-                    )
-
-                    prev_quoted = False
-                    quotes = list(quotes)
-                    for (_, spans, quoted) in quotes:
-                        if not spans:
-                            continue
-                        start = spans[0][0]
-                        end = spans[-1][1]
-                        if prev_quoted != quoted:
-                            fout.write('^')
-                            prev_quoted = quoted
-                        fout.write(data[start:end])
+        output_path = marked_output_path(args.output, args.input,
+                                         args.classifier, input_file_path)
+        with open(input_file_path, 'r') as fin:
+            data = fin.read()
+
+        if args.incremental:
+            state_path = parts_output_path(
+                args.output, args.input, classifier_parts(args.classifier),
+                input_file_path, incremental.PREFIX,
+            ) + incremental.STATE
+            quotes = incremental.remark_file(input_file_path, state_path,
+                                             args.classifier, manager,
+                                             tagger, classifier)
+        else:
+            tagged = tag_document(manager, input_file_path, tagger, cache)
+            fsets = [manager.get_training_features(sentence)
+                     for sentence in tagged]
+            fixed = [False] * len(fsets)
+            if args.explicit:
+                fixed = explicit_states(tagged, manager.is_quote)
+            if args.scores:
+                (ambiguous, probs, labels) = score_ambiguous(classifier,
+                                                             fsets, fixed)
+                write_scores(scores_output_path(args, args.classifier,
+                                                input_file_path),
+                             fsets, fixed, probs, labels)
+            else:
+                ambiguous = classify_ambiguous(classifier, tagged, fsets,
+                                               fixed, cache, digest)
+            quotes = label_quotes(fsets, fill_ambiguous(fixed, ambiguous))
+            counts.update(sentences=len(fsets), classified=len(ambiguous))
+        write_marked(output_path, data, quotes, args.format, input_file_path)
+        if cache is not None:
+            cache.commit()
+
+
+def open_cache(args):
+    """This opens the sentence cache from the command line, if there is one."""
+    if args.cache is None:
+        return None
+    return sentence_cache.SentenceCache(args.cache, args.cache_size)
+
+
+def print_cache_counts(hits, misses):
+    print('sentence cache: {} hits, {} misses'.format(hits, misses))
 
 
 def mark_all_files(args):
@@ -151,12 +466,186 @@ def mark_all_files(args):
     manager = Current(train_quotes.is_quote, train_quotes.is_word)
     if os.path.isdir(args.input):
         create_folder_structure(args, True)
+        tagger = build_tagger()
+        counts = Counter()
+        cache = open_cache(args)
+        digest = None
+        if cache is not None:
+            digest = sentence_cache.classifier_digest(args.classifier)
         for input_fname in all_files(args.input):
-            mark_single_text(input_fname, args, manager, classifier)
+            mark_single_text(input_fname, args, manager, classifier, tagger,
+                             counts, cache, digest)
+        if args.explicit:
+            print_explicit_counts(counts)
+        if cache is not None:
+            print_cache_counts(cache.hits, cache.misses)
+            cache.close()
     else:
         create_folder_structure(args, False)
         mark_single_text(args.input, args, manager, classifier)
 
+
+def find_classifiers(classifier_dir):
+    """\
+    This returns the paths to all of the pickled classifiers and compact
+    models under `classifier_dir`.
+    """
+    found = []
+    for (root, dirs, files) in os.walk(classifier_dir):
+        for dn in sorted(dirs):
+            if compact_model.is_model(os.path.join(root, dn)):
+                found.append(os.path.join(root, dn))
+        dirs[:] = [dn for dn in dirs if not dn.endswith(compact_model.EXTENSION)]
+        for fn in sorted(files):
+            if fn.endswith('.pickle'):
+                found.append(os.path.join(root, fn))
+    return found
+
+
+# Set in each worker process by `init_batch_worker`.
+_BATCH = {}
+
+
+def init_batch_worker(args, tagger, classifiers, digests=None):
+    """\
+    This sets up a worker process for `mark_corpus`. With the fork start
+    method, the tagger and classifiers are inherited from the parent rather
+    than being rebuilt. `digests` maps classifier paths to their hashes for
+    the sentence cache.
+    """
+    _BATCH['args'] = args
+    _BATCH['tagger'] = tagger
+    _BATCH['classifiers'] = classifiers
+    _BATCH['digests'] = digests or {}
+    _BATCH['manager'] = Current(train_quotes.is_quote, train_quotes.is_word)
+    _BATCH['cache'] = open_cache(args)
+
+
+def mark_document(input_file_path):
+    """\
+    This tags one document and marks it with every classifier in the worker.
+    The document is tokenized, tagged, and turned into feature sets once.
+    This returns the path and a Counter of the sentences and classify calls.
+    """
+    args = _BATCH['args']
+    manager = _BATCH['manager']
+    with open(input_file_path, 'r') as fin:
+        data = fin.read()
+    cache = _BATCH['cache']
+    tagged = tag_document(manager, input_file_path, _BATCH['tagger'], cache)
+    fsets = [manager.get_training_features(sentence) for sentence in tagged]
+
+    fixed = [False] * len(fsets)
+    if args.explicit:
+        fixed = explicit_states(tagged, manager.is_quote)
+    ambiguous = [features
+                 for ((features, _, _), is_fixed) in zip(fsets, fixed)
+                 if not is_fixed]
+    columns = []
+    ambiguous_labels = []
+    for (classifier_path, classifier) in _BATCH['classifiers']:
+        if args.scores:
+            (found, probs, order) = score_ambiguous(classifier, fsets, fixed)
+            write_scores(scores_output_path(args, classifier_path,
+                                            input_file_path),
+                         fsets, fixed, probs, order)
+        else:
+            found = classify_ambiguous(
+                classifier, tagged, fsets, fixed, cache,
+                _BATCH['digests'].get(classifier_path),
+            )
+        ambiguous_labels.append(found)
+        labels = fill_ambiguous(fixed, ambiguous_labels[-1])
+        output_path = marked_output_path(args.output, args.input,
+                                         classifier_path, input_file_path)
+        write_marked(output_path, data, label_quotes(fsets, labels),
+                     args.format, input_file_path)
+        columns.append(('/'.join(classifier_parts(classifier_path)), labels))
+
+    if args.ensemble is not None:
+        labels = fill_ambiguous(fixed, batch_classify.ensemble_classify_many(
+            [classifier for (_, classifier) in _BATCH['classifiers']],
+            ambiguous, args.ensemble, ambiguous_labels,
+        ))
+        parts = (ENSEMBLE, 'all', args.ensemble)
+        output_path = parts_output_path(args.output, args.input, parts,
+                                        input_file_path)
+        write_marked(output_path, data, label_quotes(fsets, labels),
+                     args.format, input_file_path)
+        columns.append(('/'.join(parts), labels))
+
+    if args.labels:
+        write_label_table(
+            label_table_path(args.output, args.input, input_file_path),
+            [spans for (_, spans, _) in fsets], columns,
+        )
+    n_classifiers = len(_BATCH['classifiers'])
+    counts = Counter(sentences=len(fsets) * n_classifiers,
+                     classified=len(ambiguous) * n_classifiers)
+    if cache is not None:
+        cache.commit()
+        counts.update(cache_hits=cache.hits, cache_misses=cache.misses)
+        cache.hits = cache.misses = 0
+    return (input_file_path, counts)
+
+
+def label_table_path(output, input_dir, input_file_path):
+    """\
+    This returns the path to write the label table for `input_file_path`
+    to, creating the directory for it.
+    """
+    out_dir = os.path.join(output, 'labels_' + input_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    return os.path.join(out_dir, os.path.basename(input_file_path) + '.tsv')
+
+
+def write_label_table(output_path, spans, columns):
+    """\
+    This writes a tab-separated table with a row for each sentence: its start
+    and end offsets and then the label from each of `columns`, a list of
+    (name, labels) pairs.
+    """
+    with open(output_path, 'w') as fout:
+        fout.write('\t'.join(['start', 'end'] +
+                             [name for (name, _) in columns]) + '\n')
+        for (i, sentence_spans) in enumerate(spans):
+            if not sentence_spans:
+                continue
+            row = [sentence_spans[0][0], sentence_spans[-1][1]]
+            row += [labels[i] for (_, labels) in columns]
+            fout.write('\t'.join(str(cell) for cell in row) + '\n')
+
+
+def mark_corpus(args):
+    """\
+    This marks every document in args.input with every classifier in
+    args.classifier_dir. The tagger is built and the classifiers are loaded
+    once, and the documents are spread across a pool of workers.
+    """
+    classifiers = [(path, load_classifier(path))
+                   for path in find_classifiers(args.classifier_dir)]
+    print('{} classifiers'.format(len(classifiers)))
+    create_folder_structure(args, True)
+    tagger = build_tagger()
+
+    digests = {}
+    if args.cache is not None:
+        digests = dict((path, sentence_cache.classifier_digest(path))
+                       for (path, _) in classifiers)
+
+    counts = Counter()
+    with Pool(args.jobs, init_batch_worker,
+              (args, tagger, classifiers, digests)) as pool:
+        for (input_file_path, doc_counts) in pool.imap_unordered(
+                mark_document, all_files(args.input)):
+            print(input_file_path)
+            counts.update(doc_counts)
+    if args.explicit:
+        print_explicit_counts(counts)
+    if args.cache is not None:
+        print_cache_counts(counts['cache_hits'], counts['cache_misses'])
+
+
 def create_folder_structure(args, is_dir):
     print('is_dir' + str(is_dir))
     if is_dir:
@@ -197,7 +686,15 @@ def main():
     #                     fout.write('^')
     #                     prev_quoted = quoted
     #                 fout.write(data[start:end])
-    mark_all_files(args)
+    if args.stream:
+        manager = Current(train_quotes.is_quote, train_quotes.is_word)
+        mark_stream(sys.stdin, sys.stdout, manager, build_tagger(),
+                    load_classifier(args.classifier), args.format,
+                    args.chunk_size)
+    elif args.classifier_dir is not None:
+        mark_corpus(args)
+    else:
+        mark_all_files(args)
 
 
 
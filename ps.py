@@ -2,10 +2,11 @@
 # coding: utf-8
 
 
-import codecs
 import collections
+import csv
 import itertools
-import operator
+import json
+from multiprocessing import Pool
 import os
 import re
 import sys
@@ -19,23 +20,27 @@ import pandas as pd
 from bokeh.charts import Bar, output_file, show
 
 import numpy as np
+from scipy import sparse
+from sklearn.feature_extraction.text import (ENGLISH_STOP_WORDS,
+                                             TfidfTransformer)
+
+import charscan
+from density import (caret_locations, document_densities,
+                     find_quote_characters, find_quoted_quotes,
+                     location_bin_counts, quoted_quote_pattern)
+import docstore
+import standoff
 
 CORPUS_FOLDER = 'marked_output/marked_corpus/internal/trained_on_tagged/DecisionTreeClassifier'
 UNMARKED_CORPUS_FOLDER = 'corpus'
 
 def read_text(filename):
     """Read in the text from the file; return a processed text."""
-    with codecs.open(filename, 'r', 'utf8') as f:
-        return f.read()
-
-
-def clean_text(input_text):
-    """Clean the text by lowercasing and removing newlines."""
-    return input_text.replace('\n', ' ').lower()
+    return docstore.read_text(filename)
 
 
 def clean_and_read_text(input_text):
-    return clean_text(read_text(input_text))
+    return docstore.clean_and_read_text(input_text)
 
 
 def quotations_check(text, file_name):
@@ -59,11 +64,11 @@ def quotations_check(text, file_name):
 
 
 def count_quotation_marks(text):
-    return len(list(re.finditer(r'"', text)))
+    return text.count('"')
 
 
 def count_single_quotation_marks(text):
-    return len(list(re.finditer(r"'", text)))
+    return text.count("'")
 
 
 def print_long_quotes(text):
@@ -89,27 +94,9 @@ def print_matches_for_debug(text):
     debug.close()
 
 
-def find_quoted_quotes(text):
-    """This returns the regex matches from finding the quoted
-    quotes. Note: if the number of quotation marks is less than fifty
-    it assumes that single quotes are used to designate dialogue."""
-    if count_quotation_marks(text) < count_single_quotation_marks(text):
-        return list(re.finditer(r'(?<!\w)\'.+?\'(?!\w)', text))
-    else:
-        return list(re.finditer(r'"[^"]+"', text))
-
-
 def find_carets(text):
-    """returns regex matches for the carets in the corpus."""
-    return list(re.finditer(r'\^', text))
-
-
-def find_quote_characters(text):
-    """returns matches for quote characters only."""
-    if count_quotation_marks(text) < count_single_quotation_marks(text):
-        return list(re.finditer(r'\'', text))
-    else:
-        return list(re.finditer(r'\"', text))
+    """returns the positions of the carets in the corpus."""
+    return charscan.positions(text, '^')
 
 
 def split_quoted_quotes(text):
@@ -122,12 +109,6 @@ def split_quoted_quotes(text):
         return re.split(r'("[^"]+")', text)
 
 
-def find_bin_counts(matches, bin_count):
-        locations = [m.start() for m in matches]
-        n, bins = np.histogram(locations, bin_count)
-        return locations, n, bins
-
-
 def bokeh_play(marked_corpus, unmarked_corpus, token='compare', bin_count=400):
     """\
     This takes the regex matches and produces a histogram of where they
@@ -137,23 +118,10 @@ def bokeh_play(marked_corpus, unmarked_corpus, token='compare', bin_count=400):
     # counter object, where do you go from there.
     # Is that the right way to subtract them?
     marked_fn = marked_corpus[0]
-    unmarked_fn = os.path.basename(marked_fn)
-    unmarked_text = clean_and_read_text(UNMARKED_CORPUS_FOLDER +
-                                        '/' + unmarked_fn)
-    text = clean_and_read_text(marked_fn)
-    if token == 'compare':
-        # assumes that you've passed a True, so you're
-        # trying to graph comparatively.
-        locations, quote_n, bins = find_bin_counts(
-            find_quote_characters(unmarked_text), bin_count)
-        _, caret_n, _ = find_bin_counts(find_carets(text), bin_count)
-        n = quote_n - caret_n         
-    elif token == 'caret':
-        locations, n, bins = find_bin_counts(find_carets(text), bin_count)
-    else:
-        locations, n, bins = find_bin_counts(
-            find_quoted_quotes(unmarked_text), bin_count)
-
+    (n, bins) = location_bin_counts(
+        document_densities(marked_fn, UNMARKED_CORPUS_FOLDER), token,
+        bin_count,
+    )
 
     # # fig.suptitle(marked_fn, fontsize=14, fontweight='bold')
     left = np.array(bins[:-1])
@@ -183,25 +151,10 @@ def create_location_histogram(marked_corpus, unmarked_corpus,
     fig, axes = plt.subplots(len(marked_corpus), 1, squeeze=True)
     fig.set_figheight(9.4)
     for (marked_fn, ax) in zip(marked_corpus, axes):
-        unmarked_fn = os.path.basename(marked_fn)
-        unmarked_text = clean_and_read_text(UNMARKED_CORPUS_FOLDER +
-                                            '/' + unmarked_fn)
-        text = clean_and_read_text(marked_fn)
-        if token == 'compare':
-            # assumes that you've passed a True, so you're
-            # trying to graph comparatively.
-            locations, quote_n, bins = find_bin_counts(
-                find_quote_characters(unmarked_text), bin_count)
-            _, caret_n, _ = find_bin_counts(find_carets(text), bin_count)
-            n = quote_n - caret_n
-        elif token == 'caret':
-
-            locations, n, bins = find_bin_counts(find_carets(text), bin_count)
-            
-        else:
-            locations, n, bins = find_bin_counts(
-                find_quoted_quotes(unmarked_text), bin_count)
-
+        (n, bins) = location_bin_counts(
+            document_densities(marked_fn, UNMARKED_CORPUS_FOLDER), token,
+            bin_count,
+        )
 
         # fig.suptitle(marked_fn, fontsize=14, fontweight='bold')
         left = np.array(bins[:-1])
@@ -277,33 +230,65 @@ def make_token_re():
     return re_token
 
 
-def tokenize(input_str, token_re=make_token_re()):
+# Building the character classes walks every code point, so it's done once.
+TOKEN_RE = make_token_re()
+
+
+def tokenize(input_str, token_re=TOKEN_RE):
     """This returns an iterator over the tokens in the string."""
     return (
         m.group() for m in token_re.finditer(input_str) if not m.group('trash')
     )
 
 
+def tokenize_spans(input_str, token_re=TOKEN_RE):
+    """This returns the tokens in the string and where each one starts."""
+    tokens = []
+    starts = []
+    for m in token_re.finditer(input_str):
+        if not m.group('trash'):
+            tokens.append(m.group())
+            starts.append(m.start())
+    return (tokens, np.array(starts, dtype=np.int64))
+
+
 class VectorSpace(object):
     """\
     This manages creating a vector space model of a corpus of documents. It
     makes sure that the indexes are consistent.
 
-    Vectors of numpy arrays.
+    Documents are counted straight into a sparse CSR matrix. Once the space
+    is frozen, tokens that it hasn't seen are ignored instead of being given
+    new indexes, so new documents line up with the existing columns.
+    Documents added with `add_documents` are kept, and `matrix` returns all
+    of them at the current width without padding anything.
     """
 
-    def __init__(self):
+    def __init__(self, frozen=False, dtype=np.int64):
         self.by_index = {}
         self.by_token = {}
+        self.frozen = frozen
+        self.dtype = dtype
+        self.indptr = [0]
+        self.indices = []
+        self.data = []
 
     def __len__(self):
         return len(self.by_index)
 
+    def freeze(self):
+        """Stop adding tokens to the space."""
+        self.frozen = True
+        return self
+
     def get_index(self, token):
-        """If it doesn't have an index for the token, create one."""
+        """If it doesn't have an index for the token, create one. If the
+        space is frozen, this returns None instead."""
         try:
             i = self.by_token[token]
         except KeyError:
+            if self.frozen:
+                return None
             i = len(self.by_token)
             self.by_token[token] = i
             self.by_index[i] = token
@@ -317,20 +302,21 @@ class VectorSpace(object):
         """Returns None if there is no index for that token."""
         return self.by_token.get(token)
 
+    def count_indexes(self, token_seq):
+        """This returns the sorted indexes in a list of tokens and how many
+        times each occurs."""
+        indexes = np.fromiter(
+            (i for i in map(self.get_index, token_seq) if i is not None),
+            dtype=np.int64,
+        )
+        return np.unique(indexes, return_counts=True)
+
     def vectorize(self, token_seq):
         """This turns a list of tokens into a numpy array."""
-        v = [0] * len(self.by_token)
-        for token in token_seq:
-            i = self.get_index(token)
-            if i < len(v):
-                v[i] += 1
-            elif i == len(v):
-                v.append(1)
-            else:
-                raise Exception(
-                    "Invalid index {} (len = {})".format(i, len(v)),
-                )
-        return np.array(v)
+        (indexes, counts) = self.count_indexes(token_seq)
+        v = np.zeros(len(self), dtype=self.dtype)
+        v[indexes] = counts
+        return v
 
     def get(self, vector, key):
         """This looks up the key in the vector given."""
@@ -340,24 +326,113 @@ class VectorSpace(object):
         """\
         This pads a numpy array to match the dimensions of this vector space.
         """
-        padding = np.zeros(len(self) - len(array))
+        padding = np.zeros(len(self) - len(array), dtype=array.dtype)
         return np.concatenate((array, padding))
 
+    def count_rows(self, corpus):
+        """This returns (indptr, indices, data) for a corpus."""
+        indptr = [0]
+        indices = []
+        data = []
+        for doc in corpus:
+            (doc_indexes, counts) = self.count_indexes(doc)
+            indices.append(doc_indexes)
+            data.append(counts.astype(self.dtype))
+            indptr.append(indptr[-1] + len(doc_indexes))
+        return (indptr, indices, data)
+
+    def to_matrix(self, indptr, indices, data):
+        return sparse.csr_matrix(
+            (np.concatenate(data) if data else np.zeros(0, self.dtype),
+             np.concatenate(indices) if indices else np.zeros(0, np.int64),
+             np.array(indptr)),
+            shape=(len(indptr) - 1, len(self)),
+            dtype=self.dtype,
+        )
+
     def vectorize_corpus(self, corpus):
         """\
-        This converts a corpus (tokenized documents) into a collection of
-        vectors.
+        This converts a corpus (tokenized documents) into a sparse matrix
+        with one row per document, in one pass.
+        """
+        return self.to_matrix(*self.count_rows(corpus))
+
+    def add_documents(self, corpus):
+        """\
+        This vectorizes more documents and keeps them, returning their rows.
         """
-        vectors = [self.vectorize(doc) for doc in corpus]
-        vectors = [self.pad(doc) for doc in vectors]
-        return vectors
+        (indptr, indices, data) = self.count_rows(corpus)
+        offset = self.indptr[-1]
+        self.indptr.extend(offset + i for i in indptr[1:])
+        self.indices.extend(indices)
+        self.data.extend(data)
+        return self.to_matrix(indptr, indices, data)
+
+    def matrix(self):
+        """This returns all of the added documents as a CSR matrix."""
+        return self.to_matrix(self.indptr, self.indices, self.data)
+
+    @property
+    def vocabulary_(self):
+        """The token indexes, named like scikit-learn's vectorizers have
+        them, so `top_items` works on either."""
+        return self.by_token
+
+
+def is_frequency_token(t):
+    """Frequencies leave out single punctuation marks."""
+    return not (len(t) == 1 and is_punct(t))
 
 
 def frequencies(corpus):
     """This takes a list of tokens and returns a `Counter`."""
     return collections.Counter(
-        itertools.ifilter(lambda t: not (len(t) == 1 and is_punct(t)),
-                          itertools.chain.from_iterable(corpus)))
+        filter(is_frequency_token, itertools.chain.from_iterable(corpus)))
+
+
+def document_frequencies(fn):
+    """\
+    This reads one file and returns `Counter`s of its words inside and
+    outside of quotes, from one tokenization.
+    """
+    (quoted, unquoted) = split_quoted_tokens(clean_and_read_text(fn),
+                                             is_frequency_token)
+    return (collections.Counter(quoted), collections.Counter(unquoted))
+
+
+def corpus_frequencies(corpus, jobs=None):
+    """\
+    This counts the words inside and outside of quotes across a corpus. The
+    files are counted in a pool of `jobs` processes (default = one per CPU),
+    and their counters are merged as they come back. It returns the quoted
+    and unquoted `Counter`s.
+    """
+    corpus = list(corpus)
+    if jobs == 1 or len(corpus) < 2:
+        return merge_frequencies(map(document_frequencies, corpus))
+    with Pool(jobs) as pool:
+        return merge_frequencies(
+            pool.imap_unordered(document_frequencies, corpus))
+
+
+def merge_frequencies(counts):
+    """This sums (quoted, unquoted) pairs of `Counter`s."""
+    quoted = collections.Counter()
+    unquoted = collections.Counter()
+    for (q, u) in counts:
+        quoted.update(q)
+        unquoted.update(u)
+    return (quoted, unquoted)
+
+
+def print_frequencies(quoted, unquoted, n=25):
+    """This prints the n most common words inside and outside of quotes."""
+    for (title, counts) in (('Quoted', quoted), ('Unquoted', unquoted)):
+        print('# {} ({} tokens, {} types)\n'.format(
+            title, sum(counts.values()), len(counts)))
+        for (i, (token, count)) in enumerate(counts.most_common(n), 1):
+            print('{:>6}. {:<16}\t{:>7}'.format(i, token, count))
+        print()
 
 
 def find_quotes(doc, start_quote='“', end_quote='”'):
@@ -390,12 +465,7 @@ def pause():
 
 def calc_number_of_quotes(text):
     """returns the number of characters contained in quotation marks"""
-    matches = find_quoted_quotes(text)
-    text_string = ""
-    for match in matches:
-        text_string = text_string + match.group(0)
-    count = len(text_string)
-    return count
+    return sum(len(match.group(0)) for match in find_quoted_quotes(text))
 
 
 def calc_number_of_characters(text):
@@ -460,12 +530,83 @@ def corpus_list_percentage_quoted(corpus):
         print("=============")
 
 
-def print_stats(corpus):
-    """prints stats to the terminal. when you implement the csv export
-    this will likely be obsolete"""
-    corpus_list_percentage_quoted(corpus)
-    corpus_list_average_sentence_lengths(corpus)
-    corpus_list_number_of_quoted_characters(corpus)
+STAT_FIELDS = [
+    'file', 'characters', 'quoted_characters', 'percent_quoted', 'quotes',
+    'average_quote_length', 'double_quotation_marks',
+    'single_quotation_marks',
+]
+
+
+def text_stats(text):
+    """\
+    This computes all of the per-document statistics from one search for the
+    quotes, instead of finding them again for every statistic. The average
+    quote length is None when there are no quotes.
+    """
+    double_marks = count_quotation_marks(text)
+    single_marks = count_single_quotation_marks(text)
+    pattern = quoted_quote_pattern(double_marks, single_marks)
+    lengths = [m.end() - m.start() for m in re.finditer(pattern, text)]
+    quoted = sum(lengths)
+    characters = calc_number_of_characters(text)
+    return {
+        'characters': characters,
+        'quoted_characters': quoted,
+        'percent_quoted': 100 * (quoted / characters) if characters else 0.0,
+        'quotes': len(lengths),
+        'average_quote_length': quoted / len(lengths) if lengths else None,
+        'double_quotation_marks': double_marks,
+        'single_quotation_marks': single_marks,
+    }
+
+
+def document_stats(fn):
+    """This reads and cleans one file once and returns its statistics."""
+    stats = text_stats(clean_and_read_text(fn))
+    stats['file'] = fn
+    return stats
+
+
+def corpus_stats(corpus, jobs=None):
+    """\
+    This returns the statistics for every file in the corpus, in order,
+    computing them across a pool of `jobs` processes (default = one per
+    CPU).
+    """
+    corpus = list(corpus)
+    if jobs == 1 or len(corpus) < 2:
+        return [document_stats(fn) for fn in corpus]
+    with Pool(jobs) as pool:
+        return pool.map(document_stats, corpus)
+
+
+def write_stats(stats, filename):
+    """\
+    This writes the statistics to a CSV file, or to a JSON file if the
+    filename ends in .json.
+    """
+    if filename.endswith('.json'):
+        with open(filename, 'w') as fout:
+            json.dump(stats, fout, indent=2)
+    else:
+        with open(filename, 'w', newline='') as fout:
+            writer = csv.DictWriter(fout, STAT_FIELDS)
+            writer.writeheader()
+            writer.writerows(stats)
+
+
+def print_stats(corpus, jobs=None):
+    """prints stats to the terminal. every file is read and searched once;
+    use write_stats to export them to CSV or JSON."""
+    for stats in corpus_stats(corpus, jobs):
+        print("\n=============\n" + stats['file'])
+        print("The percentage of quoted text is {}".format(
+            stats['percent_quoted']))
+        print("The average sentence length is {}".format(
+            stats['average_quote_length']))
+        print("The number of quoted characters is {}".format(
+            stats['quoted_characters']))
+        print("=============")
 
 
 def all_files(dirname):
@@ -474,13 +615,37 @@ def all_files(dirname):
             yield os.path.join(root, fn)
 
 
-def top_items(vectorizer, array, n=10):
+CHUNK_ROWS = 256
+
+
+def top_row_items(indices, data, n):
+    """\
+    This returns the (index, value) pairs of the n largest values in one
+    sparse row, largest first, with ties going to the lower index. It only
+    sorts the candidates left after a partial selection.
+    """
+    if len(data) > n:
+        kth = np.partition(data, len(data) - n)[len(data) - n]
+        keep = data >= kth
+        indices = indices[keep]
+        data = data[keep]
+    order = np.lexsort((indices, -data))[:n]
+    return zip(indices[order].tolist(), data[order].tolist())
+
+
+def top_items(vectorizer, array, n=10, chunk_rows=CHUNK_ROWS):
+    """\
+    This yields the top n (index, term, value) items for each row of a
+    document-term matrix, sparse or dense, without densifying it. Rows are
+    handled in chunks of `chunk_rows`, and only nonzero entries are listed.
+    """
     inv_vocab = dict((v, k) for (k, v) in vectorizer.vocabulary_.items())
-    for row in array:
-        indexes = list(enumerate(row))
-        indexes.sort(key=operator.itemgetter(1), reverse=True)
-        top = [(i, inv_vocab[i], c) for (i, c) in indexes[:n]]
-        yield top
+    for start in range(0, array.shape[0], chunk_rows):
+        chunk = sparse.csr_matrix(array[start:start + chunk_rows])
+        for row in range(chunk.shape[0]):
+            (lo, hi) = chunk.indptr[row:row + 2]
+            yield [(i, inv_vocab[i], c) for (i, c) in top_row_items(
+                chunk.indices[lo:hi], chunk.data[lo:hi], n)]
 
 
 def vectorizer_report(title, klass, filenames, **kwargs):
@@ -492,24 +657,126 @@ def vectorizer_report(title, klass, filenames, **kwargs):
     params.update(kwargs)
     v = klass(**params)
     corpus = v.fit_transform(filenames)
-    a = corpus.toarray()
 
     print('# {}\n'.format(title))
-    for (fn, top) in zip(filenames, top_items(v, a)):
+    for (fn, top) in zip(filenames, top_items(v, corpus)):
         print('## {}\n'.format(fn))
         for row in top:
             print('{0[0]:>6}. {0[1]:<12}\t{0[2]:>5}'.format(row))
         print()
 
 
+def keep_report_token(token):
+    """Drops one-character tokens and English stop words, like the
+    vectorizer reports do."""
+    return len(token) > 1 and token not in ENGLISH_STOP_WORDS
+
+
+def in_quotes(quotes, positions):
+    """\
+    This takes the matches from `find_quoted_quotes` and an array of
+    offsets into the text, and returns whether each offset is in a quote.
+    """
+    positions = np.asarray(positions, dtype=np.int64)
+    if not quotes:
+        return np.zeros(len(positions), dtype=bool)
+    quote_starts = np.array([m.start() for m in quotes], dtype=np.int64)
+    quote_ends = np.array([m.end() for m in quotes], dtype=np.int64)
+    i = np.searchsorted(quote_starts, positions, 'right') - 1
+    return (i >= 0) & (positions < quote_ends[np.maximum(i, 0)])
+
+
+def split_quoted_tokens(text, keep=keep_report_token):
+    """\
+    This tokenizes a text once and routes each token into the quoted or the
+    unquoted tokens, depending on whether it starts inside one of the
+    quoted quotes. It returns (quoted, unquoted).
+    """
+    (tokens, starts) = tokenize_spans(text)
+    inside = in_quotes(find_quoted_quotes(text), starts)
+
+    quoted = []
+    unquoted = []
+    for (token, is_quoted) in zip(tokens, inside.tolist()):
+        if keep is None or keep(token):
+            (quoted if is_quoted else unquoted).append(token)
+    return (quoted, unquoted)
+
+
+def quote_vectors(filenames, keep=keep_report_token, dtype=np.int64):
+    """\
+    This reads and tokenizes each file once and returns (space, quoted,
+    unquoted): a VectorSpace and two count matrices over its vocabulary,
+    with a row per file for its quoted and its unquoted tokens.
+    """
+    space = VectorSpace(dtype=dtype)
+    for fn in filenames:
+        space.add_documents(split_quoted_tokens(clean_and_read_text(fn), keep))
+    matrix = space.matrix()
+    return (space, matrix[0::2], matrix[1::2])
+
+
+def quote_tfidf(quoted, unquoted):
+    """\
+    This weights the paired count matrices by TF-IDF, with the document
+    frequencies taken over both of them, so the weights are comparable.
+    """
+    transformer = TfidfTransformer().fit(sparse.vstack((quoted, unquoted)))
+    return (transformer.transform(quoted), transformer.transform(unquoted))
+
+
+def distinctive_terms(space, quoted, unquoted, n=20):
+    """\
+    This compares how often each term is used inside quotes and outside of
+    them over the whole corpus, as the log (base 2) ratio of their smoothed
+    rates. It returns the n most quoted and the n most unquoted terms as
+    (term, log ratio, quoted count, unquoted count) rows.
+    """
+    q = np.asarray(quoted.sum(axis=0)).ravel()
+    u = np.asarray(unquoted.sum(axis=0)).ravel()
+    if len(q) == 0:
+        return ([], [])
+    ratio = (np.log2((q + 1) / (q.sum() + len(q))) -
+             np.log2((u + 1) / (u.sum() + len(u))))
+
+    def top(scores):
+        best = top_row_items(np.arange(len(scores)), scores, n)
+        return [(space.lookup_token(i), float(ratio[i]), int(q[i]), int(u[i]))
+                for (i, _) in best]
+
+    return (top(ratio), top(-ratio))
+
+
+def quote_vectorizer_report(filenames, n=10):
+    """\
+    This prints the top quoted and unquoted terms for each file, by count
+    and by TF-IDF, and then the terms most distinctive of quoted and of
+    unquoted text, all from one read of each file.
+    """
+    (space, quoted, unquoted) = quote_vectors(filenames)
+    (quoted_tfidf, unquoted_tfidf) = quote_tfidf(quoted, unquoted)
+    for (title, matrix) in (('Quoted Frequencies', quoted),
+                            ('Unquoted Frequencies', unquoted),
+                            ('Quoted Tf-Idf', quoted_tfidf),
+                            ('Unquoted Tf-Idf', unquoted_tfidf)):
+        print('# {}\n'.format(title))
+        for (fn, top) in zip(filenames, top_items(space, matrix, n)):
+            print('## {}\n'.format(fn))
+            for row in top:
+                print('{0[0]:>6}. {0[1]:<12}\t{0[2]:>5}'.format(row))
+            print()
+
+    (most_quoted, most_unquoted) = distinctive_terms(space, quoted, unquoted)
+    for (title, rows) in (('Distinctively Quoted', most_quoted),
+                          ('Distinctively Unquoted', most_unquoted)):
+        print('# {}\n'.format(title))
+        for (term, ratio, q, u) in rows:
+            print('{:<16}\t{:>7.3f}\t{:>6}\t{:>6}'.format(term, ratio, q, u))
+        print()
+
+
 def concatenate_quotes(text):
-    quotes = find_quoted_quotes(text)
-    counter = 0
-    concatenated_quotes = ""
-    for match in quotes:
-        concatenated_quotes += quotes[counter].group(0)
-        counter += 1
-    return concatenated_quotes
+    return ''.join(match.group(0) for match in find_quoted_quotes(text))
 
 
 def matplot_graph_all_three(marked_files, unmarked_files):
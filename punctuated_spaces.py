@@ -2,7 +2,6 @@
 # coding: utf-8
 
 
-import codecs
 import collections
 import itertools
 import os
@@ -16,21 +15,18 @@ import matplotlib.path as path
 
 import numpy as np
 
+import docstore
+
 
 CORPUS = 'corpus'
 
 
 def read_text(filename):
     """Read in the text from the file."""
-    with codecs.open(filename, 'r', 'utf8') as f:
-        return f.read()
-
-def clean_text(input_text):
-    """Clean the text by lowercasing and removing newlines."""
-    return input_text.replace('\n', ' ').lower()
+    return docstore.read_text(filename)
 
 def clean_and_read_text(input_text):
-    return clean_text(read_text(input_text))
+    return docstore.clean_and_read_text(input_text)
 
 def quotations_check(filename):
     text = clean_and_read_text(filename)
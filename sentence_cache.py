@@ -0,0 +1,207 @@
+"""\
+A content-addressed cache of sentence tags and labels. Editions and
+re-exports of the same novel share most of their sentences, so marking one
+after another mostly repeats work that's already been done.
+
+Sentences are keyed by a hash of their normalized tokens (the lower-cased
+tokens that `split_sentences` produces), so changes in whitespace, case, or
+position in the document don't matter. The cache holds each sentence's
+part-of-speech tags, and its label from each classifier, keyed also by a
+hash of the classifier's file.
+
+Recently used entries are kept in memory, in front of a SQLite file that
+persists between runs. The file is capped at `max_entries`, and the least
+recently used entries are evicted past that. Use times count up from the
+latest one in the file, so the daemon's workers can share it.
+"""
+
+
+import hashlib
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+
+import batch_classify
+
+
+MAX_ENTRIES = 1000000
+MEMORY_ENTRIES = 100000
+
+
+def sentence_key(tokens):
+    """This returns the content hash for a sentence's normalized tokens."""
+    return hashlib.sha1('\0'.join(tokens).encode('utf8')).hexdigest()
+
+
+def classifier_digest(path):
+    """\
+    This returns a hash of a classifier's pickle file, or of every file in
+    a compact model directory.
+    """
+    digest = hashlib.sha1()
+    if os.path.isdir(path):
+        paths = [os.path.join(path, fn) for fn in sorted(os.listdir(path))]
+    else:
+        paths = [path]
+    for file_path in paths:
+        digest.update(os.path.basename(file_path).encode('utf8'))
+        with open(file_path, 'rb') as fin:
+            for block in iter(lambda: fin.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+class SentenceCache(object):
+    """\
+    An LRU cache of JSON values in memory, backed by a SQLite file. Writes,
+    and the uses of entries that were hit, are kept in memory until
+    `commit`, which is also when the file is trimmed back down to
+    `max_entries`.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES,
+                 memory_entries=MEMORY_ENTRIES):
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory = OrderedDict()
+        # {key: JSON value, or None for an entry that was only used}, in
+        # the order they were last used.
+        self.pending = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.db = sqlite3.connect(path, timeout=60)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('CREATE TABLE IF NOT EXISTS entries '
+                        '(key TEXT PRIMARY KEY, value TEXT, used INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS entries_used '
+                        'ON entries (used)')
+        self.db.commit()
+
+    def remember(self, key, value):
+        """This puts an entry at the front of the in-memory LRU."""
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_entries:
+            self.memory.popitem(last=False)
+
+    def touch(self, key):
+        """This marks an entry as used, so `commit` updates its use time."""
+        if key not in self.pending:
+            self.pending[key] = None
+        self.pending.move_to_end(key)
+
+    def get_many(self, keys):
+        """\
+        This returns {key: value} for the keys that are in the cache,
+        looking in memory first and then in the file.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                found[key] = self.memory[key]
+                self.touch(key)
+            else:
+                missing.append(key)
+
+        unique = list(OrderedDict.fromkeys(missing))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            rows = self.db.execute(
+                'SELECT key, value FROM entries WHERE key IN ({})'.format(
+                    ','.join('?' * len(batch))),
+                batch,
+            )
+            for (key, value) in rows:
+                found[key] = json.loads(value)
+                self.remember(key, found[key])
+                self.touch(key)
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put(self, key, value):
+        self.remember(key, value)
+        self.pending[key] = json.dumps(value)
+        self.pending.move_to_end(key)
+
+    def commit(self):
+        """\
+        This writes the new entries and the use times of the entries that
+        were hit, and then evicts the least recently used entries past
+        `max_entries`. The use times continue from the latest one in the
+        file, inside one write transaction, so other processes writing to
+        the same file don't reuse them.
+        """
+        self.db.execute('BEGIN IMMEDIATE')
+        (clock,) = self.db.execute(
+            'SELECT COALESCE(MAX(used), 0) FROM entries').fetchone()
+        rows = []
+        uses = []
+        for (key, value) in self.pending.items():
+            clock += 1
+            if value is None:
+                uses.append((clock, key))
+            else:
+                rows.append((key, value, clock))
+        self.pending = OrderedDict()
+        self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                            rows)
+        self.db.executemany('UPDATE entries SET used = ? WHERE key = ?', uses)
+        (count,) = self.db.execute('SELECT COUNT(*) FROM entries').fetchone()
+        if count > self.max_entries:
+            self.db.execute(
+                'DELETE FROM entries WHERE key IN (SELECT key FROM entries '
+                'ORDER BY used LIMIT ?)', (count - self.max_entries,))
+        self.db.commit()
+
+    def close(self):
+        self.commit()
+        self.db.close()
+
+
+def tag_sentences(cache, sentences, tagger):
+    """\
+    This is `fset_manager.tag_token_spans` with the tags looked up in the
+    cache first. Only the sentences that aren't in the cache are tagged.
+    """
+    sentences = list(sentences)
+    keys = ['tags/' + sentence_key([token for (token, _) in sent])
+            for sent in sentences]
+    found = cache.get_many(keys)
+    tagged_sents = []
+    for (key, sent) in zip(keys, sentences):
+        to_tag = [token for (token, _) in sent]
+        spans = [span for (_, span) in sent]
+        if key in found:
+            tagged = list(zip(to_tag, found[key]))
+        else:
+            tagged = tagger.tag(to_tag)
+            cache.put(key, [tag for (_, tag) in tagged])
+        tagged_sents.append(list(zip(tagged, spans)))
+    return tagged_sents
+
+
+def classify_sentences(cache, classifier, digest, tagged_sentences,
+                       featuresets):
+    """\
+    This returns the label for each feature set, like
+    `batch_classify.classify_many`, using the labels cached for this
+    classifier (identified by its `digest`) and classifying the rest in one
+    batch. `tagged_sentences` are the sentences the feature sets came from.
+    """
+    featuresets = list(featuresets)
+    keys = ['label/{}/{}'.format(digest, sentence_key(
+                [token for ((token, _), _) in sent]))
+            for sent in tagged_sentences]
+    found = cache.get_many(keys)
+    missing = [i for (i, key) in enumerate(keys) if key not in found]
+    labels = batch_classify.classify_many(
+        classifier, (featuresets[i] for i in missing))
+    for (i, label) in zip(missing, labels):
+        found[keys[i]] = label
+        cache.put(keys[i], label)
+    return [found[key] for key in keys]
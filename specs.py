@@ -1,6 +1,40 @@
 
 
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import io
+import os
+import pickle
+import random
+import tempfile
+import zipfile
+
+import nltk
+import numpy as np
+from scipy import sparse
+
+import agreement
+import archives
+import batch
+import batch_classify
+import charscan
+import compact_model
+import concordance
+import density
+import docstore
+import evaluate
+import feature_pruning
+from fset_manager import Current, read_paragraphs, split_paragraphs
+import incremental
+import mark_daemon
+import mark_quotes
 import ps
+import sentence_cache
+import standoff
+import thresholds
+import train_quotes
+import weighted_training
 
 def assert_quote(input, expected):
     quotes = [m.group() for m in ps.find_quoted_quotes(input)]
@@ -78,3 +112,939 @@ class TestFindQuotedQuotes:
             "She didn't say, 'Don't say that!' Something else here.",
             ["'Don't say that!'", "'Don't say that!'"],
             )
+
+class TestTextStats:
+
+    def test_it_should_compute_all_of_the_stats_in_one_pass(self):
+        stats = ps.text_stats('Hello. I said, "yes"')
+        assert 20 == stats['characters']
+        assert 5 == stats['quoted_characters']
+        assert 25 == stats['percent_quoted']
+        assert 1 == stats['quotes']
+
+    def test_it_should_agree_with_the_single_stat_functions(self):
+        text = 'She said, "Howdy!"' * 100
+        stats = ps.text_stats(text)
+        assert ps.average_sentence_length(text) == stats['average_quote_length']
+        assert ps.percent_quoted(text) == stats['percent_quoted']
+
+    def test_it_should_handle_texts_without_quotes(self):
+        stats = ps.text_stats('No quotes here.')
+        assert 0 == stats['quotes']
+        assert stats['average_quote_length'] is None
+
+class TestVectorSpace:
+
+    def test_it_should_vectorize_a_corpus_into_one_sparse_matrix(self):
+        vs = ps.VectorSpace()
+        matrix = vs.vectorize_corpus([['a', 'b', 'a'], ['c']])
+        assert [[2, 1, 0], [0, 0, 1]] == matrix.toarray().tolist()
+
+    def test_it_should_ignore_new_tokens_when_frozen(self):
+        vs = ps.VectorSpace()
+        vs.add_documents([['a', 'b']])
+        vs.freeze()
+        vs.add_documents([['b', 'z']])
+        assert 2 == len(vs)
+        assert [[1, 1], [0, 1]] == vs.matrix().toarray().tolist()
+
+class TestSplitQuotedTokens:
+
+    def test_it_should_route_tokens_by_the_quotes_they_are_in(self):
+        quoted, unquoted = ps.split_quoted_tokens(
+            'he said "hello there friend" and she said "goodbye" quietly',
+            keep=None,
+        )
+        assert ['"', 'hello', 'there', 'friend', '"', '"', 'goodbye', '"'] \
+            == quoted
+        assert ['he', 'said', 'and', 'she', 'said', 'quietly'] == unquoted
+
+class TestFrequencies:
+
+    def test_it_should_leave_out_single_punctuation_marks(self):
+        counts = ps.frequencies([['a', '.', 'b'], ['a', '--']])
+        assert {'a': 2, 'b': 1, '--': 1} == dict(counts)
+
+    def test_it_should_merge_quoted_and_unquoted_counts(self):
+        counts = ps.merge_frequencies([
+            (Counter(['a']), Counter(['b'])),
+            (Counter(['a', 'c']), Counter()),
+        ])
+        assert ({'a': 2, 'c': 1}, {'b': 1}) == tuple(map(dict, counts))
+
+class TestInQuotes:
+
+    def test_it_should_flag_offsets_inside_quoted_quotes(self):
+        text = 'a "b c" d'
+        inside = ps.in_quotes(ps.find_quoted_quotes(text), [0, 2, 3, 6, 8])
+        assert [False, True, True, True, False] == inside.tolist()
+
+class TestPrefixCounts:
+
+    def test_it_should_bin_like_numpy_histogram(self):
+        positions = [3, 3, 10, 41, 97]
+        counts = density.PrefixCounts.from_positions(positions, 120)
+        for (bins, range) in ((7, None), (10, (0, 120)), (4, (10, 41))):
+            (n, edges) = np.histogram(positions, bins, range)
+            (m, our_edges) = counts.histogram(bins, range)
+            assert n.tolist() == m.tolist()
+            assert np.allclose(edges, our_edges)
+
+    def test_it_should_count_quoted_characters(self):
+        counts = density.PrefixCounts.from_spans([(2, 5), (4, 8)], 10)
+        assert 6 == counts.total()
+        assert 2 == counts.count(6, 9)
+
+class TestTopItems:
+
+    class Vectorizer:
+        vocabulary_ = dict(('t{}'.format(i), i) for i in range(8))
+
+    def full_sort(self, row, n):
+        # The old top_items: a stable sort of the whole row.
+        items = sorted(enumerate(row), key=lambda item: item[1], reverse=True)
+        return [(i, 't{}'.format(i), c) for (i, c) in items[:n] if c]
+
+    def test_it_should_break_ties_like_the_full_sort(self):
+        rows = np.array([[3, 1, 3, 0, 1, 3, 2, 1],
+                         [0, 2, 0, 2, 2, 0, 2, 5],
+                         [1, 1, 1, 1, 1, 1, 1, 1]])
+        for n in range(1, 10):
+            expected = [self.full_sort(row, n) for row in rows.tolist()]
+            for chunk_rows in (1, 2, 256):
+                actual = list(ps.top_items(self.Vectorizer(), rows, n,
+                                           chunk_rows))
+                assert expected == actual
+            # Rows whose stored entries aren't in column order.
+            matrix = sparse.csr_matrix(rows)
+            for (lo, hi) in zip(matrix.indptr, matrix.indptr[1:]):
+                matrix.indices[lo:hi] = matrix.indices[lo:hi][::-1].copy()
+                matrix.data[lo:hi] = matrix.data[lo:hi][::-1].copy()
+            assert expected == list(ps.top_items(self.Vectorizer(), matrix,
+                                                 n))
+
+class TestDocumentStore:
+
+    def test_it_should_read_a_file_again_only_when_it_changes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'doc.txt')
+            with open(fn, 'w') as fout:
+                fout.write('He said\n"Hi."')
+            store = docstore.DocumentStore(os.path.join(tmp, 'cache'))
+            assert 'he said "hi."' == store.clean(fn)
+            assert 'he said "hi."' == store.clean(fn)
+            assert 1 == store.misses
+            with open(fn, 'w') as fout:
+                fout.write('Bye.')
+            os.utime(fn, ns=(0, 0))
+            assert 'bye.' == store.clean(fn)
+            assert 2 == store.misses
+
+    def test_it_should_drop_the_cached_text_of_old_versions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fn = os.path.join(tmp, 'doc.txt')
+            cache_dir = os.path.join(tmp, 'cache')
+            for (text, ns) in (('One.', 0), ('Two.', 10 ** 9)):
+                with open(fn, 'w') as fout:
+                    fout.write(text)
+                os.utime(fn, ns=(ns, ns))
+                store = docstore.DocumentStore(cache_dir)
+                assert text.lower() == store.clean(fn)
+            cached = [os.path.join(root, name)
+                      for (root, _, files) in os.walk(cache_dir)
+                      for name in files]
+            assert 1 == len(cached)
+            with open(cached[0]) as fin:
+                assert 'two.' == fin.read()
+
+class TestArchives:
+
+    def test_it_should_read_documents_out_of_a_zip_file(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'books.zip')
+            with zipfile.ZipFile(path, 'w') as archive:
+                archive.writestr('one.txt', '"Hi," she said.')
+                archive.writestr('two.txt', 'Nothing.')
+            documents = list(archives.iter_documents(tmp))
+            assert [(os.path.join(path, 'one.txt'), '"Hi," she said.'),
+                    (os.path.join(path, 'two.txt'), 'Nothing.')] == documents
+
+    def test_it_should_skip_archives_it_cannot_read(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bad = os.path.join(tmp, 'a.zip')
+            with open(bad, 'w') as fout:
+                fout.write('not a zip')
+            good = os.path.join(tmp, 'b.txt')
+            with open(good, 'w') as fout:
+                fout.write('Fine.')
+            errors = []
+            documents = list(archives.iter_documents(
+                tmp, errors=lambda name, exc: errors.append(name)))
+            assert [(good, 'Fine.')] == documents
+            assert [bad] == errors
+            assert [] == list(archives.iter_documents(tmp, failed={tmp}))
+
+    def test_it_should_decode_plain_files_like_archive_members(self):
+        data = 'Caf\xe9 "ol\xe9."'.encode('latin-1')
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(os.path.join(tmp, 'a.txt'), 'wb') as fout:
+                fout.write(data)
+            with zipfile.ZipFile(os.path.join(tmp, 'b.zip'), 'w') as archive:
+                archive.writestr('b.txt', data)
+            errors = []
+            documents = list(archives.iter_documents(
+                tmp, errors=lambda name, exc: errors.append(name)))
+        assert [] == errors
+        assert 2 == len(documents)
+        assert documents[0][1] == documents[1][1]
+        assert 'Caf\ufffd "ol\ufffd."' == documents[0][1]
+
+class TestBatch:
+
+    def test_it_should_log_a_document_that_fails(self):
+        row = batch.document_stats(('broken.txt', None))
+        assert 'broken.txt' == row['file']
+        assert 'error' in row
+
+class TestCharScan:
+
+    def test_it_should_find_every_mark_in_one_scan(self):
+        marks = charscan.scan('“Hé,” she said. "Hi," he said.^')
+        assert [0] == marks['“'].tolist()
+        assert [4] == marks['”'].tolist()
+        assert [16, 20] == marks['"'].tolist()
+        assert [30] == marks['^'].tolist()
+        assert [] == marks["'"].tolist()
+
+def synthetic_featuresets(n=60, seed=0):
+    rand = random.Random(seed)
+    featuresets = []
+    for _ in range(n):
+        fs = {'tag': rand.choice(['NN', 'VB', 'DT']),
+              'quote': rand.choice([True, False]),
+              'word': rand.choice(['said', 'he', 'the', 'then'])}
+        featuresets.append((fs, fs['quote'] and fs['tag'] != 'DT'))
+    return featuresets
+
+class TestBatchClassify:
+
+    def assert_same_labels(self, classifier, featuresets):
+        expected = [classifier.classify(fs) for fs in featuresets]
+        assert expected == batch_classify.classify_many(classifier,
+                                                        featuresets)
+
+    def test_it_should_label_like_naive_bayes(self):
+        training = synthetic_featuresets()
+        classifier = nltk.NaiveBayesClassifier.train(training)
+        test = [fs for (fs, _) in synthetic_featuresets(seed=1)]
+        test.append({'tag': 'JJ', 'word': 'unseen'})
+        self.assert_same_labels(classifier, test)
+
+    def test_it_should_label_like_a_decision_tree(self):
+        training = synthetic_featuresets()
+        classifier = nltk.DecisionTreeClassifier.train(training,
+                                                       support_cutoff=0)
+        test = [fs for (fs, _) in synthetic_featuresets(seed=1)]
+        self.assert_same_labels(classifier, test)
+
+    def test_it_should_break_ties_like_nltk(self):
+        training = [({'a': 'x'}, 'no'), ({'a': 'x'}, 'yes'),
+                    ({'a': 'y'}, 'no'), ({'a': 'y'}, 'yes')]
+        classifier = nltk.NaiveBayesClassifier.train(training)
+        test = [{'a': 'x'}, {'a': 'y'}, {'a': 'z'}, {}]
+        assert ['yes'] * 4 == batch_classify.classify_many(classifier, test)
+        self.assert_same_labels(classifier, test)
+        tree = nltk.DecisionTreeClassifier.train(training)
+        self.assert_same_labels(tree, test)
+
+    def test_it_should_take_the_labels_from_the_probabilities(self):
+        classifier = nltk.NaiveBayesClassifier.train(synthetic_featuresets())
+        test = [fs for (fs, _) in synthetic_featuresets(seed=1)]
+        (labels, probs, order) = batch_classify.classify_and_prob_many(
+            classifier, test)
+        assert [False, True] == order
+        assert batch_classify.classify_many(classifier, test) == labels
+        assert np.allclose(1, probs.sum(axis=1))
+
+    def disagreeing_classifiers(self):
+        yes = nltk.DecisionTreeClassifier('yes')
+        no = nltk.DecisionTreeClassifier('no')
+        stump = nltk.DecisionTreeClassifier('no', 'a', {'x': yes, 'y': no})
+        return (yes, no, stump)
+
+    def test_it_should_take_the_majority_vote(self):
+        (yes, no, stump) = self.disagreeing_classifiers()
+        test = [{'a': 'x'}, {'a': 'y'}]
+        assert ['yes', 'no'] == batch_classify.ensemble_classify_many(
+            [yes, no, stump], test)
+        labels = [['yes', 'yes'], ['no', 'no'], ['yes', 'no']]
+        assert ['yes', 'no'] == batch_classify.ensemble_classify_many(
+            [yes, no, stump], test, labels=labels)
+
+    def test_it_should_break_ensemble_ties_like_nltk(self):
+        (yes, no, _) = self.disagreeing_classifiers()
+        test = [{'a': 'x'}, {'a': 'y'}]
+        for method in batch_classify.ENSEMBLE_METHODS:
+            assert ['yes', 'yes'] == batch_classify.ensemble_classify_many(
+                [no, yes], test, method)
+
+    def test_it_should_average_the_label_probabilities(self):
+        # Each Bayes classifier leans to "no" (0.58), but the tree is sure of
+        # "yes": two votes to one for "no", but "yes" averages 0.61.
+        leaning = nltk.NaiveBayesClassifier.train(
+            [({}, 'no')] * 3 + [({}, 'yes')] * 2)
+        (yes, _, _) = self.disagreeing_classifiers()
+        test = [{'a': 'x'}]
+        assert ['no'] == batch_classify.ensemble_classify_many(
+            [leaning, leaning, yes], test, 'vote')
+        assert ['yes'] == batch_classify.ensemble_classify_many(
+            [leaning, leaning, yes], test, 'average')
+        try:
+            batch_classify.ensemble_classify_many([yes], test, 'median')
+        except ValueError:
+            pass
+        else:
+            assert False, 'expected a ValueError'
+
+class TestEvaluate:
+
+    gold = [True, True, True, False, False, False, False, False]
+    predicted = [True, True, False, True, False, False, False, False]
+
+    def test_it_should_count_the_confusion_matrix(self):
+        (labels, gold, predicted) = evaluate.encode_labels(self.gold,
+                                                           self.predicted)
+        assert [False, True] == labels
+        assert [[4, 1], [1, 2]] == evaluate.confusion_counts(
+            gold, predicted, 2).tolist()
+        samples = np.array([[0, 0, 0], [3, 4, 3]])
+        assert [[[0, 0], [0, 3]], [[1, 2], [0, 0]]] == \
+            evaluate.confusion_counts(gold[:5], predicted[:5], 2,
+                                      samples).tolist()
+
+    def test_it_should_score_each_label(self):
+        scores = evaluate.scores([[4, 1], [1, 2]])
+        assert 0.75 == scores['accuracy']
+        assert np.allclose([4 / 5, 2 / 3], scores['precision'])
+        assert np.allclose([4 / 5, 2 / 3], scores['recall'])
+        assert np.allclose([4 / 5, 2 / 3], scores['f1'])
+        assert [5, 3] == scores['support'].tolist()
+        assert [1, 0] == evaluate.scores([[2, 0], [0, 0]])['f1'].tolist()
+
+    def test_it_should_format_the_report(self):
+        report = evaluate.evaluation_report(self.gold, self.predicted,
+                                            n_resamples=0)
+        lines = evaluate.format_report(report).split('\n')
+        assert 'Accuracy = 0.7500' == lines[0]
+        assert lines[3].startswith('False      0.8000')
+        assert lines[4].split() == ['True', '0.6667', '0.6667', '0.6667',
+                                    '3']
+        assert lines[-1].split() == ['True', '1', '2']
+
+    def test_it_should_bracket_the_scores_with_the_bootstrap(self):
+        report = evaluate.evaluation_report(self.gold * 10,
+                                            self.predicted * 10,
+                                            n_resamples=500, seed=0)
+        for key in ('accuracy', 'precision', 'recall', 'f1'):
+            (low, high) = report['intervals'][key]
+            value = report['scores'][key]
+            assert np.all(low <= value) and np.all(value <= high), key
+            assert np.all(low < high), key
+        line = evaluate.format_report(report).split('\n')[0]
+        assert line.startswith('Accuracy = 0.7500 [')
+
+class TestCompactModel:
+
+    def assert_round_trip(self, classifier):
+        test = [fs for (fs, _) in synthetic_featuresets(seed=1)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'classifier.model')
+            compiled = compact_model.save_model(classifier, path)
+            assert compact_model.is_model(path)
+            loaded = compact_model.load_model(path)
+            assert compact_model.same_model(compiled, loaded)
+            expected = [classifier.classify(fs) for fs in test]
+            assert expected == list(loaded.classify_many(test))
+
+    def test_it_should_round_trip_naive_bayes(self):
+        self.assert_round_trip(
+            nltk.NaiveBayesClassifier.train(synthetic_featuresets()))
+
+    def test_it_should_round_trip_a_decision_tree(self):
+        self.assert_round_trip(nltk.DecisionTreeClassifier.train(
+            synthetic_featuresets(), support_cutoff=0))
+
+    def test_it_should_refuse_values_json_would_change(self):
+        training = [({'span': (0, 1)}, True), ({'span': (1, 2)}, False)]
+        for trainer in (nltk.NaiveBayesClassifier.train,
+                        nltk.DecisionTreeClassifier.train):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'classifier.model')
+                try:
+                    compact_model.save_model(trainer(training), path)
+                except ValueError as exc:
+                    assert "'span'" in str(exc)
+                else:
+                    assert False, 'expected a ValueError'
+                assert not os.path.exists(path)
+
+class TestWeightedTraining:
+
+    def duplicated_featuresets(self):
+        featuresets = synthetic_featuresets(40)
+        return featuresets + featuresets[:25] + featuresets[10:20]
+
+    def test_it_should_collapse_duplicates_into_weights(self):
+        fs = {'a': 1}
+        weighted = weighted_training.dedupe_featuresets(
+            [(fs, True), (fs, False), (fs, True)])
+        assert [(fs, True, 2, 2), (fs, False, 1, 1)] == weighted
+
+    def test_it_should_train_the_same_naive_bayes(self):
+        training = self.duplicated_featuresets()
+        expected = nltk.NaiveBayesClassifier.train(training)
+        actual = weighted_training.train(nltk.NaiveBayesClassifier, training)
+        assert expected.labels() == actual.labels()
+        for (fs, _) in synthetic_featuresets(seed=1):
+            expected_dist = expected.prob_classify(fs)
+            actual_dist = actual.prob_classify(fs)
+            for label in expected.labels():
+                assert abs(expected_dist.prob(label) -
+                           actual_dist.prob(label)) < 1e-9
+
+    def test_it_should_train_the_same_decision_tree(self):
+        training = self.duplicated_featuresets()
+        for binary in (False, True):
+            expected = nltk.DecisionTreeClassifier.train(
+                training, support_cutoff=0, binary=binary)
+            actual = weighted_training.train_decision_tree(
+                weighted_training.dedupe_featuresets(training),
+                support_cutoff=0, binary=binary)
+            assert expected.pretty_format() == actual.pretty_format()
+        expected = nltk.DecisionTreeClassifier.train(training)
+        actual = weighted_training.train(nltk.DecisionTreeClassifier, training)
+        assert expected.pretty_format() == actual.pretty_format()
+
+class TestFeaturePruning:
+
+    def test_it_should_keep_the_features_that_predict_the_label(self):
+        training = synthetic_featuresets()
+        for method in ('chi2', 'mi'):
+            keep = feature_pruning.select_features(training, method, 1, 1)
+            assert 1 == len(keep)
+            assert next(iter(keep))[0] in ('quote', 'tag')
+
+    def test_it_should_keep_the_most_frequent_features(self):
+        training = [({'a': 1, 'b': 1}, True), ({'a': 1, 'c': 1}, False),
+                    ({'a': 1, 'b': 1}, False)]
+        assert {('a', 1), ('b', 1)} == feature_pruning.select_features(
+            training, 'frequency', 2)
+        assert {('a', 1)} == feature_pruning.select_features(
+            training, 'frequency', 1, 1)
+
+    def test_it_should_need_a_number_to_keep_for_scores(self):
+        for method in ('chi2', 'mi'):
+            try:
+                feature_pruning.select_features(synthetic_featuresets(),
+                                                method)
+            except ValueError:
+                pass
+            else:
+                assert False, method
+
+    def test_it_should_sweep_the_number_to_keep_in_the_report(self):
+        settings = feature_pruning.report_settings(synthetic_featuresets(), 1)
+        keeps = set(keep for (method, _, keep) in settings
+                    if method != 'frequency' or keep is not None)
+        assert len(keeps) > 1
+        assert None not in keeps
+
+class TestMarkCorpus:
+
+    def classifier_tree(self, root):
+        folder = os.path.join(root, 'classifiers', 'internal', 'tagged')
+        os.makedirs(folder)
+        for (name, label) in (('Quoted', True), ('Unquoted', False)):
+            with open(os.path.join(folder, name + '.pickle'), 'wb') as fout:
+                pickle.dump(nltk.DecisionTreeClassifier(label), fout)
+        with open(os.path.join(folder, 'notes.txt'), 'w') as fout:
+            fout.write('not a classifier')
+        compact_model.save_model(
+            nltk.NaiveBayesClassifier.train(synthetic_featuresets()),
+            os.path.join(folder, 'Bayes.model'))
+        return folder
+
+    def test_it_should_find_pickles_and_compact_models(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            folder = self.classifier_tree(tmp)
+            found = mark_quotes.find_classifiers(
+                os.path.join(tmp, 'classifiers'))
+        assert [os.path.join(folder, 'Bayes.model'),
+                os.path.join(folder, 'Quoted.pickle'),
+                os.path.join(folder, 'Unquoted.pickle')] == found
+
+    def test_it_should_split_classifier_paths(self):
+        folder = os.path.join('classifiers', 'internal', 'tagged')
+        parts = mark_quotes.classifier_parts
+        assert ('internal', 'tagged', 'Quoted') == parts(
+            os.path.join(folder, 'Quoted.pickle'))
+        assert ('internal', 'tagged', 'Bayes') == parts(
+            os.path.join(folder, 'Bayes.model', ''))
+
+    def test_it_should_mark_like_one_classifier_at_a_time(self):
+        cwd = os.getcwd()
+        build_tagger = mark_quotes.build_tagger
+        with tempfile.TemporaryDirectory() as tmp:
+            try:
+                os.chdir(tmp)
+                mark_quotes.build_tagger = lambda: nltk.RegexpTagger(
+                    [(r'.*', 'NN')])
+                self.classifier_tree(tmp)
+                os.makedirs('corpus')
+                for (name, text) in (('a.txt', 'He left. "Hi," she said.'),
+                                     ('b.txt', 'The end came. Bye.')):
+                    with open(os.path.join('corpus', name), 'w') as fout:
+                        fout.write(text)
+
+                mark_quotes.mark_corpus(mark_quotes.parse_args(
+                    ['-i', 'corpus', '-d', 'classifiers', '-j', '2',
+                     '-o', 'pooled']))
+                for path in mark_quotes.find_classifiers('classifiers'):
+                    mark_quotes.mark_all_files(mark_quotes.parse_args(
+                        ['-i', 'corpus', '-c', path, '-o', 'serial']))
+                    (model, corpus, name) = mark_quotes.classifier_parts(path)
+                    for fn in ('a.txt', 'b.txt'):
+                        parts = ('marked_corpus', model,
+                                 'trained_on_' + corpus, name, fn)
+                        with open(os.path.join('serial', *parts)) as fin:
+                            expected = fin.read()
+                        with open(os.path.join('pooled', *parts)) as fin:
+                            actual = fin.read()
+                        assert expected == actual
+                        assert ('^' in actual) == (name == 'Quoted')
+            finally:
+                mark_quotes.build_tagger = build_tagger
+                os.chdir(cwd)
+
+class TestStandoff:
+
+    def assert_round_trip(self, output_format):
+        spans = [(0, 5), (9, 14), (20, 31)]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = standoff.sidecar_path(os.path.join(tmp, 'doc.txt'),
+                                         output_format)
+            assert standoff.is_sidecar(path)
+            assert os.path.join(tmp, 'doc.txt') == standoff.source_name(path)
+            standoff.write_spans(path, spans, 'doc.txt', 40)
+            assert spans == [tuple(span) for span in
+                             standoff.read_spans(path).tolist()]
+            assert 40 == standoff.read_sidecar(path)[1]
+
+    def test_it_should_round_trip_json_lines(self):
+        self.assert_round_trip('spans')
+
+    def test_it_should_round_trip_npy(self):
+        self.assert_round_trip('npy')
+
+    def test_it_should_round_trip_no_spans(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for output_format in standoff.FORMATS:
+                path = standoff.sidecar_path(os.path.join(tmp, 'doc.txt'),
+                                             output_format)
+                standoff.write_spans(path, [])
+                (spans, length) = standoff.read_sidecar(path)
+                assert (0, 2) == spans.shape
+                assert length is None
+
+    def test_it_should_read_npy_sidecars_without_a_length(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'doc.txt' + standoff.NPY)
+            np.save(path, np.array([[0, 5], [9, 14]], dtype=np.int64))
+            (spans, length) = standoff.read_sidecar(path)
+        assert [[0, 5], [9, 14]] == spans.tolist()
+        assert length is None
+
+    def test_it_should_render_carets_from_spans(self):
+        text = 'He said. "Hi." She left.'
+        spans = standoff.merge_spans([(9, 14), (0, 8), (4, 8)])
+        assert [[0, 8], [9, 14]] == spans.tolist()
+        rendered = standoff.render_carets(text, spans)
+        assert '^He said. ^"Hi." She left.' == rendered
+        positions = standoff.caret_positions(spans).tolist()
+        assert ['^', '^'] == [rendered[i] for i in positions]
+
+class TestMarkServer:
+
+    def respond(self, server, *lines):
+        async def run():
+            return [await server.respond(line) for line in lines]
+        return asyncio.run(run())
+
+    def test_it_should_answer_bad_requests_with_errors(self):
+        server = mark_daemon.MarkServer({'a': 'a.pickle', 'b': 'b.pickle'},
+                                        None)
+        responses = self.respond(server, b'not json', b'[]',
+                                 b'{"text": "Hi."}',
+                                 b'{"text": "Hi.", "classifier": "c"}')
+        assert all('error' in response for response in responses)
+
+    def test_it_should_answer_failed_marking_with_an_error(self):
+        # The worker was never set up, so marking fails in the pool.
+        with ThreadPoolExecutor(1) as pool:
+            server = mark_daemon.MarkServer({'a': 'missing.pickle'}, pool)
+            responses = self.respond(server, b'{"text": "Hi."}',
+                                     b'{"text": "Bye."}')
+        assert 2 == len(responses)
+        assert all('error' in response for response in responses)
+
+    def test_it_should_reload_a_re_exported_model(self):
+        training = synthetic_featuresets()
+        worker = dict(mark_daemon._WORKER)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'classifier.model')
+            vocab = os.path.join(path, compact_model.VOCAB)
+            try:
+                mark_daemon._WORKER.update(classifiers={}, cache=None)
+                compact_model.save_model(
+                    nltk.NaiveBayesClassifier.train(training), path)
+                os.utime(vocab, ns=(0, 0))
+                assert [False, True] == mark_daemon.get_classifier(path).labels
+                dir_stat = os.stat(path)
+                compact_model.save_model(nltk.NaiveBayesClassifier.train(
+                    [(fs, 'x') for (fs, _) in training]), path)
+                os.utime(path, ns=(dir_stat.st_atime_ns, dir_stat.st_mtime_ns))
+                os.utime(vocab, ns=(10 ** 9, 10 ** 9))
+                assert ['x'] == mark_daemon.get_classifier(path).labels
+            finally:
+                mark_daemon._WORKER.clear()
+                mark_daemon._WORKER.update(worker)
+
+class TestMarkStream:
+
+    text = ('He left. "Hi," she said.\n\n'
+            'The end "came\n\nand went." Then.\n\n') * 2
+
+    def mark(self, chunk_size):
+        fout = io.StringIO()
+        mark_quotes.mark_stream(
+            io.StringIO(self.text), fout,
+            Current(train_quotes.is_quote, train_quotes.is_word),
+            nltk.RegexpTagger([(r'.*', 'NN')]),
+            nltk.DecisionTreeClassifier(True), 'spans', chunk_size,
+        )
+        return fout.getvalue()
+
+    def test_it_should_cut_paragraphs_outside_of_quotes(self):
+        expected = split_paragraphs(self.text)
+        assert [0, 25, 58, 84, 117] == [offset for (offset, _) in expected]
+        for chunk_size in (1, 5, 17, 1000):
+            actual = list(read_paragraphs(io.StringIO(self.text), chunk_size))
+            assert expected == actual
+
+    def test_it_should_mark_the_same_whatever_the_chunk_size(self):
+        expected = self.mark(len(self.text))
+        assert '{"start": 35, "end": 50}\n' in expected
+        for chunk_size in (1, 5, 17, 1000):
+            assert expected == self.mark(chunk_size)
+
+class TestIncremental:
+
+    text = ('He left. "Hi," she said.\n\nThe end came.\n\n'
+            '"Yes." Bye.')
+
+    def mark(self, text, previous):
+        manager = Current(train_quotes.is_quote, train_quotes.is_word)
+        return incremental.mark_incremental(
+            text, previous, manager, nltk.RegexpTagger([(r'.*', 'NN')]),
+            nltk.DecisionTreeClassifier(True),
+            nltk.tokenize.PunktSentenceTokenizer(),
+        )
+
+    def spans(self, quotes):
+        return [(spans, quoted) for (_, spans, quoted) in quotes]
+
+    def test_it_should_reuse_the_paragraphs_that_did_not_change(self):
+        (_, paragraphs, reused) = self.mark(self.text, {})
+        assert 0 == reused
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'doc' + incremental.STATE)
+            incremental.save_state(path, 'key', 'doc.txt', paragraphs)
+            previous = incremental.load_state(path, 'key')
+            assert {} == incremental.load_state(path, 'other key')
+        edited = self.text.replace('came', 'went')
+        (quotes, _, reused) = self.mark(edited, previous)
+        assert 2 == reused
+        assert self.spans(self.mark(edited, {})[0]) == self.spans(quotes)
+
+class TestThresholds:
+
+    def test_it_should_quote_sentences_at_or_over_the_threshold(self):
+        probs = np.array([0.2, 0.5, 0.7, 0.49])
+        assert [False, True, True, False] == \
+            thresholds.apply_threshold(probs).tolist()
+        assert [False, False, True, False] == \
+            thresholds.apply_threshold(probs, 0.6).tolist()
+
+    def test_it_should_keep_quotes_open_between_the_thresholds(self):
+        probs = np.array([0.5, 0.9, 0.5, 0.3, 0.5, 0.1, 0.5, 0.8])
+        quoted = thresholds.apply_hysteresis(probs, 0.3, 0.8)
+        assert [False, True, True, True, True, False, False, True] == \
+            quoted.tolist()
+
+    def test_it_should_refuse_a_low_threshold_over_the_high_one(self):
+        try:
+            thresholds.apply_hysteresis(np.array([0.5]), 0.8, 0.3)
+        except ValueError:
+            pass
+        else:
+            assert False, 'expected a ValueError'
+
+    def test_it_should_round_trip_scores(self):
+        spans = [(0, 4), (5, 9)]
+        probs = [[0.75, 0.25], [0.125, 0.875]]
+        for labels in ([False, True], ['no', 'yes']):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, 'doc' + thresholds.SCORES)
+                thresholds.save_scores(path, spans, probs, labels)
+                (spans_read, probs_read, labels_read) = \
+                    thresholds.load_scores(path)
+            assert [[0, 4], [5, 9]] == spans_read.tolist()
+            assert probs == probs_read.tolist()
+            assert labels == labels_read
+
+    def test_it_should_round_trip_no_sentences(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'doc' + thresholds.SCORES)
+            thresholds.save_scores(path, [], np.zeros((0, 2)), [False, True])
+            (spans, probs, labels) = thresholds.load_scores(path)
+        assert (0, 2) == spans.shape
+        assert [] == thresholds.quoted_probs(probs, labels).tolist()
+
+class TestExplicitQuotes:
+
+    text = ('He left. "Hi," she said. The end "came. So. And went." '
+            'Then it rained.')
+
+    class Spy(nltk.ClassifierI):
+
+        def __init__(self, classifier):
+            self.classifier = classifier
+            self.seen = []
+
+        def labels(self):
+            return self.classifier.labels()
+
+        def classify_many(self, featuresets):
+            self.seen += featuresets
+            return batch_classify.classify_many(self.classifier, featuresets)
+
+    def tag(self):
+        manager = Current(train_quotes.is_quote, train_quotes.is_word)
+        tagged = manager.tag_text(self.text,
+                                  nltk.RegexpTagger([(r'.*', 'NN')]),
+                                  nltk.tokenize.PunktSentenceTokenizer())
+        fsets = [manager.get_training_features(sentence)
+                 for sentence in tagged]
+        return (tagged, fsets, mark_quotes.explicit_states(tagged,
+                                                           manager.is_quote))
+
+    def test_it_should_fix_sentences_in_and_with_quotation_marks(self):
+        (_, _, fixed) = self.tag()
+        assert [False, True, False, False, True, True, True, False] == fixed
+
+    def test_it_should_classify_only_the_ambiguous_sentences(self):
+        (tagged, fsets, fixed) = self.tag()
+        spy = self.Spy(nltk.DecisionTreeClassifier(False))
+        labels = mark_quotes.fill_ambiguous(
+            fixed, mark_quotes.classify_ambiguous(spy, tagged, fsets, fixed))
+        assert [fsets[i][0] for i in (0, 2, 3, 7)] == spy.seen
+        assert fixed == labels
+
+    def test_it_should_agree_with_the_classifier_alone(self):
+        (tagged, fsets, fixed) = self.tag()
+        # Trained on the explicit states, the classifier agrees with them.
+        classifier = nltk.NaiveBayesClassifier.train(
+            [(features, is_fixed)
+             for ((features, _, _), is_fixed) in zip(fsets, fixed)])
+        expected = batch_classify.classify_many(
+            classifier, [features for (features, _, _) in fsets])
+        assert fixed == expected
+        assert expected == mark_quotes.fill_ambiguous(
+            fixed, mark_quotes.classify_ambiguous(classifier, tagged, fsets,
+                                                  fixed))
+
+class TestWriteScores:
+
+    def test_it_should_score_explicit_quotes_as_quoted(self):
+        fsets = [({}, [(0, 4)], None), ({}, [(5, 9)], None),
+                 ({}, [], None), ({}, [(10, 14)], None)]
+        fixed = [False, True, False, False]
+        probs = [[0.75, 0.25], [0.5, 0.5], [0.125, 0.875]]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'doc' + thresholds.SCORES)
+            mark_quotes.write_scores(path, fsets, fixed, probs,
+                                     [False, True])
+            (spans, scores, labels) = thresholds.load_scores(path)
+        assert [[0, 4], [5, 9], [10, 14]] == spans.tolist()
+        assert [0.25, 1.0, 0.875] == thresholds.quoted_probs(
+            scores, labels).tolist()
+
+class TestSentenceCache:
+
+    def test_it_should_keep_the_entries_that_are_used(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = sentence_cache.SentenceCache(os.path.join(tmp, 'c.db'), 3)
+            for key in 'abc':
+                cache.put(key, key.upper())
+            cache.commit()
+            assert {'a': 'A'} == cache.get_many(['a'])
+            cache.put('d', 'D')
+            cache.commit()
+            (kept,) = zip(*cache.db.execute('SELECT key FROM entries'))
+            cache.close()
+        assert ['a', 'c', 'd'] == sorted(kept)
+
+    def test_it_should_share_use_times_across_processes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'c.db')
+            first = sentence_cache.SentenceCache(path, 3)
+            second = sentence_cache.SentenceCache(path, 3)
+            first.put('a', 1)
+            first.put('b', 2)
+            first.commit()
+            second.put('c', 3)
+            second.commit()
+            assert {'a': 1} == first.get_many(['a'])
+            first.commit()
+            second.put('d', 4)
+            second.commit()
+            assert {'a': 1, 'c': 3, 'd': 4} == second.get_many('abcd')
+            first.close()
+            second.close()
+
+class TestAgreement:
+
+    def test_it_should_find_quoted_spans_in_caret_text(self):
+        (spans, length) = agreement.caret_spans('^He left.She said.^Hi.')
+        assert [[0, 8], [17, 20]] == spans.tolist()
+        assert 20 == length
+
+    def test_it_should_cut_the_text_into_segments(self):
+        (bounds, weights, members) = agreement.segment_membership(
+            [np.array([[2, 6]]), np.array([[3, 8]])], 20)
+        assert [0, 2, 3, 6, 8, 20] == bounds.tolist()
+        assert [2, 1, 3, 2, 12] == weights.tolist()
+        assert [[False, True, True, False, False],
+                [False, False, True, True, False]] == members.tolist()
+
+    def test_it_should_count_agreement_and_kappa(self):
+        (_, weights, members) = agreement.segment_membership(
+            [np.array([[2, 6]]), np.array([[3, 8]])], 20)
+        counts = agreement.pair_counts(weights, members)
+        assert [[14, 2], [1, 3]] == counts[0, 1].tolist()
+        assert [[15, 0], [0, 5]] == counts[1, 1].tolist()
+        assert 0.85 == np.trace(counts[0, 1]) / counts[0, 1].sum()
+        assert abs(agreement.kappa(counts[0, 1]) - 4 / 7) < 1e-9
+        assert 1.0 == agreement.kappa(counts[1, 1])
+
+    def test_it_should_find_hot_spots(self):
+        (bounds, weights, members) = agreement.segment_membership(
+            [np.array([[2, 6]]), np.array([[3, 8]]), np.array([[3, 8]])], 20)
+        (first, last, splits) = agreement.hot_spots(bounds, weights, members)
+        assert [1, 3] == first.tolist()
+        assert [2, 4] == last.tolist()
+        assert np.allclose([2 / 3, 2 / 3], splits)
+
+    def test_it_should_read_the_document_length_from_every_sidecar(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            results = []
+            for output_format in standoff.FORMATS:
+                marked_dir = os.path.join(tmp, output_format)
+                for (name, spans) in (('A', [(2, 6)]), ('B', [(3, 8)])):
+                    folder = os.path.join(marked_dir, 'internal',
+                                          'trained_on_tagged', name)
+                    os.makedirs(folder)
+                    standoff.write_spans(standoff.sidecar_path(
+                        os.path.join(folder, 'doc.txt'), output_format),
+                        spans, 'doc.txt', 20)
+                results.append(agreement.compare(marked_dir))
+        for (classifiers, counts, spots) in results:
+            assert ['internal/tagged/A', 'internal/tagged/B'] == classifiers
+            assert [[14, 2], [1, 3]] == counts[0, 1].tolist()
+            assert [('doc.txt', 6, 8, 1.0, ['internal/tagged/B']),
+                    ('doc.txt', 2, 3, 1.0, ['internal/tagged/A'])] == spots
+
+class TestConcordance:
+
+    texts = {
+        'a.txt': 'Clarissa left. "Clarissa," he said.',
+        'b.txt': '"Where is Clarissa?" asked Peter.',
+    }
+
+    def add(self, index, path, text=None):
+        index.add_document(
+            path, self.texts[path] if text is None else text,
+            Current(train_quotes.is_quote, train_quotes.is_word),
+            nltk.tokenize.PunktSentenceTokenizer(),
+        )
+
+    def test_it_should_find_a_word_in_and_out_of_quotes(self):
+        index = concordance.Concordance()
+        self.add(index, 'a.txt')
+        found = index.lookup('Clarissa')
+        assert [0, 16] == found['start'].tolist()
+        assert [False, True] == found['quoted'].tolist()
+        assert [0, 1] == found['sentence'].tolist()
+        assert [16] == index.lookup('clarissa', quoted=True)['start'].tolist()
+        assert [] == index.lookup('septimus')['start'].tolist()
+
+    def test_it_should_merge_documents_and_replace_them(self):
+        index = concordance.Concordance()
+        self.add(index, 'a.txt')
+        assert 2 == len(index.lookup('clarissa')['start'])
+        self.add(index, 'b.txt')
+        found = index.lookup('clarissa')
+        assert [0, 0, 1] == found['document'].tolist()
+        self.add(index, 'a.txt', 'Nobody here.')
+        assert [1] == index.lookup('clarissa')['document'].tolist()
+        assert [0] == index.lookup('nobody')['document'].tolist()
+
+    def test_it_should_round_trip_and_show_context(self):
+        index = concordance.Concordance()
+        self.add(index, 'a.txt')
+        self.add(index, 'b.txt')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'index.npz')
+            index.save(path)
+            loaded = concordance.Concordance.load(path)
+        assert index.vocab.tolist() == loaded.vocab.tolist()
+        rows = list(loaded.concordance('clarissa', quoted=True, width=5,
+                                       read=self.texts.get))
+        assert [('a.txt', 1, True, 'ft. "', 'Clarissa', '," he'),
+                ('b.txt', 0, True, 'e is ', 'Clarissa', '?" as')] == rows
+
+class TestDocumentDensities:
+
+    def test_it_should_count_a_marked_file_against_its_source(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'corpus'))
+            os.makedirs(os.path.join(tmp, 'marked'))
+            with open(os.path.join(tmp, 'corpus', 'doc.txt'), 'w') as fout:
+                fout.write('"Hi," she said. "Bye."')
+            marked_fn = os.path.join(tmp, 'marked', 'doc.txt')
+            with open(marked_fn, 'w') as fout:
+                fout.write('^"Hi," she said. ^"Bye."')
+            densities = density.document_densities(
+                marked_fn, os.path.join(tmp, 'corpus'))
+            carets = density.caret_locations(marked_fn)
+            with open(marked_fn, 'w') as fout:
+                fout.write('"Hi," she said. ^"Bye."')
+            os.utime(marked_fn, ns=(0, 0))
+            remarked = density.document_densities(
+                marked_fn, os.path.join(tmp, 'corpus'))
+        assert ['carets', 'marks', 'quotes'] == sorted(densities)
+        assert 4 == densities['marks'].count(0, 22)
+        assert 2 == densities['quotes'].count(0, 22)
+        assert [0, 17] == carets.tolist()
+        assert 2 == densities['carets'].count(0, 22)
+        assert 1 == remarked['carets'].count(0, 22)
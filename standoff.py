@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+
+"""\
+Standoff output for marked documents. Instead of writing a full copy of the
+text with ^ markers, marking can write a small sidecar file listing the
+(start, end) offsets of the quoted sentences in the source text. The caret
+text can be rendered from the sidecar and the source on demand, and since
+the offsets point into the source, nothing drifts.
+
+Sidecars are either JSON lines (a header line and then one {"start", "end"}
+line per span) or a NumPy .npy array of shape (n + 1, 2), whose first row is
+a (-1, length) header giving the length of the source (-1 if unknown).
+
+usage: standoff.py SPANS_FILE SOURCE_FILE [-o OUTPUT_FILE]
+"""
+
+
+import argparse
+import codecs
+import json
+import sys
+
+import numpy as np
+
+
+JSONL = '.spans.jsonl'
+NPY = '.spans.npy'
+FORMATS = {
+    'spans': JSONL,
+    'npy': NPY,
+}
+
+
+def quote_spans(quotes):
+    """\
+    This takes (features, spans, quoted) for each sentence, like
+    `mark_quotes.insert_quotes_many` yields, and returns an (n, 2) array of
+    the (start, end) offsets of the quoted sentences.
+    """
+    spans = [(spans[0][0], spans[-1][1])
+             for (_, spans, quoted) in quotes
+             if spans and quoted]
+    return np.array(spans, dtype=np.int64).reshape((len(spans), 2))
+
+
+def merge_spans(spans):
+    """This merges overlapping or touching spans."""
+    spans = np.asarray(spans, dtype=np.int64).reshape((-1, 2))
+    if len(spans) == 0:
+        return spans
+    spans = spans[np.argsort(spans[:, 0], kind='stable')]
+    ends = np.maximum.accumulate(spans[:, 1])
+    starts_run = np.ones(len(spans), dtype=bool)
+    starts_run[1:] = spans[1:, 0] > ends[:-1]
+    run_starts = np.flatnonzero(starts_run)
+    run_ends = np.append(run_starts[1:], len(spans)) - 1
+    return np.column_stack((spans[run_starts, 0], ends[run_ends]))
+
+
+def sidecar_path(path, output_format):
+    """This returns the sidecar path for a marked output file."""
+    return path + FORMATS[output_format]
+
+
+def source_name(path):
+    """This strips the sidecar extension off of a path."""
+    for ext in (JSONL, NPY):
+        if path.endswith(ext):
+            return path[:-len(ext)]
+    return path
+
+
+def is_sidecar(path):
+    return path.endswith(JSONL) or path.endswith(NPY)
+
+
+def write_spans(path, spans, source=None, length=None):
+    """\
+    This writes the spans to `path`, as JSON lines or .npy depending on the
+    extension. The JSON header records the source file and its length, and
+    the .npy header row records the length.
+    """
+    spans = np.asarray(spans, dtype=np.int64).reshape((-1, 2))
+    if path.endswith(NPY):
+        header = [[-1, -1 if length is None else length]]
+        np.save(path, np.concatenate((np.array(header, dtype=np.int64),
+                                      spans)))
+        return
+    with open(path, 'w') as fout:
+        fout.write(json.dumps({'source': source, 'length': length}) + '\n')
+        for (start, end) in spans.tolist():
+            fout.write('{{"start": {}, "end": {}}}\n'.format(start, end))
+
+
+def read_sidecar(path):
+    """\
+    This reads a sidecar file and returns the spans as an (n, 2) array and
+    the length of the source, or None if the sidecar doesn't record it.
+    Older .npy sidecars without a header row have no length.
+    """
+    if path.endswith(NPY):
+        spans = np.load(path).reshape((-1, 2))
+        if len(spans) == 0 or spans[0, 0] >= 0:
+            return (spans, None)
+        length = int(spans[0, 1])
+        return (spans[1:], length if length >= 0 else None)
+    with open(path) as fin:
+        header = json.loads(fin.readline())
+        spans = [(span['start'], span['end'])
+                 for span in (json.loads(line) for line in fin if line.strip())]
+    return (np.array(spans, dtype=np.int64).reshape((len(spans), 2)),
+            header.get('length'))
+
+
+def read_spans(path):
+    """This reads the spans from a sidecar file as an (n, 2) array."""
+    return read_sidecar(path)[0]
+
+
+def caret_positions(spans):
+    """\
+    This returns where the carets fall in the rendered text: one before each
+    span, shifted by the carets inserted before it.
+    """
+    starts = np.asarray(spans, dtype=np.int64).reshape((-1, 2))[:, 0]
+    return np.sort(starts) + np.arange(len(starts))
+
+
+def render_carets(text, spans):
+    """This returns the text with a ^ inserted before each span."""
+    starts = np.sort(np.asarray(spans, dtype=np.int64).reshape((-1, 2))[:, 0])
+    buf = []
+    prev = 0
+    for start in starts.tolist():
+        buf.append(text[prev:start])
+        buf.append('^')
+        prev = start
+    buf.append(text[prev:])
+    return ''.join(buf)
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('spans', metavar='SPANS_FILE',
+                        help='The sidecar file to render.')
+    parser.add_argument('source', metavar='SOURCE_FILE',
+                        help='The source text the spans point into.')
+    parser.add_argument('-o', '--output', dest='output',
+                        metavar='OUTPUT_FILE',
+                        help='The file to write the caret text to. '
+                             'Default = stdout.')
+
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    with codecs.open(args.source, 'r', 'utf8') as fin:
+        text = fin.read()
+    rendered = render_carets(text, read_spans(args.spans))
+    if args.output is None:
+        sys.stdout.write(rendered)
+    else:
+        with codecs.open(args.output, 'w', 'utf8') as fout:
+            fout.write(rendered)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+
+"""\
+This computes the quotation statistics from ps.py for every file in a corpus,
+reading and searching each file once, across a pool of processes. It prints
+them, or writes them to a CSV or JSON file. With --words, it prints the most
+common words inside and outside of quotes instead.
+
+usage: stats.py [-j JOBS] [-o OUTPUT_FILE | -w WORDS] [--text-cache DIR]
+                CORPUS_DIR
+"""
+
+
+import argparse
+import sys
+
+import docstore
+import ps
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('corpus', metavar='CORPUS_DIR',
+                        help='The folder of texts.')
+    parser.add_argument('-o', '--output', dest='output',
+                        metavar='OUTPUT_FILE',
+                        help='Write the statistics here instead of printing '
+                             'them: JSON if this ends in .json, CSV '
+                             'otherwise.')
+    parser.add_argument('-w', '--words', dest='words', type=int,
+                        metavar='WORDS',
+                        help='Print this many of the most common words '
+                             'inside and outside of quotes.')
+    parser.add_argument('--text-cache', dest='text_cache', metavar='DIR',
+                        help='Keep the cleaned texts in this folder, so '
+                             'later runs over the same files skip reading '
+                             'and cleaning them.')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=None,
+                        help='The number of worker processes. '
+                             'Default = one per CPU.')
+
+    args = parser.parse_args(argv)
+    if args.words is not None and args.output is not None:
+        parser.error('--words only prints.')
+    return args
+
+
+def main():
+    args = parse_args()
+    if args.text_cache is not None:
+        docstore.configure(args.text_cache)
+    corpus = sorted(ps.all_files(args.corpus))
+    if args.words is not None:
+        ps.print_frequencies(*ps.corpus_frequencies(corpus, args.jobs),
+                             n=args.words)
+    elif args.output is None:
+        ps.print_stats(corpus, args.jobs)
+    else:
+        ps.write_stats(ps.corpus_stats(corpus, args.jobs), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+
+"""\
+This re-marks documents from cached probability scores. Marking with
+--scores saves the probability of each label for each sentence in a small
+.scores.npz file per document, so trying another decision threshold, or
+hysteresis, doesn't mean tagging and classifying everything again.
+
+With a threshold, a sentence is quoted if its probability of being quoted
+is at least the threshold. With hysteresis, a quote starts at a sentence
+whose probability is at least --high and runs until one whose probability
+is under --low, which keeps a single doubtful sentence from breaking up a
+long speech.
+
+usage: thresholds.py SCORE_FILE SOURCE_FILE [-t THRESHOLD | --low LOW --high
+                     HIGH] [-f text|spans|npy] [-o OUTPUT_FILE]
+"""
+
+
+import argparse
+import codecs
+import sys
+
+import numpy as np
+
+import standoff
+
+
+# Score files go in their own tree, mirroring the marked output.
+PREFIX = 'scores_'
+SCORES = '.scores.npz'
+THRESHOLD = 0.5
+
+
+def save_scores(path, spans, probs, labels):
+    """\
+    This writes the sentence spans, an (n, 2) array of offsets into the
+    source, and their label probabilities, an (n, len(labels)) array.
+    """
+    np.savez_compressed(
+        path,
+        spans=np.asarray(spans, dtype=np.int64).reshape((-1, 2)),
+        probs=np.asarray(probs, dtype=np.float64),
+        labels=np.array(labels),
+    )
+
+
+def load_scores(path):
+    """This reads a score file and returns (spans, probs, labels)."""
+    with np.load(path) as scores:
+        return (scores['spans'], scores['probs'], scores['labels'].tolist())
+
+
+def quoted_probs(probs, labels):
+    """This returns the probability that each sentence is quoted."""
+    if True not in labels:
+        raise ValueError('These scores have no quoted label.')
+    return probs[:, labels.index(True)]
+
+
+def apply_threshold(probs, threshold=THRESHOLD):
+    return probs >= threshold
+
+
+def apply_hysteresis(probs, low, high):
+    """\
+    This returns whether each sentence is quoted: sentences at or over
+    `high` start a quote, sentences under `low` end one, and the ones in
+    between take the label of the sentence before them.
+    """
+    if low > high:
+        raise ValueError('The low threshold is over the high one.')
+    state = np.full(len(probs), -1)
+    state[probs >= high] = 1
+    state[probs < low] = 0
+    decided = np.maximum.accumulate(
+        np.where(state >= 0, np.arange(len(probs)), -1)
+    )
+    return np.where(decided >= 0, state[np.maximum(decided, 0)], 0) == 1
+
+
+def render_marked(text, spans, quoted):
+    """\
+    This returns each sentence of the text, with a ^ before the quoted
+    ones, the way `mark_quotes.write_marked_text` writes them.
+    """
+    buf = []
+    for ((start, end), is_quoted) in zip(spans.tolist(), quoted.tolist()):
+        if is_quoted:
+            buf.append('^')
+        buf.append(text[start:end])
+    return ''.join(buf)
+
+
+def parse_args(argv=None):
+    """This parses the command line."""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = argparse.ArgumentParser(description=__doc__)
+
+    parser.add_argument('scores', metavar='SCORE_FILE',
+                        help='The score file written by mark_quotes.py '
+                             '--scores.')
+    parser.add_argument('source', metavar='SOURCE_FILE',
+                        help='The source text the scores point into.')
+    parser.add_argument('-t', '--threshold', dest='threshold', type=float,
+                        default=THRESHOLD,
+                        help='The probability a sentence needs to be marked '
+                             'as quoted. Default = {}.'.format(THRESHOLD))
+    parser.add_argument('--low', dest='low', type=float,
+                        help='With --high, use hysteresis. Quotes end at '
+                             'sentences under this probability.')
+    parser.add_argument('--high', dest='high', type=float,
+                        help='With --low, use hysteresis. Quotes start at '
+                             'sentences with at least this probability.')
+    parser.add_argument('-f', '--format', dest='format', default='text',
+                        choices=['text'] + sorted(standoff.FORMATS),
+                        help='Write the marked text with carets (text), or '
+                             'a sidecar of the quoted spans. Default = text.')
+    parser.add_argument('-o', '--output', dest='output',
+                        metavar='OUTPUT_FILE',
+                        help='The file to write to. Default = stdout, which '
+                             'only works for text.')
+
+    args = parser.parse_args(argv)
+    if (args.low is None) != (args.high is None):
+        parser.error('--low and --high go together.')
+    if args.format != 'text' and args.output is None:
+        parser.error('Sidecars need an --output file.')
+    return args
+
+
+def main():
+    args = parse_args()
+    (spans, probs, labels) = load_scores(args.scores)
+    probs = quoted_probs(probs, labels)
+    if args.low is not None:
+        quoted = apply_hysteresis(probs, args.low, args.high)
+    else:
+        quoted = apply_threshold(probs, args.threshold)
+
+    with codecs.open(args.source, 'r', 'utf8') as fin:
+        text = fin.read()
+    if args.format != 'text':
+        standoff.write_spans(standoff.sidecar_path(args.output, args.format),
+                             spans[quoted], args.source, len(text))
+    elif args.output is None:
+        sys.stdout.write(render_marked(text, spans, quoted))
+    else:
+        with codecs.open(args.output, 'w', 'utf8') as fout:
+            fout.write(render_marked(text, spans, quoted))
+
+
+if __name__ == '__main__':
+    main()
@@ -32,7 +32,11 @@ import notification
 import nltk
 import nltk.corpus
 
+import batch_classify
+import evaluate
+import feature_pruning
 from fset_manager import Current, TAGGED
+import weighted_training
 
 
 TEST_SET_RATIO = 0.2
@@ -64,9 +68,26 @@ def produce_confusion_matrix(test_features, classifier):
     """Produces a confusion matrix for the test classifier"""
 
     gold = [feature for (__, feature) in test_features]
-    test = [classifier.classify(features) for (features, __) in test_features]
-    cm = nltk.ConfusionMatrix(gold, test)
-    print(cm.pretty_format(sort_by_count=True, show_percents=True, truncate=9))
+    test = batch_classify.classify_many(
+        classifier, (features for (features, __) in test_features)
+    )
+    report = evaluate.evaluation_report(gold, test, n_resamples=0)
+    print(evaluate.format_report(report))
+
+
+def evaluate_classifier(classifier, test,
+                        n_resamples=evaluate.BOOTSTRAP_RESAMPLES):
+    """This prints a trained classifier's precision, recall, F1, and
+    confusion matrix on `test`, with bootstrap confidence intervals."""
+    gold = [label for (_, label) in test]
+    predicted = batch_classify.classify_many(
+        classifier, (features for (features, _) in test)
+    )
+    report = evaluate.evaluation_report(gold, predicted,
+                                        n_resamples=n_resamples)
+    print('Evaluating {}'.format(type(classifier).__name__))
+    print(evaluate.format_report(report))
+    return report
 
 
 def cross_validate(cls, training_features, num_folds=10):
@@ -84,8 +105,8 @@ def cross_validate(cls, training_features, num_folds=10):
         testing_this_round = training_features[i * subset_size:][:subset_size]
         training_this_round = (training_features[:i * subset_size] +
                                training_features[(i + 1) * subset_size:])
-        classifier = cls.train(training_this_round)
-        accuracy = nltk.classify.accuracy(classifier, testing_this_round)
+        classifier = weighted_training.train(cls, training_this_round)
+        accuracy = batch_classify.accuracy(classifier, testing_this_round)
         accuracies.append(accuracy)
         print('Accuracy for fold {} = {}'.format(i, accuracy))
 
@@ -110,8 +131,8 @@ def cross_validate_sets(cls, training_features, num_folds=10):
 def cross_validate_p(cls, training, test):
     """This performs the cross-validation on one fold."""
     print("cross validating " + str(cls))
-    classifier = cls.train(training)
-    accuracy = nltk.classify.accuracy(classifier, test)
+    classifier = weighted_training.train(cls, training)
+    accuracy = batch_classify.accuracy(classifier, test)
     return (cls, accuracy)
 
 
@@ -137,8 +158,8 @@ def get_baseline(cls, training, test, base_value):
     """This returns the accuracy for a baseline training, i.e.,
     training based on everything being `base_value`."""
     baseline = [(fs, base_value) for (fs, _) in training]
-    classifier = cls.train(baseline)
-    return nltk.classify.accuracy(classifier, test)
+    classifier = weighted_training.train(cls, baseline)
+    return batch_classify.accuracy(classifier, test)
 
 
 def report_classifier(cls, accuracy, training, test,
@@ -163,7 +184,7 @@ def report_classifier(cls, accuracy, training, test,
         os.makedirs(os.path.join(outdir, model, corpus_dir))
     output = os.path.join(outdir, model, corpus_dir, name + '.pickle')
     baseline = get_baseline(cls, training, test, False)
-    classifier = cls.train(featureset)
+    classifier = weighted_training.train(cls, featureset)
     with open(output, 'wb') as fout:
         pickle.dump(classifier, fout)
     return (output, accuracy, baseline)
@@ -186,8 +207,36 @@ def parse_args(argv=None):
                         action='store', default='classifiers',
                         help='The directory to write the pickled classifiers '
                              'to. Default = ./classifiers/.')
-
-    return parser.parse_args(argv)
+    parser.add_argument('-b', '--bootstrap', dest='bootstrap', type=int,
+                        default=evaluate.BOOTSTRAP_RESAMPLES,
+                        help='The number of bootstrap resamples for the '
+                             'evaluation report, or 0 to skip the intervals. '
+                             'Default = {}.'.format(
+                                 evaluate.BOOTSTRAP_RESAMPLES))
+    parser.add_argument('-p', '--prune', dest='prune',
+                        choices=feature_pruning.PRUNE_METHODS,
+                        help='Prune the features before training, using '
+                             'frequency, chi-squared, or mutual information '
+                             'scores from the training set.')
+    parser.add_argument('--min-count', dest='min_count', type=int,
+                        default=feature_pruning.MIN_COUNT,
+                        help='When pruning, drop features seen fewer than '
+                             'this many times. Default = {}.'.format(
+                                 feature_pruning.MIN_COUNT))
+    parser.add_argument('--keep', dest='keep', type=int,
+                        help='When pruning, keep only this many of the '
+                             'highest-scoring features.')
+    parser.add_argument('--prune-report', dest='prune_report',
+                        action='store_true',
+                        help='Report training time, model size, and '
+                             'accuracy for each pruning method, keeping '
+                             '--keep features, or a range of counts without '
+                             'it.')
+
+    args = parser.parse_args(argv)
+    if args.prune in ('chi2', 'mi') and args.keep is None:
+        parser.error('--prune {} needs --keep.'.format(args.prune))
+    return args
 
 
 def main():
@@ -199,8 +248,18 @@ def main():
         manager.get_tagged_tokens(args.corpus)
     )
     featuresets = [(fs, tag) for (fs, _, tag) in featuresets]
+    print('{} feature sets, {} distinct'.format(
+        len(featuresets), len(weighted_training.dedupe_featuresets(featuresets))
+    ))
     random.shuffle(featuresets)
     test_set, training_set = get_sets(featuresets, args.ratio)
+    if args.prune is not None:
+        keep = feature_pruning.select_features(
+            training_set, args.prune, args.min_count, args.keep,
+        )
+        print('Pruned to {} features'.format(len(keep)))
+        featuresets = feature_pruning.prune_featuresets(featuresets, keep)
+        test_set, training_set = get_sets(featuresets, args.ratio)
 
     classifiers = [
         # nltk.ConditionalExponentialClassifier,
@@ -209,6 +268,14 @@ def main():
         # nltk.NaiveBayesClassifier,
         # nltk.PositiveNaiveBayesClassifier,
     ]
+    if args.prune_report:
+        settings = feature_pruning.report_settings(
+            training_set, args.min_count, args.keep,
+        )
+        for cls in classifiers:
+            feature_pruning.pruning_report(cls, training_set, test_set,
+                                           settings)
+
     folds = itertools.chain.from_iterable(
         cross_validate_sets(cls, featuresets)
         for cls in classifiers
@@ -220,6 +287,10 @@ def main():
 
     means.sort(key=second)
 
+    for (cls, _) in means:
+        evaluate_classifier(weighted_training.train(cls, training_set),
+                            test_set, args.bootstrap)
+
     if not os.path.exists(args.output_dir):
         os.makedirs(args.output_dir)
     if Current.__name__ == 'InternalStyle':
@@ -2,7 +2,6 @@
 # coding: utf-8
 
 import sys
-import codecs
 import os
 import re
 import argparse
@@ -14,6 +13,10 @@ import pandas as pd
 from bokeh.charts import Bar, output_file, save
 import numpy as np
 
+from density import document_densities, location_bin_counts
+import docstore
+import standoff
+
 
 def parse_args(argv=None):
     """This parses the command line."""
@@ -42,49 +45,20 @@ def all_files(dirname):
 
 
 def count_quotation_marks(text):
-    return len(list(re.finditer(r'"', text)))
+    return text.count('"')
 
 
 def count_single_quotation_marks(text):
-    return len(list(re.finditer(r"'", text)))
+    return text.count("'")
 
 
 def read_text(filename):
     """Read in the text from the file; return a processed text."""
-    with codecs.open(filename, 'r', 'utf8') as f:
-        return f.read()
-
-
-def clean_text(input_text):
-    """Clean the text by lowercasing and removing newlines."""
-    return input_text.replace('\n', ' ').lower()
+    return docstore.read_text(filename)
 
 
 def clean_and_read_text(input_text):
-    return clean_text(read_text(input_text))
-
-
-def find_carets(text):
-    """returns regex matches for the carets in the corpus."""
-    return list(re.finditer(r'\^', text))
-
-
-def find_quote_characters(text):
-    """returns matches for quote characters only."""
-    if count_quotation_marks(text) < count_single_quotation_marks(text):
-        return list(re.finditer(r'\'', text))
-    else:
-        return list(re.finditer(r'\"', text))
-
-
-def find_quoted_quotes(text):
-    """This returns the regex matches from finding the quoted
-    quotes. Note: if the number of quotation marks is less than fifty
-    it assumes that single quotes are used to designate dialogue."""
-    if count_quotation_marks(text) < count_single_quotation_marks(text):
-        return list(re.finditer(r'(?<!\w)\'.+?\'(?!\w)', text))
-    else:
-        return list(re.finditer(r'"[^"]+"', text))
+    return docstore.clean_and_read_text(input_text)
 
 
 def all_bokeh_graphs(args, marked_corpus, unmarked_corpus,
@@ -98,37 +72,19 @@ def single_bokeh_graph(args, marked_fn, unmarked_corpus,
                        token='compare', bin_count=400):
 
     print(marked_fn)
-    unmarked_fn = os.path.basename(marked_fn)
-    unmarked_text = clean_and_read_text(args.unmarked_corpus_folder +
-                                        '/' + unmarked_fn)
-    text = clean_and_read_text(marked_fn)
-    if token == 'compare':
-        # assumes that you've passed a True, so you're
-        # trying to graph comparatively.
-        locations, quote_n, bins = find_bin_counts(
-            find_quote_characters(unmarked_text), bin_count)
-        _, caret_n, _ = find_bin_counts(find_carets(text), bin_count)
-        n = quote_n - caret_n
-    elif token == 'caret':
-        locations, n, bins = find_bin_counts(find_carets(text), bin_count)
-    else:
-        locations, n, bins = find_bin_counts(
-            find_quoted_quotes(unmarked_text), bin_count)
+    (n, _) = location_bin_counts(
+        document_densities(marked_fn, args.unmarked_corpus_folder), token,
+        bin_count,
+    )
     d_frame = pd.DataFrame(n, columns=['count'])
     output_file('bokeh_graphs/' + re.sub(r'\.txt', '',
-                os.path.basename(marked_fn)) + '.html')
+                os.path.basename(standoff.source_name(marked_fn))) + '.html')
     p = Bar(d_frame, legend=False, plot_width=1200)
     p.xaxis.visible = False
     p.xgrid.visible = False
     save(p)
 
 
-def find_bin_counts(matches, bin_count):
-        locations = [m.start() for m in matches]
-        n, bins = np.histogram(locations, bin_count)
-        return locations, n, bins
-
-
 def create_location_histogram(args, marked_corpus, unmarked_corpus,
                               token, bin_count=500):
     """\
@@ -138,24 +94,10 @@ def create_location_histogram(args, marked_corpus, unmarked_corpus,
     fig, axes = plt.subplots(len(marked_corpus), 1, squeeze=True)
     fig.set_figheight(9.4)
     for (marked_fn, ax) in zip(marked_corpus, axes):
-        unmarked_fn = os.path.basename(marked_fn)
-        unmarked_text = clean_and_read_text(args.unmarked_corpus_folder +
-                                            '/' + unmarked_fn)
-        text = clean_and_read_text(marked_fn)
-        if token == 'compare':
-            # assumes that you've passed a True, so you're
-            # trying to graph comparatively.
-            locations, quote_n, bins = find_bin_counts(
-                find_quote_characters(unmarked_text), bin_count)
-            _, caret_n, _ = find_bin_counts(find_carets(text), bin_count)
-            n = quote_n - caret_n
-        elif token == 'caret':
-
-            locations, n, bins = find_bin_counts(find_carets(text), bin_count)
-
-        else:
-            locations, n, bins = find_bin_counts(
-                find_quoted_quotes(unmarked_text), bin_count)
+        (n, bins) = location_bin_counts(
+            document_densities(marked_fn, args.unmarked_corpus_folder),
+            token, bin_count,
+        )
 
         # fig.suptitle(marked_fn, fontsize=14, fontweight='bold')
         left = np.array(bins[:-1])
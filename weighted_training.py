@@ -0,0 +1,247 @@
+"""\
+This collapses duplicate (feature set, label) pairs into weighted instances
+before training. Short replies and "said Mrs. Ramsay" fragments produce the
+same InternalStyle feature sets over and over, and QuotePoint windows repeat
+even more.
+
+The trainers here are weighted versions of NLTK's NaiveBayesClassifier and
+DecisionTreeClassifier training. They follow NLTK's algorithms step for step,
+including how ties are broken, so they build exactly the same classifiers as
+training on the original, duplicated feature sets.
+"""
+
+
+from collections import defaultdict, OrderedDict
+
+import nltk
+from nltk.probability import ELEProbDist, FreqDist, MLEProbDist, entropy
+
+
+def dedupe_featuresets(labeled_featuresets):
+    """\
+    This collapses identical (feature set, label) pairs and returns a list of
+    (feature set, label, weight, last) tuples, in the order that each pair
+    first appeared. `last` is the position where the pair last appeared.
+    """
+    weights = OrderedDict()
+    featuresets = {}
+    last = {}
+    for (i, (featureset, label)) in enumerate(labeled_featuresets):
+        key = (frozenset(featureset.items()), label)
+        if key in weights:
+            weights[key] += 1
+        else:
+            weights[key] = 1
+            featuresets[key] = featureset
+        last[key] = i
+    return [(featuresets[key], key[1], weight, last[key])
+            for (key, weight) in weights.items()]
+
+
+def label_freqs(weighted):
+    """This returns a FreqDist of the weighted labels."""
+    freqs = FreqDist()
+    for (_, label, weight, _) in weighted:
+        freqs[label] += weight
+    return freqs
+
+
+def total_weight(weighted):
+    return sum(weight for (_, _, weight, _) in weighted)
+
+
+def last_label(weighted):
+    """\
+    This returns the label of the last original instance. NLTK's stumps
+    reuse `label` as their loop variable, so that's the label they end up
+    with, and the weighted trainers need it to build the same trees.
+    """
+    return max(weighted, key=lambda instance: instance[3])[1]
+
+
+def train_naive_bayes(weighted, estimator=ELEProbDist):
+    """This is `NaiveBayesClassifier.train` over weighted instances."""
+    label_freqdist = FreqDist()
+    feature_freqdist = defaultdict(FreqDist)
+    feature_values = defaultdict(set)
+    fnames = set()
+
+    for (featureset, label, weight, _) in weighted:
+        label_freqdist[label] += weight
+        for (fname, fval) in featureset.items():
+            feature_freqdist[label, fname][fval] += weight
+            feature_values[fname].add(fval)
+            fnames.add(fname)
+
+    for label in label_freqdist:
+        num_samples = label_freqdist[label]
+        for fname in fnames:
+            count = feature_freqdist[label, fname].N()
+            if num_samples - count > 0:
+                feature_freqdist[label, fname][None] += num_samples - count
+                feature_values[fname].add(None)
+
+    label_probdist = estimator(label_freqdist)
+    feature_probdist = {}
+    for ((label, fname), freqdist) in feature_freqdist.items():
+        probdist = estimator(freqdist, bins=len(feature_values[fname]))
+        feature_probdist[label, fname] = probdist
+
+    return nltk.NaiveBayesClassifier(label_probdist, feature_probdist)
+
+
+def value_freqs(fname, weighted):
+    """This returns the weighted label FreqDist for each value of fname."""
+    freqs = defaultdict(FreqDist)
+    for (featureset, label, weight, _) in weighted:
+        freqs[featureset.get(fname)][label] += weight
+    return freqs
+
+
+def binary_freqs(fname, fval, weighted):
+    """\
+    This returns the weighted label FreqDists for the instances where fname
+    is fval and where it isn't.
+    """
+    pos_fdist = FreqDist()
+    neg_fdist = FreqDist()
+    for (featureset, label, weight, _) in weighted:
+        if featureset.get(fname) == fval:
+            pos_fdist[label] += weight
+        else:
+            neg_fdist[label] += weight
+    return (pos_fdist, neg_fdist)
+
+
+def best_count(freqs):
+    """This returns the weight of the most common label, or 0."""
+    return freqs[freqs.max()] if freqs.N() > 0 else 0
+
+
+def leaf(weighted):
+    return nltk.DecisionTreeClassifier(label_freqs(weighted).max())
+
+
+def best_stump(feature_names, weighted):
+    """\
+    This is `DecisionTreeClassifier.best_stump` over weighted instances. A
+    stump labels every value with its most common label, so its error can be
+    read straight off the value FreqDists without classifying anything.
+    """
+    total = total_weight(weighted)
+    best_fname = None
+    best_error = (total - best_count(label_freqs(weighted))) / total
+    best_freqs = None
+    for fname in feature_names:
+        freqs = value_freqs(fname, weighted)
+        correct = sum(best_count(fdist) for fdist in freqs.values())
+        error = (total - correct) / total
+        if error < best_error:
+            best_error = error
+            best_fname = fname
+            best_freqs = freqs
+
+    if best_fname is None:
+        return leaf(weighted)
+    decisions = dict((val, nltk.DecisionTreeClassifier(best_freqs[val].max()))
+                     for val in best_freqs)
+    return nltk.DecisionTreeClassifier(last_label(weighted), best_fname,
+                                       decisions)
+
+
+def best_binary_stump(feature_names, weighted, feature_values):
+    """This is `DecisionTreeClassifier.best_binary_stump` over weighted
+    instances."""
+    total = total_weight(weighted)
+    best_error = (total - best_count(label_freqs(weighted))) / total
+    best = None
+    for fname in feature_names:
+        for fval in feature_values[fname]:
+            (pos_fdist, neg_fdist) = binary_freqs(fname, fval, weighted)
+            correct = best_count(pos_fdist) + best_count(neg_fdist)
+            error = (total - correct) / total
+            if error < best_error:
+                best_error = error
+                best = (fname, fval, pos_fdist, neg_fdist)
+
+    if best is None:
+        return leaf(weighted)
+    (fname, fval, pos_fdist, neg_fdist) = best
+    label = last_label(weighted)
+    decisions = {}
+    default = label
+    if pos_fdist.N() > 0:
+        decisions = {fval: nltk.DecisionTreeClassifier(pos_fdist.max())}
+    if neg_fdist.N() > 0:
+        default = nltk.DecisionTreeClassifier(neg_fdist.max())
+    return nltk.DecisionTreeClassifier(label, fname, decisions, default)
+
+
+def refine(tree, weighted, entropy_cutoff, depth_cutoff, support_cutoff,
+           binary, feature_values):
+    """This is `DecisionTreeClassifier.refine` over weighted instances."""
+    if total_weight(weighted) <= support_cutoff:
+        return
+    if tree._fname is None:
+        return
+    if depth_cutoff <= 0:
+        return
+    for fval in tree._decisions:
+        fval_weighted = [instance for instance in weighted
+                         if instance[0].get(tree._fname) == fval]
+        if entropy(MLEProbDist(label_freqs(fval_weighted))) > entropy_cutoff:
+            tree._decisions[fval] = train_decision_tree(
+                fval_weighted, entropy_cutoff, depth_cutoff, support_cutoff,
+                binary, feature_values,
+            )
+    if tree._default is not None:
+        default_weighted = [instance for instance in weighted
+                            if instance[0].get(tree._fname)
+                            not in tree._decisions]
+        if entropy(MLEProbDist(label_freqs(default_weighted))) > entropy_cutoff:
+            tree._default = train_decision_tree(
+                default_weighted, entropy_cutoff, depth_cutoff,
+                support_cutoff, binary, feature_values,
+            )
+
+
+def train_decision_tree(weighted, entropy_cutoff=0.05, depth_cutoff=100,
+                        support_cutoff=10, binary=False, feature_values=None):
+    """This is `DecisionTreeClassifier.train` over weighted instances."""
+    feature_names = set()
+    for (featureset, _, _, _) in weighted:
+        for fname in featureset:
+            feature_names.add(fname)
+
+    if feature_values is None and binary:
+        feature_values = defaultdict(set)
+        for (featureset, _, _, _) in weighted:
+            for (fname, fval) in featureset.items():
+                feature_values[fname].add(fval)
+
+    if not binary:
+        tree = best_stump(feature_names, weighted)
+    else:
+        tree = best_binary_stump(feature_names, weighted, feature_values)
+
+    refine(tree, weighted, entropy_cutoff, depth_cutoff - 1, support_cutoff,
+           binary, feature_values)
+    return tree
+
+
+TRAINERS = {
+    nltk.NaiveBayesClassifier: train_naive_bayes,
+    nltk.DecisionTreeClassifier: train_decision_tree,
+}
+
+
+def train(cls, labeled_featuresets):
+    """\
+    This trains a classifier of class `cls` on the deduplicated, weighted
+    feature sets. Classes without a weighted trainer get the original
+    feature sets.
+    """
+    trainer = TRAINERS.get(cls)
+    if trainer is None:
+        return cls.train(labeled_featuresets)
+    return trainer(dedupe_featuresets(labeled_featuresets))